@@ -0,0 +1,153 @@
+"""
+Arrow opslag en vergelijking.
+
+Alle kolommen worden als Arrow string arrays (dtype 'string[pyarrow]') bewaard. De
+vergelijking gebruikt de compute kernels van pyarrow voor de gelijkheid per kolom,
+zodat er geen Python string objecten per cel gemaakt worden.
+"""
+
+import numpy as np
+import pandas as pd
+from pandas._libs.parsers import STR_NA_VALUES
+
+from inlezen import NA_WAARDEN, met_quarantaine
+from verschillen import ALLEEN_A, ALLEEN_B, Verschillen, waarde_verschillen
+
+try:
+    import pyarrow as pa
+    import pyarrow.compute as pc
+    import pyarrow.csv as pa_csv
+except ImportError:
+    pa = None
+
+ARROW_STRING = "string[pyarrow]"
+
+
+def controleer_pyarrow():
+    """Geef een duidelijke foutmelding als pyarrow niet geïnstalleerd is."""
+    if pa is None:
+        raise ValueError("Voor de Arrow opslag is het package 'pyarrow' nodig")
+
+
+def _is_arrow_dtype(dtype):
+    return isinstance(dtype, pd.StringDtype) and dtype.storage == "pyarrow"
+
+
+def is_arrow_kolom(serie):
+    """Controleer of een kolom Arrow strings bevat."""
+    return _is_arrow_dtype(serie.dtype)
+
+
+def is_arrow(df):
+    """Controleer of alle kolommen van een DataFrame Arrow strings zijn."""
+    return len(df.columns) > 0 and all(_is_arrow_dtype(dtype) for dtype in df.dtypes)
+
+
+def naar_arrow(df):
+    """Zet alle kolommen om naar Arrow strings, met '' voor lege waarden."""
+    controleer_pyarrow()
+    return df.astype(ARROW_STRING).fillna('')
+
+
+def _naar_pandas(tabel):
+    """Zet een pyarrow tabel om naar een DataFrame met Arrow string kolommen."""
+    return tabel.to_pandas(types_mapper={pa.string(): pd.StringDtype("pyarrow")}.get)
+
+
+def lees_csv_arrow(bron, separator, headers, nrows=None, kies=None):
+    """
+    Lees een CSV direct in als Arrow tabel met de CSV lezer van pyarrow. `bron` is
+    bytes, een pad of een (gedecomprimeerde) stroom. De kopregel wordt overgeslagen
+    en het lezen stopt zodra `nrows` rijen gelezen zijn. Met `kies` wordt per batch
+    alleen de selectie bewaard. Ongeldige regels worden net als in inlezen.py opnieuw
+    gelezen en in df.attrs['quarantaine'] gezet.
+    """
+    controleer_pyarrow()
+    if isinstance(bron, str):
+        bron = pa.memory_map(bron)
+    elif isinstance(bron, (bytes, bytearray, memoryview)) or hasattr(bron, 'size'):
+        bron = pa.BufferReader(pa.py_buffer(bron))
+
+    overgeslagen = []
+
+    def ongeldige_rij(rij):
+        # Sla de rij over en lees hem na afloop opnieuw met de tolerante parser
+        overgeslagen.append((rij.number, rij.text))
+        return 'skip'
+
+    lezer = pa_csv.open_csv(
+        bron,
+        read_options=pa_csv.ReadOptions(column_names=headers, skip_rows=1),
+        parse_options=pa_csv.ParseOptions(delimiter=separator, quote_char='"',
+                                          newlines_in_values=True,
+                                          invalid_row_handler=ongeldige_rij),
+        convert_options=pa_csv.ConvertOptions(column_types={h: pa.string() for h in headers},
+                                              null_values=sorted(set(NA_WAARDEN) | STR_NA_VALUES),
+                                              strings_can_be_null=True),
+    )
+    batches = []
+    aantal = 0
+    for batch in lezer:
+        if kies is not None:
+            batch = batch.filter(pa.array(kies(_naar_pandas(pa.Table.from_batches([batch])))))
+        batches.append(batch)
+        aantal += batch.num_rows
+        if nrows is not None and aantal >= nrows:
+            break
+    tabel = pa.Table.from_batches(batches, schema=lezer.schema)
+    if nrows is not None:
+        tabel = tabel.slice(0, nrows)
+    return met_quarantaine(_naar_pandas(tabel), overgeslagen, separator, headers, kies, nrows)
+
+
+def _kolom(serie):
+    """Geef de Arrow data van een kolom, met '' voor lege waarden."""
+    return pc.fill_null(pa.array(serie.array), '')
+
+
+def arrow_verschil(serie_a, serie_b, positie_a, positie_b):
+    """Het masker met de afwijkende paren van twee Arrow kolommen, met de Arrow kernels."""
+    waarde_a = _kolom(serie_a).take(positie_a)
+    waarde_b = _kolom(serie_b).take(positie_b)
+    return pc.not_equal(waarde_a, waarde_b).to_numpy(zero_copy_only=False)
+
+
+def vergelijk_arrow(df_a, df_b, key_columns):
+    """
+    Vergelijk twee DataFrames met Arrow string kolommen. Het resultaat bevat dezelfde
+    verschillen in dezelfde volgorde als vergelijk_data.
+    """
+    controleer_pyarrow()
+    if not is_arrow(df_a):
+        df_a = naar_arrow(df_a)
+    if not is_arrow(df_b):
+        df_b = naar_arrow(df_b)
+
+    # Koppel alleen de sleutels, met de positie van de rij in A en B
+    paren = pd.merge(
+        df_a[key_columns].assign(_positie_a=np.arange(len(df_a))),
+        df_b[key_columns].assign(_positie_b=np.arange(len(df_b))),
+        on=key_columns,
+        how='outer'
+    )
+    positie_a = paren['_positie_a'].fillna(-1).to_numpy(dtype=np.int64)
+    positie_b = paren['_positie_b'].fillna(-1).to_numpy(dtype=np.int64)
+    alleen_a = positie_b < 0
+    alleen_b = positie_a < 0
+    beide = ~alleen_a & ~alleen_b
+
+    delen = [
+        (ALLEEN_A, -1, positie_a[alleen_a], positie_b[alleen_a]),
+        (ALLEEN_B, -1, positie_a[alleen_b], positie_b[alleen_b]),
+    ]
+
+    # Verschillen in waarden voor overeenkomende rijen, met de Arrow kernels
+    positie_a = positie_a[beide]
+    positie_b = positie_b[beide]
+    indices_a = pa.array(positie_a)
+    indices_b = pa.array(positie_b)
+    vergelijk_kolommen = [col for col in df_a.columns if col not in key_columns and col in df_b.columns]
+    delen += waarde_verschillen(vergelijk_kolommen, positie_a, positie_b,
+                                lambda col: arrow_verschil(df_a[col], df_b[col], indices_a, indices_b))
+
+    return Verschillen.uit_delen(df_a, df_b, key_columns, vergelijk_kolommen, delen)
@@ -0,0 +1,127 @@
+"""
+Basislijnen: opgeslagen bronnen voor terugkerende vergelijkingen.
+
+Een basislijn is een ingelezen bron die op de lokale schijf bewaard wordt, samen met
+een index: een hash per rij over alle kolommen en een hash per sleutel. Bij de
+dagelijkse vergelijking van een nieuw extract met dat van gisteren hoeft alleen het
+nieuwe bestand ingelezen te worden. Rijen waarvan de hash in beide bronnen voorkomt
+zijn ongewijzigd en worden vóór de vergelijking weggelaten.
+"""
+import os
+import re
+import time
+
+import numpy as np
+import pandas as pd
+
+from vingerafdruk import sleutel_hashes
+
+# Map waarin de basislijnen bewaard worden
+BASISLIJN_MAP = os.environ.get(
+    'DATA_VERGELIJKER_BASISLIJNEN',
+    os.path.join(os.path.expanduser('~'), '.data_vergelijker', 'basislijnen')
+)
+
+_DATA = 'data.pkl'
+_INDEX = 'index.pkl'
+
+
+def _map(naam):
+    """De map van een basislijn; de naam mag geen pad zijn."""
+    naam = naam.strip()
+    if not naam or naam in ('.', '..') or os.sep in naam or (os.altsep and os.altsep in naam):
+        raise ValueError("Ongeldige naam voor een basislijn")
+    return os.path.join(BASISLIJN_MAP, naam)
+
+
+def standaard_naam(bestandsnaam):
+    """Een naam voor de basislijn uit de bestandsnaam, zonder extensie en datum/tijd."""
+    naam = os.path.basename(bestandsnaam).split('.')[0]
+    return re.sub(r'[_-]?\d{8}([_-]?\d{4,6})?$', '', naam) or naam
+
+
+def basislijnen():
+    """De namen van alle opgeslagen basislijnen."""
+    if not os.path.isdir(BASISLIJN_MAP):
+        return []
+    return sorted(naam for naam in os.listdir(BASISLIJN_MAP)
+                  if os.path.isfile(os.path.join(BASISLIJN_MAP, naam, _INDEX)))
+
+
+def rij_hashes(df):
+    """Hash per rij over alle kolommen, onafhankelijk van de volgorde van de kolommen."""
+    return sleutel_hashes(df, sorted(df.columns))
+
+
+def registreer_basislijn(naam, df, key_columns, bron=None):
+    """
+    Bewaar een bron als basislijn. Een bestaande basislijn met dezelfde naam wordt
+    vervangen; de bestanden worden eerst volledig geschreven en dan pas verwisseld.
+    """
+    map_ = _map(naam)
+    os.makedirs(map_, exist_ok=True)
+    sleutels = sleutel_hashes(df, key_columns)
+    index = {
+        'bron': bron,
+        'geregistreerd': time.strftime('%Y-%m-%d %H:%M'),
+        'rijen': len(df),
+        'kolommen': list(df.columns),
+        'rij_hashes': rij_hashes(df),
+        'key_columns': list(key_columns),
+        'sleutel_hashes': sleutels,
+        'sleutels_uniek': len(np.unique(sleutels)) == len(sleutels),
+    }
+    # attrs (zoals de cachesleutel) horen bij deze sessie en worden niet opgeslagen
+    df = df.copy(deep=False)
+    df.attrs = {}
+    for bestand, inhoud in [(_DATA, df), (_INDEX, index)]:
+        tijdelijk = os.path.join(map_, bestand + '.tmp')
+        pd.to_pickle(inhoud, tijdelijk)
+        os.replace(tijdelijk, os.path.join(map_, bestand))
+
+
+def versie(naam):
+    """De versie van een basislijn (wijzigingstijd van de index), voor de cache."""
+    return os.stat(os.path.join(_map(naam), _INDEX)).st_mtime_ns
+
+
+def laad_basislijn(naam):
+    """De opgeslagen data van een basislijn, zonder het oorspronkelijke bestand opnieuw in te lezen."""
+    return pd.read_pickle(os.path.join(_map(naam), _DATA))
+
+
+def laad_index(naam):
+    """De index van een basislijn: rij-hashes, sleutel-hashes en gegevens over de bron."""
+    return pd.read_pickle(os.path.join(_map(naam), _INDEX))
+
+
+def verwijder_gelijke_rijen(df_basis, index, df_nieuw, key_columns):
+    """
+    Laat de rijen weg die in de basislijn en de nieuwe bron precies gelijk zijn. Dat
+    kan alleen als beide bronnen dezelfde kolommen hebben en de sleutels uniek zijn;
+    anders worden de bronnen ongewijzigd teruggegeven.
+    """
+    if set(df_nieuw.columns) != set(index['kolommen']) or not key_columns:
+        return df_basis, df_nieuw
+
+    if list(key_columns) == index['key_columns']:
+        basis_uniek = index['sleutels_uniek']
+    else:
+        sleutels = sleutel_hashes(df_basis, key_columns)
+        basis_uniek = len(np.unique(sleutels)) == len(sleutels)
+    sleutels_nieuw = sleutel_hashes(df_nieuw, key_columns)
+    if not basis_uniek or len(np.unique(sleutels_nieuw)) < len(sleutels_nieuw):
+        return df_basis, df_nieuw
+
+    hashes_nieuw = rij_hashes(df_nieuw)
+    gewijzigd_basis = ~np.isin(index['rij_hashes'], hashes_nieuw)
+    gewijzigd_nieuw = ~np.isin(hashes_nieuw, index['rij_hashes'])
+
+    # De gefilterde bronnen krijgen een eigen cachesleutel
+    bron = (df_basis.attrs.get('sleutel'), df_nieuw.attrs.get('sleutel'))
+    resultaat = []
+    for df, gewijzigd, kant in [(df_basis, gewijzigd_basis, 'A'), (df_nieuw, gewijzigd_nieuw, 'B')]:
+        df = df[gewijzigd]
+        df.attrs = {'sleutel': None if None in bron else ('gewijzigd', kant) + bron + (tuple(key_columns),)}
+        resultaat.append(df)
+    return tuple(resultaat)
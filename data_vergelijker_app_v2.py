@@ -3,6 +3,64 @@ import pandas as pd
 import logging
 import io
 import csv
+import os
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import closing
+from functools import partial
+
+from inlezen import (
+    BESTANDSTYPEN,
+    COMPRESSIE_TYPEN,
+    HERSTELD,
+    ServerBestand,
+    bron_sleutel,
+    einde_eerste_record,
+    excel_bladen,
+    excel_kop,
+    is_leeg,
+    lees_begin_stroom,
+    lees_csv,
+    lees_csv_stroom,
+    lees_excel,
+    open_excel,
+    open_gedecomprimeerd,
+    open_server_bestand,
+    quarantaine_tabel,
+    toegestane_mappen,
+    uitgepakte_grootte,
+    zip_leden,
+)
+from arrow_engine import is_arrow, lees_csv_arrow, naar_arrow, vergelijk_arrow
+from basislijn import (
+    basislijnen,
+    laad_basislijn,
+    laad_index,
+    registreer_basislijn,
+    standaard_naam,
+    verwijder_gelijke_rijen,
+    versie,
+)
+from duckdb_engine import vergelijk_duckdb
+from gedeeld import GedeeldeOpslag, SessieCache
+from kolomkoppeling import stel_koppeling_voor
+from opslag import comprimeer, deel_dictionary, geheugen_mb
+from pijplijn import (
+    StadiumCache,
+    kolom_verschil,
+    rij_labels,
+    sleutel_index,
+    sleutel_van,
+    stadium,
+    uitlijning,
+    verschillen_uit_paren,
+)
+from profielen import bewaar_profiel, laad_profiel, profielen
+from raming import GEHEUGEN_BUDGET_MB, duckdb_limiet_mb, kies_engine, raming_inlezen, raming_vergelijking
+from regels import EXACT, REGELS, regels_sleutel
+from schets import MIN_OVERLAP, schat_koppeling, schets_sleutel, sleutelkandidaten, steekproef
+from vaag import KOLOMMEN as VAAG_KOLOMMEN, MIN_BETROUWBAARHEID, koppel_vaag
+from verschillen import PAGINA_GROOTTE, Verschillen
+from vingerafdruk import in_steekproef, vingerafdrukken
 
 # Pagina configuratie voor volledig scherm (moet als eerste Streamlit commando zijn)
 st.set_page_config(layout="wide")
@@ -44,54 +102,211 @@ st.markdown("""
     </style>
 """, unsafe_allow_html=True)
 
-def load_input(label):
-    # Voeg een slider toe voor het aantal rijen
-    max_rows = st.slider(
-        f"Maximaal aantal rijen voor {label}",
-        min_value=1000,
-        max_value=1000000,
-        value=100000,
-        step=1000,
-        help="Beperk het aantal rijen om de vergelijking sneller te maken. Kies een lagere waarde voor grote bestanden."
+def schoon_op(df, opslag):
+    """
+    Maak een ingelezen DataFrame klaar voor de vergelijking: lege waarden als '',
+    kolomnamen zonder witruimte en alle waarden als string.
+    """
+    # Vervang NaN waarden door lege string
+    df = df.fillna('')
+    
+    # Verwijder witruimte uit kolomnamen
+    df.columns = df.columns.str.strip()
+    
+    if opslag == "Arrow":
+        # Houd alle kolommen als Arrow strings
+        df = naar_arrow(df)
+    else:
+        # Converteer alle waarden naar strings en verwijder categorische data
+        for col in df.columns:
+            df[col] = df[col].apply(lambda x: str(x) if pd.notnull(x) else '')
+    return df
+
+def comprimeer_bron(df):
+    """
+    Comprimeer een bron en onthoud het geheugengebruik voor en na in df.attrs.
+    """
+    gecomprimeerd = comprimeer(df)
+    gecomprimeerd.attrs['geheugen_mb'] = (geheugen_mb(df), geheugen_mb(gecomprimeerd))
+    return gecomprimeerd
+
+def omvang(max_rows, kies):
+    """Het deel van een bestand dat ingelezen wordt, voor de cachesleutel."""
+    if kies is not None:
+        return ('steekproef', kies.keywords['fractie'], kies.keywords['key_columns'])
+    return ('rijen', max_rows)
+
+def omvang_instellingen(label, max_rows, instellingen):
+    """Het aantal rijen en de sleutel van de steekproef, om in een profiel op te slaan."""
+    return {
+        'max_rows': max_rows or instellingen.get('max_rows', 100000),
+        'steekproef_sleutels': st.session_state.get(f"steekproef_sleutels_{label}",
+                                                    instellingen.get('steekproef_sleutels', [])),
+    }
+
+def kies_steekproef(label, kolommen, instellingen, fractie):
+    """
+    Laat de sleutel voor de steekproef kiezen en geef de functie die per blok de rijen
+    in de steekproef aanwijst (None zolang er geen sleutel gekozen is).
+    """
+    sleutels = st.multiselect(
+        f"Sleutel voor de steekproef van {label}",
+        options=kolommen,
+        default=[col for col in instellingen.get('steekproef_sleutels', []) if col in kolommen],
+        key=f"steekproef_sleutels_{label}",
+        help="Kies dezelfde sleutel als voor de vergelijking; dan bevatten alle bronnen dezelfde sleutels."
     )
+    if not sleutels:
+        st.info(f"Kies de sleutel voor de steekproef van {label}")
+        return None
+    return partial(in_steekproef, key_columns=tuple(sleutels), fractie=fractie)
+
+def toon_raming_inlezen(label, rijen, raming, opslag):
+    """
+    Toon de raming van het inlezen per opslag. Heeft de gekozen opslag meer dan de helft
+    van het geheugenbudget nodig (de andere helft is voor de andere bron en de
+    vergelijking), dan wordt pas ingelezen als de gebruiker dat bevestigt. Retourneert
+    of er ingelezen mag worden.
+    """
+    budget = GEHEUGEN_BUDGET_MB / 2
+    geheugen, looptijd = raming.loc[opslag, 'Geheugen (MB)'], raming.loc[opslag, 'Looptijd (s)']
+    st.caption(f"Raming voor {label}: ongeveer {int(rijen):,} rijen, {geheugen:,.0f} MB en {looptijd:,.0f} s "
+               f"met opslag {opslag}")
+    if geheugen > budget:
+        passend = [naam for naam in raming.index if raming.loc[naam, 'Geheugen (MB)'] <= budget]
+        st.warning(f"{label} heeft naar verwachting meer geheugen nodig dan beschikbaar ({budget:,.0f} MB). "
+                   f"Lees hooguit ongeveer {int(rijen * budget / geheugen):,} rijen in, gebruik een steekproef op "
+                   "sleutel" + (f" of kies opslag {' of '.join(passend)}" if passend else "") + ".")
+    with st.expander(f"Raming per opslag voor {label}"):
+        st.dataframe(raming.round(1), use_container_width=True)
+    if geheugen > budget and not st.checkbox(f"{label} toch volledig inlezen", key=f"toch_inlezen_{label}",
+                                             help="Het proces kan dan te weinig geheugen krijgen en stoppen"):
+        return False
+    return True
+
+def toon_quarantaine(label, quarantaine):
+    """Meld de ongeldige regels: hoeveel er hersteld en afgewezen zijn en waarom, met de lijst."""
+    tabel = quarantaine_tabel(quarantaine)
+    hersteld = int((tabel['Status'] == HERSTELD).sum())
+    redenen = tabel['Reden'].str.replace(r' \(.*\)', '', regex=True).value_counts()
+    st.warning(f"{label}: {len(tabel)} ongeldige regels. {hersteld} hersteld, {len(tabel) - hersteld} "
+               f"afgewezen (niet ingelezen). " + ", ".join(f"{reden}: {aantal}" for reden, aantal in redenen.items()))
+    with st.expander(f"Ongeldige regels van {label}"):
+        st.dataframe(tabel, use_container_width=True)
+
+def kolomnamen(kop, separator):
+    """
+    De kolomnamen uit de kopregel en of de kopregel numeriek is (geen echte kolomnamen);
+    dan worden de namen Kolom_0, Kolom_1, enzovoort.
+    """
+    # Gebruik csv.reader om correct met quotes en scheidingstekens om te gaan
+    headers = next(csv.reader(io.StringIO(kop), delimiter=separator), [])
+    try:
+        [int(h) for h in headers]
+        return [f"Kolom_{i}" for i in range(len(headers))], True
+    except ValueError:
+        # Er zijn echte kolomnamen
+        return [h.strip().strip('"').strip("'") for h in headers], False
+
+def load_input(label, opslag="Standaard", instellingen=None, steekproef=None):
+    # Instellingen voor het inlezen uit een vergelijkingsprofiel
+    instellingen = instellingen or {}
     
-    file = st.file_uploader(f"Upload bestand voor {label}", type=["csv", "xls", "xlsx"], key=f"file_uploader_{label}")
+    # Bij een steekproef op sleutel bepaalt de fractie het aantal rijen
+    max_rows = None
+    if steekproef is None:
+        # Voeg een slider toe voor het aantal rijen
+        max_rows = st.slider(
+            f"Maximaal aantal rijen voor {label}",
+            min_value=1000,
+            max_value=1000000,
+            value=instellingen.get('max_rows', 100000),
+            step=1000,
+            help="Beperk het aantal rijen om de vergelijking sneller te maken. Kies een lagere waarde voor grote bestanden."
+        )
+    
+    # Kies tussen uploaden en een bestand dat al op de server staat
+    invoer = "Upload"
+    if toegestane_mappen():
+        invoer = st.radio(
+            f"Invoer voor {label}",
+            ["Upload", "Pad op server"],
+            horizontal=True,
+            key=f"invoer_{label}",
+            help="Met 'Pad op server' wordt het bestand direct vanaf de schijf gelezen, zonder uploadlimiet."
+        )
+    
+    if invoer == "Pad op server":
+        pad = st.text_input(
+            f"Pad naar bestand voor {label}",
+            key=f"pad_{label}",
+            help=f"Toegestane mappen: {', '.join(toegestane_mappen())}"
+        )
+        file = None
+        if pad:
+            try:
+                file = open_server_bestand(pad)
+            except ValueError as e:
+                st.error(str(e))
+                return None
+    else:
+        file = st.file_uploader(f"Upload bestand voor {label}", type=BESTANDSTYPEN, key=f"file_uploader_{label}")
     if file:
         try:
             # Bepaal het bestandstype op basis van de extensie
             file_extension = file.name.split('.')[-1].lower()
             
-            if file_extension == 'csv':
-                # Lees de eerste regel om te bepalen of er kolomnamen zijn
-                content = file.read().decode('utf-8')
-                file.seek(0)
+            if file_extension == 'csv' or file_extension in COMPRESSIE_TYPEN:
+                if file_extension in COMPRESSIE_TYPEN:
+                    # Gecomprimeerd bestand: lees alleen het begin voor de kopregel, de rest
+                    # wordt straks als stroom aan de parser gegeven
+                    bron = getattr(file, 'pad', file)
+                    lid = None
+                    if file_extension == 'zip':
+                        leden = zip_leden(bron)
+                        if not leden:
+                            st.error("Het zip-bestand bevat geen CSV bestand")
+                            return None
+                        lid = leden[0]
+                        if len(leden) > 1:
+                            lid = st.selectbox(f"Bestand in zip voor {label}", leden, key=f"zip_lid_{label}")
+                    with open_gedecomprimeerd(bron, file_extension, lid) as stroom:
+                        data = lees_begin_stroom(stroom)
+                else:
+                    # Lees de ruwe bytes (of mmap bij een bestand op de server); decodeer alleen
+                    # de kopregel zodat grote bestanden niet als één grote string in het geheugen komen
+                    data = file.getvalue()
+                    lid = None
                 
                 # Controleer of het bestand leeg is
-                if not content.strip():
+                if is_leeg(data):
                     st.error("Het bestand is leeg")
                     return None
                 
-                # Detecteer het scheidingsteken (comma of semicolon)
-                first_line = content.split('\n')[0]
+                kop_eind = einde_eerste_record(data)
+                kop = data[:kop_eind].decode('utf-8')
+                first_line = kop.split('\n')[0]
                 if not first_line.strip():
                     st.error("Het bestand bevat geen data")
                     return None
-                    
-                separator = ';' if ';' in first_line else ','
-                
-                # Gebruik csv.reader om correct met quotes en scheidingstekens om te gaan
-                csv_reader = csv.reader(io.StringIO(content), delimiter=separator)
-                headers = next(csv_reader)  # Eerste rij zijn de kolomnamen
                 
-                # Controleer of de headers numeriek zijn (geen echte kolomnamen)
-                try:
-                    [int(h) for h in headers]
-                    st.warning("Geen kolomnamen gevonden, gebruik numerieke kolomnamen")
-                    # Maak betekenisvolle kolomnamen
-                    headers = [f"Kolom_{i}" for i in range(len(headers))]
-                except ValueError:
-                    # Er zijn echte kolomnamen
-                    headers = [h.strip().strip('"').strip("'") for h in headers]
+                profiel_separator = instellingen.get('separator')
+                profiel_headers = list(instellingen.get('headers') or [])
+                if profiel_separator and profiel_headers and \
+                        kolomnamen(kop, profiel_separator)[0] == profiel_headers:
+                    # Het profiel kent het scheidingsteken en de kolomnamen van deze feed al
+                    separator = profiel_separator
+                    headers = profiel_headers
+                else:
+                    if profiel_separator and profiel_headers:
+                        st.warning(f"De kopregel van {label} wijkt af van het profiel; het scheidingsteken en "
+                                   "de kolomnamen worden opnieuw uit het bestand bepaald")
+                    
+                    # Detecteer het scheidingsteken (comma of semicolon)
+                    separator = ';' if ';' in first_line else ','
+                    headers, numeriek = kolomnamen(kop, separator)
+                    if numeriek:
+                        st.warning("Geen kolomnamen gevonden, gebruik numerieke kolomnamen")
                 
                 # Controleer of er kolomnamen zijn
                 if not headers:
@@ -102,37 +317,106 @@ def load_input(label):
                 if len(headers) != len(set(headers)):
                     st.warning("Let op: Er zijn dubbele kolomnamen gevonden")
                 
-                # CSV opnieuw inlezen met pandas, nu met de juiste kolomnamen
-                file.seek(0)
-                df = pd.read_csv(file,
-                               sep=separator,
-                               names=headers,
-                               skiprows=1,
-                               dtype=str,  # Alles als string inlezen
-                               na_values=['', 'nan', 'NaN', 'NULL', 'null'],
-                               keep_default_na=True,
-                               quoting=csv.QUOTE_MINIMAL,
-                               quotechar='"',
-                               on_bad_lines='warn',
-                               nrows=max_rows)  # Beperk het aantal rijen
+                # Met een steekproef worden tijdens het inlezen alleen de gekozen sleutels bewaard
+                kies = None
+                if steekproef is not None:
+                    kies = kies_steekproef(label, headers, instellingen, steekproef)
+                    if kies is None:
+                        return None
+                
+                # CSV inlezen met pandas, nu met de juiste kolomnamen. Grote bestanden
+                # worden in blokken verdeeld over meerdere processen ingelezen; gecomprimeerde
+                # bestanden worden tijdens het inlezen gedecomprimeerd
+                def lees():
+                    if opslag == "Arrow":
+                        # Direct als Arrow strings inlezen met de CSV lezer van pyarrow
+                        if file_extension in COMPRESSIE_TYPEN:
+                            with open_gedecomprimeerd(bron, file_extension, lid) as stroom:
+                                return lees_csv_arrow(stroom, separator, headers, nrows=max_rows, kies=kies)
+                        return lees_csv_arrow(getattr(file, 'pad', data), separator, headers, nrows=max_rows,
+                                              kies=kies)
+                    if file_extension in COMPRESSIE_TYPEN:
+                        with open_gedecomprimeerd(bron, file_extension, lid) as stroom:
+                            return lees_csv_stroom(stroom, separator, headers, nrows=max_rows, kies=kies,
+                                                   heropen=partial(open_gedecomprimeerd, bron, file_extension, lid))
+                    return lees_csv(data, separator, headers, nrows=max_rows,  # Beperk het aantal rijen
+                                    pad=getattr(file, 'pad', None), kies=kies)
+                
+                # Raam vooraf het geheugen en de looptijd; bij een gecomprimeerd bestand wordt de
+                # grootte na het uitpakken geschat uit de compressieverhouding van het begin
+                def raam():
+                    if file_extension in COMPRESSIE_TYPEN:
+                        grootte = uitgepakte_grootte(bron, file_extension, lid)
+                    else:
+                        grootte = len(data)
+                    return raming_inlezen(data, grootte, separator, headers, max_rows, steekproef)
+                
+                raming = stadium(pijplijn, 'raming', (bron_sleutel(file), omvang(max_rows, kies), separator,
+                                                      tuple(headers)), raam)
+                if raming is None:
+                    st.caption(f"Geen raming voor {label}: het aantal rijen is vooraf niet te bepalen")
+                elif not toon_raming_inlezen(label, *raming, opslag):
+                    return None
+                
+                # Onthoud de instellingen, zodat ze in een profiel opgeslagen kunnen worden
+                st.session_state[f"inlezen_{label}"] = {'separator': separator, 'headers': headers,
+                                                       **omvang_instellingen(label, max_rows, instellingen)}
+                
+                # Zolang het bestand en de instellingen gelijk blijven komt de data uit de cache
+                df = stadium(pijplijn, 'ingelezen',
+                             (bron_sleutel(file), omvang(max_rows, kies), opslag, separator, tuple(headers), lid),
+                             lambda: schoon_op(lees(), opslag))
             else:  # Excel bestand
-                # Excel inlezen met alle kolommen als string en geen categorische data
-                df = pd.read_excel(file, dtype=str, engine='openpyxl', nrows=max_rows)  # Beperk het aantal rijen
+                # Excel in read-only modus openen; alleen de bladnamen worden geladen. Het werkboek
+                # wordt ook gesloten als er eerder gestopt wordt of een fout optreedt
+                with closing(open_excel(getattr(file, 'pad', file))) as werkboek:
+                    bladen = excel_bladen(werkboek)
+                    gekozen_bladen = [blad for blad in instellingen.get('bladen', []) if blad in bladen] or bladen[:1]
+                    if len(bladen) > 1:
+                        gekozen_bladen = st.multiselect(
+                            f"Werkbladen voor {label}",
+                            options=bladen,
+                            default=gekozen_bladen,
+                            key=f"bladen_{label}",
+                            help="Kies één of meer werkbladen. Meerdere bladen worden onder elkaar gezet."
+                        )
+                
+                    # Toon de kolomkoppen per werkblad zonder de data in te lezen
+                    with st.expander(f"Werkbladen en kolomkoppen van {label}"):
+                        for blad in bladen:
+                            st.write(f"**{blad}**: {', '.join(excel_kop(werkboek, blad))}")
+                
+                    if not gekozen_bladen:
+                        st.info("Kies minimaal één werkblad")
+                        return None
+                
+                    kies = None
+                    if steekproef is not None:
+                        kies = kies_steekproef(label, excel_kop(werkboek, gekozen_bladen[0]), instellingen, steekproef)
+                        if kies is None:
+                            return None
+                
+                    st.session_state[f"inlezen_{label}"] = {'bladen': gekozen_bladen,
+                                                           **omvang_instellingen(label, max_rows, instellingen)}
+                
+                    # Rijen streamen met alle kolommen als string; stopt bij het maximum aantal rijen
+                    df = stadium(pijplijn, 'ingelezen',
+                                 (bron_sleutel(file), omvang(max_rows, kies), opslag, tuple(gekozen_bladen)),
+                                 lambda: schoon_op(lees_excel(werkboek, gekozen_bladen, nrows=max_rows, kies=kies),
+                                                   opslag))
+            
+            # Meld de regels die de parser heeft overgeslagen
+            if df.attrs.get('quarantaine'):
+                toon_quarantaine(label, df.attrs['quarantaine'])
             
             # Controleer of er data is ingelezen
             if df.empty:
                 st.error("Geen data gevonden in het bestand")
                 return None
-            
-            # Vervang NaN waarden door lege string
-            df = df.fillna('')
-            
-            # Verwijder witruimte uit kolomnamen
-            df.columns = df.columns.str.strip()
-            
-            # Converteer alle waarden naar strings en verwijder categorische data
-            for col in df.columns:
-                df[col] = df[col].apply(lambda x: str(x) if pd.notnull(x) else '')
+            df.attrs['bestandsnaam'] = file.name
+            if kies is not None:
+                df.attrs['steekproef'] = (kies.keywords['fractie'], kies.keywords['key_columns'])
+                st.caption(f"Steekproef van {steekproef:.0%} van de sleutels: {len(df)} rijen")
             
             # Toon kolommen in een nette tabel
             st.write(f"Beschikbare kolommen in {label}:")
@@ -155,81 +439,562 @@ def load_input(label):
             st.write("Tip: Controleer of:")
             st.write("1. Het bestand niet leeg is")
             st.write("2. Het bestand kolomnamen bevat")
-            if file_extension == 'csv':
+            if file_extension == 'csv' or file_extension in COMPRESSIE_TYPEN:
                 st.write("3. Het bestand gebruikt komma's of puntkomma's als scheidingsteken")
                 st.write("4. Alle regels hetzelfde aantal kolommen hebben")
                 st.write("5. Er geen onverwachte regelbreuken in de data zitten")
             logging.error(f"Fout bij inlezen bestand ({label}): {e}")
+        finally:
+            # Geef de memory mapping van een bestand op de server weer vrij
+            if isinstance(file, ServerBestand):
+                file.close()
     return None
 
-def vergelijk_data(df_a, df_b, key_columns):
+def schat_sleutelkoppeling(df_a, df_b, key_columns, cache=None):
+    """De geschatte koppeling op de sleutels uit de (bewaarde) schetsen van beide bronnen."""
+    schets_a = stadium(cache, 'sleutelschets', (sleutel_van(df_a), tuple(key_columns)),
+                       lambda: schets_sleutel(df_a, key_columns))
+    schets_b = stadium(cache, 'sleutelschets', (sleutel_van(df_b), tuple(key_columns)),
+                       lambda: schets_sleutel(df_b, key_columns))
+    return schat_koppeling(schets_a, schets_b)
+
+def raam_vergelijking(df_a, df_b, key_columns, cache=None):
+    """De raming van geheugen en looptijd per engine, met de geschatte grootte van de merge."""
+    koppeling = schat_sleutelkoppeling(df_a, df_b, key_columns, cache)
+    return raming_vergelijking(df_a, df_b, key_columns, koppeling['merge_rijen'])
+
+def vingerafdruk_van(df_a, df_b, key_columns, cache=None):
+    """De identieke kolommen en of de sleutels gelijk zijn, via de cache (zie vingerafdrukken)."""
+    return stadium(cache, 'vingerafdruk', (sleutel_van(df_a), sleutel_van(df_b), tuple(key_columns)),
+                   lambda: vingerafdrukken(df_a, df_b, key_columns))
+
+def vergelijk_data(df_a, df_b, key_columns, engine="Automatisch", cache=None, regels=None):
     """
-    Vergelijk twee DataFrames en retourneer een DataFrame met de verschillen.
+    Vergelijk twee DataFrames en retourneer de verschillen (compact, als Verschillen).
+    Met engine "Automatisch" wordt DuckDB gekozen zodra de geraamde piek van pandas
+    niet meer in het geheugenbudget past.
+    Met een cache worden de sleutelindex, de uitlijning en het resultaat bewaard en
+    alleen opnieuw berekend als hun eigen invoer wijzigt. `regels` geeft per kolom een
+    vergelijkingsregel (zoals een tolerantie voor getallen); die worden in de pandas
+    vergelijking toegepast.
     """
-    # Zorg dat beide DataFrames dezelfde behandeling van lege waarden hebben
-    for col in df_a.columns:
-        df_a[col] = df_a[col].apply(lambda x: str(x) if pd.notnull(x) else '')
-    for col in df_b.columns:
-        df_b[col] = df_b[col].apply(lambda x: str(x) if pd.notnull(x) else '')
+    if engine == "Automatisch":
+        engine = kies_engine(raam_vergelijking(df_a, df_b, key_columns, cache))
+    if regels and engine == "DuckDB":
+        logging.info("Vergelijkingsregels worden toegepast; de vergelijking wordt met pandas uitgevoerd")
+        engine = "pandas"
     
-    # Voer de vergelijking uit
-    df_merge = pd.merge(
-        df_a,
-        df_b,
-        on=key_columns,
-        how='outer',
-        indicator=True,
-        suffixes=('_A', '_B')
-    )
+    def vergelijk():
+        a, b = df_a, df_b
+        
+        # Kolommen met dezelfde vingerafdruk zijn gelijk voor alle overeenkomende rijen;
+        # die blijven buiten de merge en de vergelijking per cel
+        identiek, zelfde_sleutels = vingerafdruk_van(a, b, key_columns, cache)
+        
+        # Met dezelfde sleutels en alleen identieke kolommen bevatten beide bronnen
+        # dezelfde rijen: geen verschillen en geen merge
+        vergelijk_kolommen = [col for col in a.columns if col not in key_columns and col in b.columns]
+        if zelfde_sleutels and len(identiek) == len(vergelijk_kolommen):
+            logging.info("De bronnen zijn identiek volgens de vingerafdrukken; de merge wordt overgeslagen")
+            return Verschillen.uit_delen(a, b, key_columns, vergelijk_kolommen, [])
+        
+        if identiek:
+            logging.info(f"{len(identiek)} kolommen zijn identiek volgens de vingerafdruk en worden overgeslagen")
+            a = a.drop(columns=identiek)
+            b = b.drop(columns=identiek)
+        
+        if engine == "DuckDB":
+            return vergelijk_duckdb(a, b, key_columns, duckdb_limiet_mb(a, b))
+        
+        # Met Arrow opslag wordt de vergelijking volledig met Arrow kernels gedaan
+        if is_arrow(a) and is_arrow(b) and not regels:
+            return vergelijk_arrow(a, b, key_columns)
+        
+        # Geef gecodeerde kolommen in beide bronnen dezelfde dictionary, zodat ze op
+        # codes vergeleken kunnen worden (op een kopie, de bronnen zelf blijven gelijk)
+        gedeelde_kolommen = [col for col in a.columns if col in b.columns]
+        a, b = deel_dictionary(a.copy(deep=False), b.copy(deep=False), gedeelde_kolommen)
+        
+        # Koppel de rijen op sleutel en vergelijk per kolom alleen de gekoppelde posities
+        paren = uitlijning(a, b, key_columns, cache)
+        return verschillen_uit_paren(a, b, paren, key_columns, regels)
+    
+    return stadium(cache, 'verschillen',
+                   (sleutel_van(df_a), sleutel_van(df_b), tuple(key_columns), engine, regels_sleutel(regels)),
+                   vergelijk)
+
+def vergelijk_meerdere(df_ref, doelen, key_columns, engine="Automatisch", cache=None, regels=None):
+    """
+    Vergelijk meerdere bronnen met één referentie. `doelen` is een dict met per naam
+    een DataFrame. De sleutelindex van de referentie wordt één keer opgebouwd en de
+    bronnen worden parallel vergeleken. Retourneert de verschillen van alle bronnen in
+    één tabel met een kolom 'Bron', en een samenvatting per bron.
+    """
+    def vergelijk():
+        # Een eigen cache voor deze vergelijking, groot genoeg voor alle sleutelindexen
+        lokaal = StadiumCache(len(doelen) + 1)
+        ref = stadium(lokaal, 'ingelezen', ('referentie',), lambda: df_ref.copy(deep=False))
+        stadium(lokaal, 'sleutelindex', (sleutel_van(ref), tuple(key_columns)),
+                lambda: sleutel_index(ref, key_columns))
+        
+        def vergelijk_bron(naam):
+            doel = stadium(lokaal, 'ingelezen', ('doel', naam), lambda: doelen[naam].copy(deep=False))
+            return vergelijk_data(ref, doel, key_columns, engine, lokaal, regels)
+        
+        with ThreadPoolExecutor(max_workers=min(len(doelen), os.cpu_count() or 1)) as executor:
+            resultaten = dict(zip(doelen, executor.map(vergelijk_bron, doelen)))
+        
+        delen = []
+        samenvatting = []
+        for naam, verschillen in resultaten.items():
+            aantallen = verschillen.aantallen()
+            samenvatting.append({
+                'Bron': naam,
+                'Rijen': len(doelen[naam]),
+                'Alleen in referentie': int(aantallen.get('Alleen in Bron A', 0)),
+                'Alleen in bron': int(aantallen.get('Alleen in Bron B', 0)),
+                'Verschillende waarden': int(aantallen.get('Verschillende waarden', 0)),
+                'Totaal': len(verschillen)
+            })
+            
+            verschillen = verschillen.pagina(0, len(verschillen))
+            verschillen['Verschil Type'] = verschillen['Verschil Type'].replace(
+                {'Alleen in Bron A': 'Alleen in referentie', 'Alleen in Bron B': 'Alleen in bron'})
+            verschillen = verschillen.rename(columns={'Waarde in A': 'Waarde in referentie',
+                                                      'Waarde in B': 'Waarde in bron'})
+            verschillen.insert(0, 'Bron', naam)
+            delen.append(verschillen)
+        return pd.concat(delen, ignore_index=True), pd.DataFrame(samenvatting)
     
-    # Zorg ervoor dat alle kolommen string type blijven na de merge
-    for col in df_merge.columns:
-        df_merge[col] = df_merge[col].apply(lambda x: str(x) if pd.notnull(x) else '')
+    bronnen = [sleutel_van(df_ref)] + [sleutel_van(df) for df in doelen.values()]
+    sleutel = None if None in bronnen else tuple(bronnen)
+    return stadium(cache, 'meerdere', (sleutel, tuple(doelen), tuple(key_columns), engine, regels_sleutel(regels)),
+                   vergelijk)
+
+def vat_samen(df_a, df_b, key_columns, voorbeelden=5, cache=None, regels=None):
+    """
+    Tel de verschillen zonder de volledige lijst met verschillen op te bouwen.
+    Retourneert per type verschil (en per kolom) het aantal en een paar voorbeeldsleutels.
+    """
+    alle_kolommen = [col for col in df_a.columns if col not in key_columns and col in df_b.columns]
+    
+    # Kolommen met dezelfde vingerafdruk hebben geen verschillen en hoeven niet vergeleken te worden
+    identiek, zelfde_sleutels = vingerafdruk_van(df_a, df_b, key_columns, cache)
+    
+    # Met dezelfde sleutels en alleen identieke kolommen zijn alle aantallen 0, zonder merge
+    if zelfde_sleutels and len(identiek) == len(alle_kolommen):
+        return pd.DataFrame(
+            [{'Verschil Type': verschil_type, 'Kolom': 'Alle kolommen', 'Aantal': 0, 'Voorbeeld sleutels': ''}
+             for verschil_type in ['Alleen in Bron A', 'Alleen in Bron B']] +
+            [{'Verschil Type': 'Verschillende waarden', 'Kolom': col, 'Aantal': 0, 'Voorbeeld sleutels': ''}
+             for col in alle_kolommen]
+        )
+    vergelijk_kolommen = [col for col in alle_kolommen if col not in identiek]
+    df_a, df_b = deel_dictionary(df_a.copy(deep=False), df_b.copy(deep=False), vergelijk_kolommen)
+    
+    paren = uitlijning(df_a, df_b, key_columns, cache)
+    positie_a = paren['_positie_a'].to_numpy()
+    positie_b = paren['_positie_b'].to_numpy()
+    rij = rij_labels(paren, key_columns)
     
-    # Identificeer verschillen
-    verschillen = []
+    def voorbeeld_sleutels(mask, labels=rij):
+        return '; '.join(labels[mask][:voorbeelden])
     
-    # Rijen die alleen in A voorkomen
-    alleen_in_a = df_merge[df_merge['_merge'] == 'left_only']
-    for _, rij in alleen_in_a.iterrows():
-        verschillen.append({
-            'Verschil Type': 'Alleen in Bron A',
-            'Rij': ', '.join(str(rij[key]) for key in key_columns),
+    samenvatting = []
+    for verschil_type, mask in [('Alleen in Bron A', positie_b < 0), ('Alleen in Bron B', positie_a < 0)]:
+        samenvatting.append({
+            'Verschil Type': verschil_type,
             'Kolom': 'Alle kolommen',
-            'Waarde in A': 'Aanwezig',
-            'Waarde in B': 'Niet aanwezig'
+            'Aantal': int(mask.sum()),
+            'Voorbeeld sleutels': voorbeeld_sleutels(mask)
         })
     
-    # Rijen die alleen in B voorkomen
-    alleen_in_b = df_merge[df_merge['_merge'] == 'right_only']
-    for _, rij in alleen_in_b.iterrows():
-        verschillen.append({
-            'Verschil Type': 'Alleen in Bron B',
-            'Rij': ', '.join(str(rij[key]) for key in key_columns),
-            'Kolom': 'Alle kolommen',
-            'Waarde in A': 'Niet aanwezig',
-            'Waarde in B': 'Aanwezig'
+    # Per kolom alleen een masker en een telling, geen rij per verschil
+    beide = (positie_a >= 0) & (positie_b >= 0)
+    for col in alle_kolommen:
+        if col in identiek:
+            samenvatting.append({'Verschil Type': 'Verschillende waarden', 'Kolom': col,
+                                 'Aantal': 0, 'Voorbeeld sleutels': ''})
+            continue
+        mask = kolom_verschil(df_a[col], df_b[col], positie_a[beide], positie_b[beide], (regels or {}).get(col))
+        samenvatting.append({
+            'Verschil Type': 'Verschillende waarden',
+            'Kolom': col,
+            'Aantal': int(mask.sum()),
+            'Voorbeeld sleutels': voorbeeld_sleutels(mask, rij[beide])
         })
     
-    # Verschillen in waarden voor overeenkomende rijen
-    vergelijk_kolommen = [col for col in df_a.columns if col not in key_columns]
-    for col in vergelijk_kolommen:
-        col_a = f"{col}_A"
-        col_b = f"{col}_B"
-        if col_a in df_merge.columns and col_b in df_merge.columns:
-            mask = (df_merge[col_a] != df_merge[col_b]) & (df_merge['_merge'] == 'both')
-            if mask.any():
-                verschillen_in_kolom = df_merge[mask]
-                for _, rij in verschillen_in_kolom.iterrows():
-                    verschillen.append({
-                        'Verschil Type': 'Verschillende waarden',
-                        'Rij': ', '.join(str(rij[key]) for key in key_columns),
-                        'Kolom': col,
-                        'Waarde in A': rij[col_a],
-                        'Waarde in B': rij[col_b]
-                    })
+    return pd.DataFrame(samenvatting)
+
+def toon_verschillen(verschillen, df_a, df_b, steekproef=None):
+    """
+    Toon de gevonden verschillen met download opties. Bij een steekproef op sleutel
+    (de fractie in `steekproef`) worden ook de aantallen in de volledige bestanden geschat.
+    """
+    if verschillen.empty:
+        st.success("Geen verschillen gevonden!")
+    else:
+        st.warning(f"Er zijn {len(verschillen)} verschillen gevonden")
+        if steekproef:
+            toon_schatting(verschillen.aantallen(), steekproef)
+        
+        # Toon een overzicht van de verschillen
+        st.subheader("Overzicht van verschillen")
+        
+        # Tel het aantal unieke rijen per type verschil
+        verschil_types = verschillen.aantallen()
+        
+        # Toon de verschillen in een tabel; alleen de getoonde pagina wordt opgehaald
+        st.subheader("Gedetailleerde verschillen")
+        paginas = (len(verschillen) - 1) // PAGINA_GROOTTE + 1
+        pagina = 1
+        if paginas > 1:
+            pagina = st.number_input(f"Pagina (van {paginas})", min_value=1, max_value=paginas, value=1,
+                                     key="pagina_verschillen")
+        begin = (pagina - 1) * PAGINA_GROOTTE
+        st.dataframe(verschillen.pagina(begin, begin + PAGINA_GROOTTE), use_container_width=True)
+        
+        # Rijen alleen in A en alleen in B kunnen sleutels zijn die alleen in de vorm verschillen
+        if {'Alleen in Bron A', 'Alleen in Bron B'} <= set(verschil_types.index):
+            toon_vage_koppeling(verschillen, df_a, df_b)
+        
+        # Download opties
+        st.subheader("Download verschillen")
+        formaten = ["Excel", "CSV"]
+        download_format = st.radio(
+            "Kies download formaat",
+            formaten,
+            index=formaten.index(profiel['download_format']) if profiel.get('download_format') in formaten else 0,
+            horizontal=True,
+            key="download_format"
+        )
+        
+        # Het bestand wordt pas gemaakt als erom gevraagd wordt
+        if not st.button(f"Maak {download_format} bestand"):
+            return
+        
+        if download_format == "Excel":
+            # Maak een Excel bestand met meerdere sheets
+            output = io.BytesIO()
+            with pd.ExcelWriter(output, engine='openpyxl') as writer:
+                # Sheet 1: Alle verschillen
+                verschillen.naar_dataframe().to_excel(writer, sheet_name='Alle verschillen', index=False)
+                
+                # Sheet 2: Samenvatting per type verschil
+                verschillen.samenvatting().to_excel(writer, sheet_name='Samenvatting', index=False)
+                
+                # Sheet 3: Unieke kolommen per bron
+                unieke_kolommen = pd.DataFrame({
+                    'Bron A': sorted(set(df_a.columns) - set(df_b.columns)),
+                    'Bron B': sorted(set(df_b.columns) - set(df_a.columns))
+                })
+                unieke_kolommen.to_excel(writer, sheet_name='Unieke kolommen', index=False)
+            
+            output.seek(0)
+            st.download_button(
+                label="Download verschillen als Excel",
+                data=output,
+                file_name="verschillen.xlsx",
+                mime="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"
+            )
+        else:
+            # Download als CSV, blok voor blok opgebouwd
+            csv_data = verschillen.naar_csv()
+            st.download_button(
+                label="Download verschillen als CSV",
+                data=csv_data,
+                file_name="verschillen.csv",
+                mime="text/csv"
+            )
+
+def toon_vage_koppeling(verschillen, df_a, df_b):
+    """
+    Zoek op verzoek paren tussen de sleutels die alleen in A en alleen in B voorkomen,
+    zoals 'KH_426903' en '426903', en toon ze met hun betrouwbaarheid.
+    """
+    with st.expander("Sleutels die bijna overeenkomen"):
+        kenmerk = (sleutel_van(df_a), sleutel_van(df_b), tuple(verschillen.key_columns))
+        if not onthoud_knop(st.button("Zoek bijna gelijke sleutels"), 'vage_koppeling', kenmerk):
+            return
+        with st.spinner("Sleutels worden gekoppeld..."):
+            paren = stadium(pijplijn, 'vage_koppeling', kenmerk,
+                            lambda: koppel_vaag(*verschillen.ongekoppelde_sleutels()))
+        
+        minimum = st.slider("Minimale betrouwbaarheid", min_value=MIN_BETROUWBAARHEID, max_value=1.0,
+                            value=0.8, step=0.05)
+        paren = paren.loc[paren['Betrouwbaarheid'] >= minimum, VAAG_KOLOMMEN]
+        if paren.empty:
+            st.info("Geen sleutels gevonden die bijna overeenkomen.")
+            return
+        st.write(f"{len(paren)} rijen alleen in Bron A hebben een bijna gelijke sleutel in Bron B:")
+        st.dataframe(paren, use_container_width=True, hide_index=True)
+        st.download_button(
+            label="Download gekoppelde sleutels als CSV",
+            data=paren.to_csv(index=False),
+            file_name="bijna_gelijke_sleutels.csv",
+            mime="text/csv",
+            key="download_vage_koppeling"
+        )
+
+def onthoud_knop(ingedrukt, naam, kenmerk):
+    """
+    Onthoud dat een knop is ingedrukt zolang `kenmerk` (zoals de sleutels) gelijk blijft,
+    zodat de resultaten zichtbaar blijven als de pagina opnieuw wordt opgebouwd.
+    """
+    if ingedrukt:
+        st.session_state[naam] = kenmerk
+    return st.session_state.get(naam) == kenmerk
+
+def toon_samenvatting(samenvatting, steekproef=None):
+    """
+    Toon de aantallen verschillen per type en per kolom.
+    """
+    totaal = samenvatting['Aantal'].sum()
+    if totaal == 0:
+        st.success("Geen verschillen gevonden!")
+    else:
+        st.warning(f"Er zijn {totaal} verschillen gevonden")
+        if steekproef:
+            toon_schatting(samenvatting.groupby('Verschil Type', sort=False)['Aantal'].sum(), steekproef)
+        st.subheader("Samenvatting van verschillen")
+        st.dataframe(samenvatting[samenvatting['Aantal'] > 0], use_container_width=True)
+
+def toon_schatting(aantallen, fractie):
+    """
+    Schat uit een steekproef op sleutel de aantallen verschillen per type in de volledige
+    bestanden. Elke sleutel zit met kans `fractie` in de steekproef; de marge is het 95%
+    interval van die binomiale trekking (bij benadering, want verschillen in meerdere
+    kolommen van dezelfde rij hangen samen).
+    """
+    aantallen = aantallen[aantallen > 0]
+    st.info(f"De bronnen zijn een steekproef van {fractie:.0%} van de sleutels. "
+            "Geschatte aantallen in de volledige bestanden:")
+    st.dataframe(pd.DataFrame({
+        'In steekproef': aantallen,
+        'Geschat totaal': (aantallen / fractie).round().astype(int),
+        'Marge (95%)': (1.96 * (aantallen * (1 - fractie)) ** 0.5 / fractie).round().astype(int),
+    }), use_container_width=True)
+
+def hernoem_naar_a(df_b, mapping):
+    """
+    Hernoem de kolommen van Bron B naar de namen in Bron A volgens de mapping (A -> B),
+    ook de sleutel van de steekproef.
+    """
+    naar_a = {col_b: col_a for col_a, col_b in mapping.items()}
+    hernoemd = df_b.rename(columns=naar_a)
+    if 'steekproef' in df_b.attrs:
+        fractie, sleutels = df_b.attrs['steekproef']
+        hernoemd.attrs['steekproef'] = (fractie, tuple(naar_a.get(col, col) for col in sleutels))
+    return hernoemd
+
+def controleer_steekproef(df_a, df_b, key_columns):
+    """
+    Geef de fractie van de steekproef als beide bronnen een steekproef op dezelfde
+    sleutelkolommen (een deel van de sleutel) met dezelfde fractie zijn, anders None met
+    een waarschuwing.
+    """
+    steekproef_a = df_a.attrs.get('steekproef')
+    steekproef_b = df_b.attrs.get('steekproef')
+    if steekproef_a is None and steekproef_b is None:
+        return None
+    if steekproef_a is None or steekproef_b is None or steekproef_a[0] != steekproef_b[0]:
+        st.warning("Niet alle bronnen zijn een steekproef met hetzelfde percentage; rijen kunnen ten onrechte "
+                   "als alleen in Bron A of alleen in Bron B gemeld worden.")
+        return None
+    if set(steekproef_a[1]) != set(steekproef_b[1]) or not set(steekproef_a[1]) <= set(key_columns):
+        st.warning("De steekproef is op een andere sleutel genomen dan de vergelijking; rijen kunnen ten "
+                   "onrechte als alleen in Bron A of alleen in Bron B gemeld worden.")
+        return None
+    return steekproef_a[0]
+
+def toon_meerdere(verschillen, samenvatting):
+    """
+    Toon de samenvatting per bron en de verschillen van alle bronnen met een download.
+    """
+    st.subheader("Samenvatting per bron")
+    st.dataframe(samenvatting, use_container_width=True)
+    if verschillen.empty:
+        st.success("Geen verschillen gevonden!")
+        return
+    
+    st.warning(f"Er zijn {len(verschillen)} verschillen gevonden")
+    st.subheader("Gedetailleerde verschillen")
+    st.dataframe(verschillen, use_container_width=True)
+    st.download_button(
+        label="Download verschillen als CSV",
+        data=verschillen.to_csv(index=False),
+        file_name="verschillen_meerdere_bronnen.csv",
+        mime="text/csv",
+        key="download_meerdere"
+    )
+
+def toon_sleutelcontrole(df_a, df_b, key_columns):
+    """
+    Toon vooraf een schatting van de koppeling op de sleutels: hoeveel sleutels in beide
+    bronnen of in één bron voorkomen en hoe groot de merge wordt. De schatting komt uit
+    schetsen van de sleutels en kost geen merge.
+    """
+    koppeling = schat_sleutelkoppeling(df_a, df_b, key_columns, pijplijn)
+    
+    st.write("Geschatte koppeling op de sleutels:")
+    st.dataframe(pd.DataFrame({
+        'Sleutels': [koppeling['in_beide'], koppeling['alleen_a'], koppeling['alleen_b']],
+        'Rijen in A': [koppeling['rijen_in_beide_a'], koppeling['rijen_alleen_a'], 0],
+        'Rijen in B': [koppeling['rijen_in_beide_b'], 0, koppeling['rijen_alleen_b']],
+    }, index=['In beide bronnen', 'Alleen in Bron A', 'Alleen in Bron B']).round().astype(int),
+        use_container_width=True)
+    st.caption(f"Geschatte grootte van de merge: {int(koppeling['merge_rijen']):,} rijen")
+    
+    if koppeling['overlap'] < MIN_OVERLAP:
+        st.warning(f"Slechts ongeveer {koppeling['overlap']:.0%} van de sleutels komt in beide bronnen voor. "
+                   "Controleer of de juiste sleutelkolommen of koppelingen gekozen zijn.")
+    if koppeling['merge_rijen'] > 1.1 * (len(df_a) + len(df_b)):
+        st.warning("De gekozen sleutel is niet uniek: de merge wordt veel groter dan de bronnen "
+                   "en de vergelijking kan lang duren. Kies eventueel een andere sleutel.")
+
+def toon_basislijn_opslaan(df, label):
+    """
+    Toon de optie om een ingelezen bron als basislijn op te slaan, zodat die bij een
+    volgende vergelijking niet opnieuw ingelezen hoeft te worden.
+    """
+    with st.expander(f"{label} opslaan als basislijn"):
+        bestandsnaam = df.attrs.get('bestandsnaam', '')
+        naam = st.text_input("Naam", value=standaard_naam(bestandsnaam), key=f"basislijn_naam_{label}")
+        sleutels = st.multiselect(
+            "Sleutelkolommen",
+            options=df.columns.tolist(),
+            key=f"basislijn_sleutels_{label}",
+            help="De index van de sleutels wordt meteen opgeslagen"
+        )
+        if st.button("Opslaan als basislijn", key=f"basislijn_opslaan_{label}"):
+            try:
+                with st.spinner("Basislijn wordt opgeslagen..."):
+                    registreer_basislijn(naam, df, sleutels, bron=bestandsnaam)
+                st.success(f"Basislijn '{naam.strip()}' opgeslagen")
+            except (OSError, ValueError) as e:
+                st.error(f"Fout bij opslaan basislijn: {e}")
+                logging.error(f"Fout bij opslaan basislijn: {e}")
+
+def kies_regels(kolommen, standaard):
+    """
+    Toon per kolom de vergelijkingsregel in één tabel en retourneer de regels die
+    afwijken van een exacte vergelijking. `standaard` bevat de regels uit een profiel.
+    """
+    with st.expander("Vergelijkingsregels"):
+        st.write("Kies per kolom hoe de waarden vergeleken worden. Getal leest Nederlandse en Engelse "
+                 "notatie ('1.280,00', '1,280.00' en '1280.0') en gebruikt de tolerantie; Datum leest "
+                 "verschillende datumformaten; Tekst negeert hoofdletters en witruimte.")
+        tabel = pd.DataFrame({
+            'Kolom': kolommen,
+            'Regel': [standaard.get(col, {}).get('regel', EXACT) for col in kolommen],
+            'Absolute tolerantie': [float(standaard.get(col, {}).get('absoluut', 0.0)) for col in kolommen],
+            'Relatieve tolerantie': [float(standaard.get(col, {}).get('relatief', 0.0)) for col in kolommen],
+        })
+        with st.form("vergelijkingsregels"):
+            tabel = st.data_editor(
+                tabel,
+                column_config={
+                    'Kolom': st.column_config.TextColumn(disabled=True),
+                    'Regel': st.column_config.SelectboxColumn(options=REGELS, required=True),
+                    'Absolute tolerantie': st.column_config.NumberColumn(
+                        min_value=0.0, format="%g", help="Alleen voor Getal: toegestaan verschil"),
+                    'Relatieve tolerantie': st.column_config.NumberColumn(
+                        min_value=0.0, format="%g",
+                        help="Alleen voor Getal: toegestaan verschil als deel van de grootste waarde"),
+                },
+                hide_index=True,
+                use_container_width=True,
+                key="regels_editor"
+            )
+            st.form_submit_button("Regels toepassen")
     
-    return pd.DataFrame(verschillen)
+    regels = {}
+    for col, regel, absoluut, relatief in tabel.itertuples(index=False):
+        if regel and regel != EXACT:
+            regels[col] = {'regel': regel,
+                           'absoluut': float(absoluut) if pd.notna(absoluut) else 0.0,
+                           'relatief': float(relatief) if pd.notna(relatief) else 0.0}
+    return regels
+
+def zonder_ongewijzigde_rijen(df_a, df_b, key_columns):
+    """
+    Laat bij een basislijn als Bron A de rijen weg die in beide bronnen gelijk zijn;
+    die leveren geen verschillen op.
+    """
+    if basislijn is None:
+        return df_a, df_b
+    index = stadium(pijplijn, 'basislijn_index', (basislijn, versie(basislijn)), lambda: laad_index(basislijn))
+    return stadium(pijplijn, 'zonder_gelijke_rijen', (sleutel_van(df_a), sleutel_van(df_b), tuple(key_columns)),
+                   lambda: verwijder_gelijke_rijen(df_a, index, df_b, key_columns))
+
+def toon_raming_vergelijking(df_a, df_b, key_columns, engine, regels=None):
+    """
+    Toon vooraf de raming van geheugen en looptijd per engine en welke engine gebruikt
+    wordt. Waarschuw als die engine niet binnen het geheugenbudget past.
+    """
+    raming = raam_vergelijking(df_a, df_b, key_columns, pijplijn)
+    gekozen = kies_engine(raming) if engine == "Automatisch" else engine
+    if regels and gekozen == "DuckDB":
+        gekozen = "pandas"
+    geheugen, looptijd = raming.loc[gekozen, 'Geheugen (MB)'], raming.loc[gekozen, 'Looptijd (s)']
+    st.caption(f"Raming van de vergelijking met {gekozen}: ongeveer {geheugen:,.0f} MB en {looptijd:,.0f} s "
+               f"(budget {GEHEUGEN_BUDGET_MB:,.0f} MB)")
+    if not raming.loc[gekozen, 'Past in budget']:
+        advies = "minder rijen of een steekproef op sleutel"
+        if gekozen == "pandas" and not regels and raming['Past in budget'].get("DuckDB", False):
+            advies = "engine Automatisch of DuckDB, " + advies
+        st.warning(f"De vergelijking met {gekozen} past naar verwachting niet in het geheugenbudget. "
+                   f"Kies {advies}.")
+    with st.expander("Raming per engine"):
+        st.dataframe(raming.round(1), use_container_width=True)
+
+def voer_vergelijking_uit(df_a, df_b, key_columns, knop_label, engine, resultaat, regels=None):
+    """
+    Toon de knop voor de vergelijking en de resultaten. Bij "Alleen samenvatting"
+    wordt de samenvatting bewaard, zodat de details daarna alsnog opgevraagd kunnen worden.
+    """
+    # De resultaten blijven zichtbaar zolang de bronnen, sleutels en regels gelijk blijven
+    kenmerk = (knop_label, tuple(key_columns), sleutel_van(df_a), sleutel_van(df_b), regels_sleutel(regels))
+    steekproef = controleer_steekproef(df_a, df_b, key_columns)
+    try:
+        df_a, df_b = zonder_ongewijzigde_rijen(df_a, df_b, key_columns)
+        toon_raming_vergelijking(df_a, df_b, key_columns, engine, regels)
+        if resultaat == "Alleen samenvatting":
+            if st.button(knop_label):
+                with st.spinner("Verschillen worden geteld..."):
+                    st.session_state['samenvatting'] = (
+                        kenmerk,
+                        vat_samen(df_a, df_b, key_columns, cache=pijplijn, regels=regels)
+                    )
+            
+            # Toon de bewaarde samenvatting zolang de bronnen, sleutels en regels niet gewijzigd zijn
+            opgeslagen = st.session_state.get('samenvatting')
+            if opgeslagen and opgeslagen[0] == kenmerk:
+                toon_samenvatting(opgeslagen[1], steekproef)
+                if opgeslagen[1]['Aantal'].sum() > 0 and \
+                        onthoud_knop(st.button("Toon alle details"), 'details', kenmerk):
+                    with st.spinner("Vergelijking wordt uitgevoerd..."):
+                        verschillen = vergelijk_data(df_a, df_b, key_columns, engine, pijplijn, regels)
+                        toon_verschillen(verschillen, df_a, df_b, steekproef)
+        elif onthoud_knop(st.button(knop_label), 'vergeleken', kenmerk):
+            # Voeg een voortgangsindicator toe
+            with st.spinner("Vergelijking wordt uitgevoerd..."):
+                verschillen = vergelijk_data(df_a, df_b, key_columns, engine, pijplijn, regels)
+                toon_verschillen(verschillen, df_a, df_b, steekproef)
+    except Exception as e:
+        st.error(f"Er is een fout opgetreden tijdens de vergelijking: {str(e)}")
+        st.error("Controleer of de geselecteerde kolommen correct zijn en of de data het juiste formaat heeft.")
+
+@st.cache_resource
+def gedeelde_opslag():
+    """De opslag voor de stadia van de vergelijking, gedeeld door alle sessies in dit proces."""
+    return GedeeldeOpslag()
+
+# Cache voor de stadia van de vergelijking: per sessie, op de opslag die alle sessies
+# delen (dezelfde bron staat maar één keer in het geheugen)
+if 'pijplijn' not in st.session_state:
+    st.session_state['pijplijn'] = SessieCache(gedeelde_opslag())
+pijplijn = st.session_state['pijplijn']
 
 # Titel en tabs
 st.title("Data Vergelijker")
@@ -237,16 +1002,138 @@ tab1, tab2, tab3 = st.tabs(["Data Inlezen", "Kolom Mapping", "Vergelijking"])
 
 # Verwijder de dubbele header container en content container
 with tab1:
+    # Een vergelijkingsprofiel vult de instellingen van een terugkerende vergelijking in
+    profiel = {}
+    namen = profielen()
+    if namen:
+        profiel_naam = st.selectbox(
+            "Vergelijkingsprofiel",
+            ["(geen)"] + namen,
+            help="Gebruik de opgeslagen instellingen van een vaste combinatie van bronnen"
+        )
+        if profiel_naam != "(geen)":
+            try:
+                profiel = laad_profiel(profiel_naam)
+            except (OSError, ValueError) as e:
+                st.error(f"Fout bij laden profiel: {e}")
+                logging.error(f"Fout bij laden profiel '{profiel_naam}': {e}")
+    inlezen = profiel.get('inlezen') or {}
+    
+    # Instellingen voor de opslag van de ingelezen data
+    with st.expander("Instellingen"):
+        opslagen = ["Standaard", "Compact", "Arrow"]
+        opslag = st.radio(
+            "Opslag van de data",
+            opslagen,
+            index=opslagen.index(profiel['opslag']) if profiel.get('opslag') in opslagen else 0,
+            horizontal=True,
+            help="Compact slaat kolommen met weinig unieke waarden (zoals 'Ja'/'Nee') op als "
+                 "dictionary met codes. Dit bespaart veel geheugen en maakt de vergelijking sneller. "
+                 "Arrow bewaart alle kolommen als Arrow strings en vergelijkt met Arrow kernels."
+        )
+        engines = ["Automatisch", "pandas", "DuckDB"]
+        engine = st.radio(
+            "Engine voor de vergelijking",
+            engines,
+            index=engines.index(profiel['engine']) if profiel.get('engine') in engines else 0,
+            horizontal=True,
+            help="DuckDB voert de vergelijking uit in een ingebedde database die meerdere cores "
+                 f"gebruikt en naar schijf kan uitwijken. Automatisch kiest DuckDB als de geraamde vergelijking "
+                 f"met pandas niet in het geheugenbudget van {GEHEUGEN_BUDGET_MB:,.0f} MB past."
+        )
+        modi = ["Eerste rijen", "Steekproef op sleutel"]
+        inlees_modus = st.radio(
+            "Rijen inlezen",
+            modi,
+            index=modi.index(profiel['inlees_modus']) if profiel.get('inlees_modus') in modi else 0,
+            horizontal=True,
+            help="Eerste rijen leest van elk bestand de eerste rijen; Bron A en Bron B bevatten dan meestal "
+                 "verschillende sleutels. Steekproef op sleutel kiest in alle bronnen dezelfde sleutels via een "
+                 "hash van de sleutel, zodat de vergelijking een betrouwbare schatting voor de volledige "
+                 "bestanden geeft."
+        )
+        steekproef_fractie = None
+        if inlees_modus == "Steekproef op sleutel":
+            steekproef_fractie = st.slider(
+                "Steekproef (% van de sleutels)",
+                min_value=1,
+                max_value=100,
+                value=int(profiel.get('steekproef', 10)),
+                help="Hetzelfde percentage geldt voor alle bronnen"
+            ) / 100
+        opslag_gedeeld = gedeelde_opslag()
+        st.caption(f"Gedeelde cache: {opslag_gedeeld.geheugen_mb():,.0f} MB van {opslag_gedeeld.budget_mb:,.0f} MB "
+                   "in het geheugen")
+        extra_bronnen = st.number_input(
+            "Extra bronnen",
+            min_value=0,
+            max_value=4,
+            value=int(profiel.get('extra_bronnen', 0)),
+            help="Vergelijk naast Bron B nog meer bronnen met Bron A als referentie."
+        )
+    
     # Twee kolommen maken voor de databronnen
     col1, col2 = st.columns(2)
 
     with col1:
         st.subheader("Databron A")
-        df_a = load_input("Bron A")
+        # Een opgeslagen basislijn kan in plaats van een bestand als Bron A dienen
+        basislijn = None
+        namen = basislijnen()
+        if namen:
+            basislijn = st.selectbox(
+                "Basislijn",
+                ["(geen)"] + namen,
+                help="Vergelijk met een opgeslagen basislijn, zonder het oude bestand opnieuw in te lezen"
+            )
+            if basislijn == "(geen)":
+                basislijn = None
+        
+        if basislijn is not None:
+            try:
+                df_a = stadium(pijplijn, 'ingelezen', ('basislijn', basislijn, versie(basislijn)),
+                               lambda: laad_basislijn(basislijn))
+                info = stadium(pijplijn, 'basislijn_index', (basislijn, versie(basislijn)),
+                               lambda: laad_index(basislijn))
+                st.caption(f"Basislijn '{basislijn}': {info['rijen']} rijen uit {info['bron'] or 'onbekend bestand'}, "
+                           f"opgeslagen op {info['geregistreerd']}")
+            except (OSError, ValueError) as e:
+                st.error(f"Fout bij laden basislijn: {e}")
+                logging.error(f"Fout bij laden basislijn '{basislijn}': {e}")
+                df_a = None
+                basislijn = None
+        else:
+            df_a = load_input("Bron A", opslag, inlezen.get("Bron A"), steekproef_fractie)
+            if df_a is not None and opslag == "Compact":
+                df_a = stadium(pijplijn, 'genormaliseerd', (sleutel_van(df_a), opslag), lambda: comprimeer_bron(df_a))
+                geheugen_voor, geheugen_na = df_a.attrs['geheugen_mb']
+                st.caption(f"Geheugengebruik Bron A: {geheugen_voor:.1f} MB → {geheugen_na:.1f} MB")
+            if df_a is not None:
+                toon_basislijn_opslaan(df_a, "Bron A")
 
     with col2:
         st.subheader("Databron B")
-        df_b = load_input("Bron B")
+        df_b = load_input("Bron B", opslag, inlezen.get("Bron B"), steekproef_fractie)
+        if df_b is not None and opslag == "Compact":
+            df_b = stadium(pijplijn, 'genormaliseerd', (sleutel_van(df_b), opslag), lambda: comprimeer_bron(df_b))
+            geheugen_voor, geheugen_na = df_b.attrs['geheugen_mb']
+            st.caption(f"Geheugengebruik Bron B: {geheugen_voor:.1f} MB → {geheugen_na:.1f} MB")
+        if df_b is not None:
+            toon_basislijn_opslaan(df_b, "Bron B")
+
+    # Extra bronnen die samen met Bron B met Bron A als referentie vergeleken worden
+    extra = {}
+    if extra_bronnen:
+        for kolom, letter in zip(st.columns(2) * 2, "CDEF"[:extra_bronnen]):
+            with kolom:
+                label = f"Bron {letter}"
+                st.subheader(f"Databron {letter}")
+                df_extra = load_input(label, opslag, inlezen.get(label), steekproef_fractie)
+                if df_extra is not None and opslag == "Compact":
+                    df_extra = stadium(pijplijn, 'genormaliseerd', (sleutel_van(df_extra), opslag),
+                                       lambda: comprimeer_bron(df_extra))
+                if df_extra is not None:
+                    extra[label] = df_extra
 
 with tab2:
     if df_a is not None and df_b is not None:
@@ -287,33 +1174,46 @@ with tab2:
             # Maak een mapping dictionary
             mapping = {}
             
-            # Toon de mapping interface in een grid
-            col1, col2 = st.columns(2)
+            # Stel een koppeling voor op basis van de namen en de waarden in een steekproef
+            steekproef_a = stadium(pijplijn, 'steekproef', (sleutel_van(df_a),), lambda: steekproef(df_a))
+            steekproef_b = stadium(pijplijn, 'steekproef', (sleutel_van(df_b),), lambda: steekproef(df_b))
+            voorstel = stadium(pijplijn, 'kolomkoppeling', (sleutel_van(df_a), sleutel_van(df_b)),
+                               lambda: stel_koppeling_voor(steekproef_a, steekproef_b).assign(Sleutel=False))
             
-            with col1:
-                st.write("Bron A kolommen:")
-                for i, col_a in enumerate(df_a.columns):
-                    st.write(f"{i+1}. {col_a}")
+            # Een koppeling uit het profiel gaat voor het voorstel
+            if profiel.get('mapping'):
+                voorstel = voorstel.copy()
+                voorstel['Kolom in B'] = [
+                    col_b if col_b in df_b.columns else ""
+                    for col_b in voorstel['Kolom in A'].map(profiel['mapping'])
+                ]
+                voorstel['Sleutel'] = voorstel['Kolom in A'].isin(profiel.get('mapping_sleutels', []))
             
-            with col2:
-                st.write("Bron B kolommen:")
-                for i, col_b in enumerate(df_b.columns):
-                    st.write(f"{i+1}. {col_b}")
+            # Alle koppelingen in één tabel; pas na 'Koppeling toepassen' wordt de pagina opnieuw opgebouwd
+            with st.form("kolom_mapping"):
+                koppeling = st.data_editor(
+                    voorstel,
+                    column_config={
+                        'Kolom in A': st.column_config.TextColumn(disabled=True),
+                        'Kolom in B': st.column_config.SelectboxColumn(options=[""] + df_b.columns.tolist()),
+                        'Score': st.column_config.NumberColumn(disabled=True, format="%.2f",
+                                                               help="Gelijkenis van naam en waarden"),
+                        'Sleutel': st.column_config.CheckboxColumn(
+                            help="Gebruik deze koppeling als sleutel. Zonder aangevinkte sleutels "
+                                 "worden alle gekoppelde kolommen als sleutel gebruikt."),
+                    },
+                    hide_index=True,
+                    use_container_width=True,
+                    key="mapping_editor"
+                )
+                st.form_submit_button("Koppeling toepassen")
             
-            # Maak een mapping interface
-            st.write("Koppel de kolommen:")
-            for i, col_a in enumerate(df_a.columns):
-                col1, col2 = st.columns(2)
-                with col1:
-                    st.write(f"{i+1}. {col_a}")
-                with col2:
-                    selected_col = st.selectbox(
-                        f"Selecteer overeenkomende kolom voor {col_a}",
-                        [""] + df_b.columns.tolist(),
-                        key=f"mapping_{i}"
-                    )
-                    if selected_col:
-                        mapping[col_a] = selected_col
+            mapping_sleutels = []
+            for col_a, col_b, is_sleutel in zip(koppeling['Kolom in A'], koppeling['Kolom in B'], koppeling['Sleutel']):
+                if col_b:
+                    mapping[col_a] = col_b
+                    if is_sleutel:
+                        mapping_sleutels.append(col_a)
             
             # Toon de gemaakte mapping
             if mapping:
@@ -324,170 +1224,122 @@ with tab2:
             st.success("Gemeenschappelijke kolommen gevonden:")
             st.write(", ".join(gemeenschappelijke_kolommen))
             
+            # Stel sleutels voor op basis van steekproeven en schetsen van beide bronnen
+            steekproef_a = stadium(pijplijn, 'steekproef', (sleutel_van(df_a),), lambda: steekproef(df_a))
+            steekproef_b = stadium(pijplijn, 'steekproef', (sleutel_van(df_b),), lambda: steekproef(df_b))
+            kandidaten = stadium(
+                pijplijn, 'sleutelkandidaten', (sleutel_van(df_a), sleutel_van(df_b)),
+                lambda: sleutelkandidaten(df_a, df_b, steekproef_a, steekproef_b, sorted(gemeenschappelijke_kolommen))
+            )
+            with st.expander("Voorgestelde sleutels", expanded=True):
+                if kandidaten.empty:
+                    st.info("Geen kolommen of combinaties van twee kolommen gevonden die als sleutel geschikt lijken.")
+                st.dataframe(
+                    kandidaten.drop(columns=['Kolommen']).style.format(
+                        {'Uniek in A': '{:.1%}', 'Uniek in B': '{:.1%}', 'Overlap': '{:.1%}', 'Score': '{:.2f}'}
+                    ),
+                    use_container_width=True
+                )
+                st.caption("Uniek: geschat deel van de rijen met een eigen sleutel (steekproef). "
+                           "Overlap: geschat deel van de sleutels dat in beide bronnen voorkomt.")
+            
             # Selectie van sleutelkolommen
             st.write("Selecteer één of meer kolommen die als sleutel gebruikt moeten worden voor de vergelijking:")
             sleutelkolommen = st.multiselect(
                 "Sleutelkolommen",
                 options=gemeenschappelijke_kolommen,
+                default=[col for col in profiel.get('sleutelkolommen', []) if col in gemeenschappelijke_kolommen],
                 help="Deze kolommen worden gebruikt om rijen tussen de twee bestanden te matchen"
             )
+            
+            # Controleer vooraf de koppeling op de gekozen sleutels
+            if sleutelkolommen:
+                toon_sleutelcontrole(df_a, df_b, sleutelkolommen)
 
 with tab3:
     if df_a is not None and df_b is not None:
         st.header("Vergelijking en Resultaten")
         
+        # Kies of alleen de aantallen of de volledige lijst met verschillen nodig is
+        resultaten = ["Volledig", "Alleen samenvatting"]
+        resultaat = st.radio(
+            "Resultaat",
+            resultaten,
+            index=resultaten.index(profiel['resultaat']) if profiel.get('resultaat') in resultaten else 0,
+            horizontal=True,
+            help="Alleen samenvatting telt de verschillen per kolom zonder de volledige lijst op te bouwen. "
+                 "De details kunnen daarna alsnog worden opgevraagd."
+        )
+        
+        # Vergelijkingsregels voor de kolommen die vergeleken worden
+        if gemeenschappelijke_kolommen:
+            regel_kolommen = [col for col in df_a.columns if col in df_b.columns]
+        else:
+            regel_kolommen = list(mapping)
+        regels = kies_regels(regel_kolommen, profiel.get('regels') or {})
+        
         if not gemeenschappelijke_kolommen:
             if mapping:
-                if st.button("Vergelijk met gekoppelde kolommen"):
-                    # Voeg een voortgangsindicator toe
-                    with st.spinner("Vergelijking wordt uitgevoerd..."):
-                        try:
-                            # Hernoem kolommen in df_b volgens de mapping
-                            df_b_mapped = df_b.rename(columns={v: k for k, v in mapping.items()})
-                            
-                            # Voer de vergelijking uit met de gemapte kolommen
-                            verschillen = vergelijk_data(df_a, df_b_mapped, list(mapping.keys()))
-                            
-                            if verschillen.empty:
-                                st.success("Geen verschillen gevonden!")
-                            else:
-                                st.warning(f"Er zijn {len(verschillen)} verschillen gevonden")
-                                
-                                # Toon een overzicht van de verschillen
-                                st.subheader("Overzicht van verschillen")
-                                
-                                # Tel het aantal unieke rijen per type verschil
-                                verschil_types = verschillen['Verschil Type'].value_counts()
-                                
-                                # Toon de verschillen in een tabel
-                                st.subheader("Gedetailleerde verschillen")
-                                st.dataframe(verschillen, use_container_width=True)
-                                
-                                # Download opties
-                                st.subheader("Download verschillen")
-                                download_format = st.radio(
-                                    "Kies download formaat",
-                                    ["Excel", "CSV"],
-                                    horizontal=True
-                                )
-                                
-                                if download_format == "Excel":
-                                    # Maak een Excel bestand met meerdere sheets
-                                    output = io.BytesIO()
-                                    with pd.ExcelWriter(output, engine='openpyxl') as writer:
-                                        # Sheet 1: Alle verschillen
-                                        verschillen.to_excel(writer, sheet_name='Alle verschillen', index=False)
-                                        
-                                        # Sheet 2: Samenvatting per type verschil
-                                        verschil_samenvatting = verschillen.groupby('Verschil Type').agg({
-                                            'Rij': 'count',
-                                            'Kolom': lambda x: ', '.join(sorted(set(x)))
-                                        }).reset_index()
-                                        verschil_samenvatting.columns = ['Type Verschil', 'Aantal', 'Betrokken Kolommen']
-                                        verschil_samenvatting.to_excel(writer, sheet_name='Samenvatting', index=False)
-                                        
-                                        # Sheet 3: Unieke kolommen per bron
-                                        unieke_kolommen = pd.DataFrame({
-                                            'Bron A': sorted(set(df_a.columns) - set(df_b.columns)),
-                                            'Bron B': sorted(set(df_b.columns) - set(df_a.columns))
-                                        })
-                                        unieke_kolommen.to_excel(writer, sheet_name='Unieke kolommen', index=False)
-                                    
-                                    output.seek(0)
-                                    st.download_button(
-                                        label="Download verschillen als Excel",
-                                        data=output,
-                                        file_name="verschillen.xlsx",
-                                        mime="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"
-                                    )
-                                else:
-                                    # Download als CSV
-                                    csv_data = verschillen.to_csv(index=False)
-                                    st.download_button(
-                                        label="Download verschillen als CSV",
-                                        data=csv_data,
-                                        file_name="verschillen.csv",
-                                        mime="text/csv"
-                                    )
-                        except Exception as e:
-                            st.error(f"Er is een fout opgetreden tijdens de vergelijking: {str(e)}")
-                            st.error("Controleer of de geselecteerde kolommen correct zijn en of de data het juiste formaat heeft.")
+                # Hernoem kolommen in df_b volgens de mapping (alleen opnieuw als de mapping wijzigt)
+                df_b_mapped = stadium(pijplijn, 'genormaliseerd', (sleutel_van(df_b), tuple(mapping.items())),
+                                      lambda: hernoem_naar_a(df_b, mapping))
+                
+                # Zonder aangevinkte sleutels zijn alle gekoppelde kolommen de sleutel
+                mapping_sleutels = mapping_sleutels or list(mapping.keys())
+                toon_sleutelcontrole(df_a, df_b_mapped, mapping_sleutels)
+                
+                # Voer de vergelijking uit met de gemapte kolommen
+                voer_vergelijking_uit(df_a, df_b_mapped, mapping_sleutels,
+                                      "Vergelijk met gekoppelde kolommen", engine, resultaat, regels)
             else:
                 st.info("Koppel eerst kolommen aan elkaar in het 'Kolom Mapping' tabblad.")
         else:
             if sleutelkolommen:
-                if st.button("Vergelijk bestanden"):
-                    # Voeg een voortgangsindicator toe
-                    with st.spinner("Vergelijking wordt uitgevoerd..."):
+                voer_vergelijking_uit(df_a, df_b, sleutelkolommen, "Vergelijk bestanden", engine, resultaat, regels)
+                
+                if extra:
+                    st.subheader("Vergelijking met meerdere bronnen")
+                    doelen = {"Bron B": df_b, **extra}
+                    zonder_sleutels = [naam for naam, df in doelen.items()
+                                       if not set(sleutelkolommen) <= set(df.columns)]
+                    if zonder_sleutels:
+                        st.warning(f"De sleutelkolommen ontbreken in: {', '.join(zonder_sleutels)}")
+                    elif st.button("Vergelijk alle bronnen met Bron A"):
                         try:
-                            # Voer de vergelijking uit
-                            verschillen = vergelijk_data(df_a, df_b, sleutelkolommen)
-                            
-                            if verschillen.empty:
-                                st.success("Geen verschillen gevonden!")
-                            else:
-                                st.warning(f"Er zijn {len(verschillen)} verschillen gevonden")
-                                
-                                # Toon een overzicht van de verschillen
-                                st.subheader("Overzicht van verschillen")
-                                
-                                # Tel het aantal unieke rijen per type verschil
-                                verschil_types = verschillen['Verschil Type'].value_counts()
-                                
-                                # Toon de verschillen in een tabel
-                                st.subheader("Gedetailleerde verschillen")
-                                st.dataframe(verschillen, use_container_width=True)
-                                
-                                # Download opties
-                                st.subheader("Download verschillen")
-                                download_format = st.radio(
-                                    "Kies download formaat",
-                                    ["Excel", "CSV"],
-                                    horizontal=True
-                                )
-                                
-                                if download_format == "Excel":
-                                    # Maak een Excel bestand met meerdere sheets
-                                    output = io.BytesIO()
-                                    with pd.ExcelWriter(output, engine='openpyxl') as writer:
-                                        # Sheet 1: Alle verschillen
-                                        verschillen.to_excel(writer, sheet_name='Alle verschillen', index=False)
-                                        
-                                        # Sheet 2: Samenvatting per type verschil
-                                        verschil_samenvatting = verschillen.groupby('Verschil Type').agg({
-                                            'Rij': 'count',
-                                            'Kolom': lambda x: ', '.join(sorted(set(x)))
-                                        }).reset_index()
-                                        verschil_samenvatting.columns = ['Type Verschil', 'Aantal', 'Betrokken Kolommen']
-                                        verschil_samenvatting.to_excel(writer, sheet_name='Samenvatting', index=False)
-                                        
-                                        # Sheet 3: Unieke kolommen per bron
-                                        unieke_kolommen = pd.DataFrame({
-                                            'Bron A': sorted(set(df_a.columns) - set(df_b.columns)),
-                                            'Bron B': sorted(set(df_b.columns) - set(df_a.columns))
-                                        })
-                                        unieke_kolommen.to_excel(writer, sheet_name='Unieke kolommen', index=False)
-                                    
-                                    output.seek(0)
-                                    st.download_button(
-                                        label="Download verschillen als Excel",
-                                        data=output,
-                                        file_name="verschillen.xlsx",
-                                        mime="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"
-                                    )
-                                else:
-                                    # Download als CSV
-                                    csv_data = verschillen.to_csv(index=False)
-                                    st.download_button(
-                                        label="Download verschillen als CSV",
-                                        data=csv_data,
-                                        file_name="verschillen.csv",
-                                        mime="text/csv"
-                                    )
+                            with st.spinner("Bronnen worden vergeleken..."):
+                                toon_meerdere(*vergelijk_meerdere(df_a, doelen, sleutelkolommen, engine,
+                                                                  pijplijn, regels))
                         except Exception as e:
                             st.error(f"Er is een fout opgetreden tijdens de vergelijking: {str(e)}")
-                            st.error("Controleer of de geselecteerde kolommen correct zijn en of de data het juiste formaat heeft.")
+                            logging.error(f"Fout bij vergelijking met meerdere bronnen: {e}")
             else:
                 st.info("Selecteer eerst sleutelkolommen in het 'Kolom Mapping' tabblad.")
+        
+        # Bewaar alle keuzes van deze vergelijking als profiel voor de volgende keer
+        with st.expander("Profiel opslaan"):
+            nieuw_profiel = st.text_input("Naam van het profiel", value=profiel_naam if profiel else "")
+            if st.button("Profiel opslaan") and nieuw_profiel.strip():
+                labels = ["Bron A", "Bron B"] + list(extra)
+                try:
+                    bewaar_profiel(nieuw_profiel, {
+                        'opslag': opslag,
+                        'engine': engine,
+                        'extra_bronnen': extra_bronnen,
+                        'inlees_modus': inlees_modus,
+                        'steekproef': (round(steekproef_fractie * 100) if steekproef_fractie
+                                       else profiel.get('steekproef', 10)),
+                        'inlezen': {label: st.session_state[f"inlezen_{label}"] for label in labels
+                                    if f"inlezen_{label}" in st.session_state},
+                        'mapping': mapping if not gemeenschappelijke_kolommen else {},
+                        'mapping_sleutels': mapping_sleutels if not gemeenschappelijke_kolommen else [],
+                        'sleutelkolommen': sleutelkolommen if gemeenschappelijke_kolommen else [],
+                        'resultaat': resultaat,
+                        'regels': regels,
+                        'download_format': st.session_state.get('download_format', profiel.get('download_format')),
+                    })
+                    st.success(f"Profiel '{nieuw_profiel.strip()}' opgeslagen")
+                except (OSError, ValueError) as e:
+                    st.error(f"Fout bij opslaan profiel: {e}")
+                    logging.error(f"Fout bij opslaan profiel '{nieuw_profiel}': {e}")
     else:
-        st.info("Laad eerst data in het 'Data Inlezen' tabblad.")
+        st.info("Laad eerst data in het 'Data Inlezen' tabblad.")
\ No newline at end of file
@@ -0,0 +1,139 @@
+"""
+Vergelijking met DuckDB als ingebedde, analytische database.
+
+Beide bronnen worden in een DuckDB database in het eigen proces geladen. De full
+outer join, de ongelijkheid per kolom en het resultaat worden door de gevectoriseerde,
+multi-threaded executor van DuckDB berekend. Als het geheugen vol raakt schrijft
+DuckDB tussenresultaten naar een tijdelijke map op schijf.
+"""
+import os
+import tempfile
+
+import numpy as np
+
+from opslag import is_gecodeerd
+from verschillen import WAARDE, Verschillen
+
+try:
+    import duckdb
+except ImportError:
+    duckdb = None
+
+# Aantal rijen waarmee het geheugengebruik van een DataFrame geschat wordt
+SCHAT_RIJEN = 1000
+
+# Map waarin DuckDB tussenresultaten kwijt kan
+TEMP_MAP = os.path.join(tempfile.gettempdir(), "data_vergelijker_duckdb")
+
+
+def schat_geheugen_mb(df):
+    """
+    Schat het geheugengebruik van een DataFrame in MB op basis van de eerste rijen. Van
+    een gecodeerde kolom tellen de codes per rij en de dictionary één keer.
+    """
+    if len(df) == 0:
+        return 0.0
+    steekproef = df.head(SCHAT_RIJEN)
+    totaal = 0
+    for i in range(df.shape[1]):
+        serie = df.iloc[:, i]
+        if is_gecodeerd(serie):
+            totaal += serie.cat.codes.nbytes + serie.cat.categories.memory_usage(deep=True)
+        else:
+            totaal += steekproef.iloc[:, i].memory_usage(deep=True, index=False) * len(df) / len(steekproef)
+    return totaal / (1024 * 1024)
+
+
+def _naam(kolom):
+    """Zet een kolomnaam tussen dubbele quotes voor gebruik in SQL."""
+    return '"' + str(kolom).replace('"', '""') + '"'
+
+
+def _tekst(waarde):
+    """Zet een waarde tussen enkele quotes voor gebruik in SQL."""
+    return "'" + str(waarde).replace("'", "''") + "'"
+
+
+def vergelijk_duckdb(df_a, df_b, key_columns, geheugen_mb=None):
+    """
+    Vergelijk twee DataFrames in DuckDB. Het resultaat bevat dezelfde verschillen in
+    dezelfde volgorde als vergelijk_data. Met `geheugen_mb` blijft DuckDB binnen die
+    limiet en schrijft het de rest naar de tijdelijke map.
+    """
+    if duckdb is None:
+        raise ValueError("Voor de DuckDB engine is het package 'duckdb' nodig")
+
+    vergelijk_kolommen = [col for col in df_a.columns if col not in key_columns and col in df_b.columns]
+
+    os.makedirs(TEMP_MAP, exist_ok=True)
+    con = duckdb.connect()
+    try:
+        con.execute(f"SET temp_directory = {_tekst(TEMP_MAP)}")
+        if geheugen_mb is not None:
+            con.execute(f"SET memory_limit = '{int(geheugen_mb)}MB'")
+        con.register('bron_a', df_a)
+        con.register('bron_b', df_b)
+
+        # Alle waarden als tekst, met '' voor lege waarden (net als in vergelijk_data)
+        def tekst(alias, col):
+            return f"COALESCE(CAST({alias}.{_naam(col)} AS VARCHAR), '')"
+
+        waarden = "".join(
+            f"{tekst('a', c)} AS {_naam(f'{c}_A')}, {tekst('b', c)} AS {_naam(f'{c}_B')}, "
+            for c in vergelijk_kolommen
+        )
+        # Lege sleutels matchen net als bij pandas ook met elkaar
+        join = " AND ".join(f"{tekst('a', k)} = {tekst('b', k)}" for k in key_columns)
+        # pandas zet de rijen per sleutel bij elkaar, op de plek waar de sleutel voor het
+        # eerst voorkomt (in A, of in B voor sleutels die alleen in B staan). Is een van
+        # de bronnen leeg, dan houdt pandas de volgorde van de andere bron aan
+        if len(df_a) and len(df_b):
+            sleutel_a = ", ".join(tekst('a', k) for k in key_columns)
+            sleutel_b = ", ".join(tekst('b', k) for k in key_columns)
+            groep = f"""CASE WHEN a.__positie IS NOT NULL
+                        THEN MIN(a.__positie) OVER (PARTITION BY {sleutel_a})
+                        ELSE MIN(b.__positie) OVER (PARTITION BY {sleutel_b})
+                   END"""
+        else:
+            groep = "COALESCE(a.__positie, b.__positie)"
+        con.execute(f"""
+            CREATE TEMP TABLE samengevoegd AS
+            SELECT {waarden}
+                   a.__positie IS NOT NULL AS in_a,
+                   b.__positie IS NOT NULL AS in_b,
+                   a.__positie AS positie_a,
+                   b.__positie AS positie_b,
+                   {groep} AS groep
+            FROM (SELECT *, row_number() OVER () AS __positie FROM bron_a) a
+            FULL OUTER JOIN (SELECT *, row_number() OVER () AS __positie FROM bron_b) b ON {join}
+        """)
+
+        # Alleen het type, de kolom en de posities gaan terug naar Python; de sleutel en
+        # de waarden worden later uit de bronnen opgehaald
+        delen = [
+            "SELECT 0 AS volgorde, groep, positie_a, positie_b FROM samengevoegd WHERE NOT in_b",
+            "SELECT 1, groep, positie_a, positie_b FROM samengevoegd WHERE NOT in_a",
+        ]
+        for i, col in enumerate(vergelijk_kolommen):
+            col_a = _naam(f"{col}_A")
+            col_b = _naam(f"{col}_B")
+            delen.append(
+                f"SELECT {i + 2}, groep, positie_a, positie_b "
+                f"FROM samengevoegd WHERE in_a AND in_b AND {col_a} <> {col_b}"
+            )
+        # pandas geeft eerst de rijen in de volgorde van Bron A en daarna de rijen die
+        # alleen in Bron B staan; binnen een sleutel alle combinaties van A en B
+        resultaat = con.execute(f"""
+            SELECT volgorde, COALESCE(positie_a - 1, -1) AS rij_a, COALESCE(positie_b - 1, -1) AS rij_b
+            FROM ({' UNION ALL '.join(delen)})
+            ORDER BY volgorde, groep, positie_a NULLS LAST, positie_b
+        """).fetchnumpy()
+    finally:
+        con.close()
+
+    volgorde = resultaat['volgorde']
+    return Verschillen(df_a, df_b, key_columns, vergelijk_kolommen,
+                       typen=np.minimum(volgorde, WAARDE),
+                       kolom_ids=np.where(volgorde >= 2, volgorde - 2, -1),
+                       positie_a=resultaat['rij_a'],
+                       positie_b=resultaat['rij_b'])
@@ -0,0 +1,261 @@
+"""
+Gedeelde cache voor alle sessies in het proces.
+
+Op een gedeelde server heeft elke browsersessie zijn eigen pijplijn. Laden vier
+gebruikers hetzelfde extract, dan staat het vier keer in het geheugen. De stadia van de
+pijplijn zijn bepaald door hun sleutel (een upload wordt herkend aan de hash van de
+inhoud, een bestand op de server aan pad, grootte en wijzigingstijd). Daarom kunnen alle
+sessies één opslag per proces delen:
+
+- een resultaat wordt één keer berekend, ook als meerdere sessies er tegelijk om vragen;
+- elke sessie krijgt een ondiepe kopie van een DataFrame, met de kolommen gedeeld
+  (alleen-lezen) en eigen attrs;
+- boven het geheugenbudget gaan de minst recent gebruikte DataFrames naar schijf en
+  worden ze bij het volgende gebruik weer ingelezen; andere resultaten worden dan
+  opnieuw berekend;
+- een sessie houdt per stadium alleen haar laatste resultaten vast. Resultaten die geen
+  sessie meer vasthoudt worden verwijderd, ook als een sessie eindigt.
+"""
+import itertools
+import logging
+import os
+import pickle
+import tempfile
+import threading
+import weakref
+from collections import OrderedDict
+
+import pandas as pd
+
+from duckdb_engine import schat_geheugen_mb
+from pijplijn import MAX_PER_STADIUM
+from raming import GEHEUGEN_BUDGET_MB
+
+# Deel van het geheugenbudget voor de bewaarde resultaten; de rest is voor de
+# vergelijkingen die lopen
+CACHE_BUDGET_MB = float(os.environ.get('DATA_VERGELIJKER_CACHE_MB') or GEHEUGEN_BUDGET_MB / 2)
+
+# Map voor DataFrames die uit het geheugen naar schijf gaan
+CACHE_MAP = os.path.join(tempfile.gettempdir(), "data_vergelijker_cache")
+
+# Bewaarde waarde voor een stadium dat None oplevert (None betekent: staat op schijf)
+_GEEN = object()
+
+
+def omvang_mb(waarde):
+    """Het geschatte geheugengebruik van een resultaat in MB (kleine resultaten tellen niet)."""
+    if isinstance(waarde, pd.DataFrame):
+        return schat_geheugen_mb(waarde)
+    if hasattr(waarde, 'geheugen_bytes'):
+        # Verschillen verwijzen naar de bronnen en houden die in het geheugen, ook als de
+        # bronnen zelf naar schijf gaan; tel ze mee, zodat het verwijderen van de
+        # verschillen ook het geheugen van de bronnen vrijgeeft
+        bronnen = [getattr(waarde, 'df_a', None), getattr(waarde, 'df_b', None)]
+        return waarde.geheugen_bytes() / (1024 * 1024) + sum(omvang_mb(bron) for bron in bronnen)
+    if isinstance(waarde, tuple):
+        return sum(omvang_mb(deel) for deel in waarde)
+    return 0.0
+
+
+def _uitgifte(waarde):
+    """Een DataFrame als ondiepe kopie, zodat een sessie de gedeelde attrs niet wijzigt."""
+    if waarde is _GEEN:
+        return None
+    if isinstance(waarde, pd.DataFrame):
+        return waarde.copy(deep=False)
+    return waarde
+
+
+class _Item:
+    """Een bewaard resultaat: de waarde (None als die op schijf staat) en de sessies die het vasthouden."""
+
+    def __init__(self, waarde, mb):
+        self.waarde = waarde
+        self.mb = mb
+        self.pad = None
+        self.sessies = set()
+
+
+class GedeeldeOpslag:
+    """
+    De resultaten van alle sessies, met een geheugenbudget en LRU. Kan vanuit meerdere
+    threads (sessies) gebruikt worden; berekenen, inlezen en wegschrijven gebeuren
+    buiten het slot.
+    """
+
+    def __init__(self, budget_mb=CACHE_BUDGET_MB, map=CACHE_MAP):
+        self.budget_mb = budget_mb
+        self.map = map
+        self._items = OrderedDict()
+        self._bezig = {}
+        self._slot = threading.Lock()
+        self._nummers = itertools.count()
+
+    def geheugen_mb(self):
+        """Het geheugengebruik van de resultaten die in het geheugen staan."""
+        with self._slot:
+            return sum(item.mb for item in self._items.values() if item.waarde is not None)
+
+    def haal(self, sleutel, bereken, sessie):
+        """
+        Geef het resultaat voor `sleutel` aan `sessie`: uit het geheugen, van schijf of
+        berekend. Vraagt een andere sessie hetzelfde resultaat al op, dan wordt daarop gewacht.
+        """
+        while True:
+            with self._slot:
+                item = self._items.get(sleutel)
+                if item is not None and item.waarde is not None:
+                    self._items.move_to_end(sleutel)
+                    item.sessies.add(sessie)
+                    logging.info(f"Stadium '{sleutel[0]}' uit de gedeelde cache")
+                    return _uitgifte(item.waarde)
+                klaar = self._bezig.get(sleutel)
+                if klaar is None:
+                    klaar = self._bezig[sleutel] = threading.Event()
+                    break
+            klaar.wait()
+
+        try:
+            waarde = self._van_schijf(item) if item is not None and item.pad is not None else None
+            if waarde is None:
+                waarde = bereken()
+                if waarde is None:
+                    waarde = _GEEN
+                elif isinstance(waarde, pd.DataFrame):
+                    waarde.attrs['sleutel'] = sleutel
+            with self._slot:
+                item = self._items.get(sleutel)
+                if item is None:
+                    item = self._items[sleutel] = _Item(waarde, omvang_mb(waarde))
+                item.waarde = waarde
+                item.sessies.add(sessie)
+                self._items.move_to_end(sleutel)
+                weg = self._kies_weg()
+        finally:
+            with self._slot:
+                del self._bezig[sleutel]
+            klaar.set()
+        self._naar_schijf(weg)
+        return _uitgifte(waarde)
+
+    def laat_los(self, sleutels, sessie):
+        """Een sessie houdt deze resultaten niet meer vast; resultaten zonder sessie vervallen."""
+        paden = []
+        with self._slot:
+            for sleutel in sleutels:
+                item = self._items.get(sleutel)
+                if item is None:
+                    continue
+                item.sessies.discard(sessie)
+                if not item.sessies and sleutel not in self._bezig:
+                    del self._items[sleutel]
+                    paden.append(item.pad)
+        for pad in paden:
+            self._verwijder(pad)
+
+    def _kies_weg(self):
+        """
+        Kies de minst recent gebruikte resultaten die uit het geheugen moeten (onder het
+        slot). DataFrames worden als 'bezig' gemarkeerd tot ze op schijf staan; andere
+        resultaten worden verwijderd.
+        """
+        totaal = sum(item.mb for item in self._items.values() if item.waarde is not None)
+        weg = []
+        for sleutel, item in list(self._items.items())[:-1]:
+            if totaal <= self.budget_mb:
+                break
+            if item.waarde is None or item.mb == 0 or sleutel in self._bezig:
+                continue
+            totaal -= item.mb
+            if isinstance(item.waarde, pd.DataFrame):
+                self._bezig[sleutel] = threading.Event()
+                weg.append((sleutel, item, item.waarde))
+                item.waarde = None
+            else:
+                del self._items[sleutel]
+        return weg
+
+    def _naar_schijf(self, weg):
+        """Schrijf de gekozen DataFrames naar schijf (buiten het slot)."""
+        for sleutel, item, waarde in weg:
+            try:
+                os.makedirs(self.map, exist_ok=True)
+                pad = os.path.join(self.map, f"{os.getpid()}_{next(self._nummers)}.pkl")
+                with open(pad, 'wb') as f:
+                    pickle.dump(waarde, f, protocol=pickle.HIGHEST_PROTOCOL)
+                item.pad = pad
+                logging.info(f"Stadium '{sleutel[0]}' ({item.mb:.0f} MB) naar schijf")
+            except OSError as e:
+                logging.error(f"Stadium '{sleutel[0]}' kan niet naar schijf: {e}")
+            finally:
+                with self._slot:
+                    # Zonder bestand, of als geen sessie het resultaat nog vasthoudt, vervalt het
+                    vervallen = item.pad is None or not item.sessies
+                    if vervallen and self._items.get(sleutel) is item:
+                        del self._items[sleutel]
+                    klaar = self._bezig.pop(sleutel)
+                klaar.set()
+                if vervallen:
+                    self._verwijder(item.pad)
+
+    def _van_schijf(self, item):
+        """Lees een DataFrame weer van schijf (None als het bestand weg is)."""
+        try:
+            with open(item.pad, 'rb') as f:
+                waarde = pickle.load(f)
+        except (OSError, TypeError, pickle.UnpicklingError) as e:
+            logging.error(f"Resultaat kan niet van schijf gelezen worden: {e}")
+            return None
+        self._verwijder(item.pad)
+        item.pad = None
+        return waarde
+
+    @staticmethod
+    def _verwijder(pad):
+        if pad is None:
+            return
+        try:
+            os.remove(pad)
+        except OSError:
+            pass
+
+
+class SessieCache:
+    """
+    De cache van één sessie op de gedeelde opslag, met dezelfde `haal` en `leeg` als
+    StadiumCache. Per stadium houdt de sessie de laatste `max_per_stadium` resultaten
+    vast. Als de sessie eindigt (en deze cache opgeruimd wordt) laat ze alles los.
+    """
+
+    def __init__(self, opslag, max_per_stadium=MAX_PER_STADIUM):
+        self.opslag = opslag
+        self.max_per_stadium = max_per_stadium
+        self._sessie = object()
+        self._stadia = {}
+        self._vast = set()
+        self._slot = threading.Lock()
+        weakref.finalize(self, opslag.laat_los, self._vast, self._sessie)
+
+    def haal(self, stadium, sleutel, bereken):
+        """Geef het resultaat voor `sleutel` uit de gedeelde opslag en houd het vast."""
+        volledig = (stadium, sleutel)
+        resultaat = self.opslag.haal(volledig, bereken, self._sessie)
+        with self._slot:
+            resultaten = self._stadia.setdefault(stadium, OrderedDict())
+            resultaten[volledig] = True
+            resultaten.move_to_end(volledig)
+            self._vast.add(volledig)
+            los = []
+            while len(resultaten) > self.max_per_stadium:
+                los.append(resultaten.popitem(last=False)[0])
+            self._vast.difference_update(los)
+        self.opslag.laat_los(los, self._sessie)
+        return resultaat
+
+    def leeg(self):
+        """Laat alle resultaten van deze sessie los."""
+        with self._slot:
+            los = list(self._vast)
+            self._stadia.clear()
+            self._vast.clear()
+        self.opslag.laat_los(los, self._sessie)
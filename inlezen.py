@@ -0,0 +1,929 @@
+"""
+Hulpfuncties voor het inlezen van (grote) CSV en Excel bestanden.
+
+Grote CSV bestanden worden opgesplitst in byte-blokken die altijd op een
+recordgrens eindigen. Elk blok wordt in een apart proces door pandas ingelezen en
+de blokken worden daarna in de oorspronkelijke volgorde weer aan elkaar geplakt.
+
+Excel bestanden worden in read-only modus rij voor rij gelezen, zodat het inlezen
+stopt zodra het maximale aantal rijen bereikt is.
+
+Bestanden op de server (in de mappen uit DATA_VERGELIJKER_MAPPEN) worden via
+memory mapping gelezen, zonder kopie in het geheugen van de upload.
+
+Gecomprimeerde CSV bestanden (gzip, zstd of zip) worden tijdens het inlezen
+gedecomprimeerd en als stroom aan pandas gegeven.
+
+Regels met te veel velden slaat de snelle C parser van pandas over. De nummers van
+die regels worden opgevangen; daarna worden alleen die regels uit het bestand gehaald
+en opnieuw gelezen met de tolerante csv module. Herstelde rijen komen achter alle
+ingelezen rijen (bij parallel inlezen na het laatste blok), en het overzicht van alle
+overgeslagen regels staat in df.attrs['quarantaine'].
+
+Alle inleesfuncties kennen een optionele functie `kies` die per blok een masker met
+de rijen geeft die bewaard worden (zoals een steekproef op sleutel). Zo komt alleen
+de selectie in het geheugen, niet het hele bestand.
+"""
+import contextlib
+import csv
+import gzip
+import hashlib
+import io
+import logging
+import mmap
+import os
+import re
+import sys
+import threading
+import zipfile
+import zlib
+from collections import OrderedDict, deque
+from concurrent.futures import ProcessPoolExecutor
+from itertools import chain, islice
+
+import numpy as np
+import openpyxl
+import pandas as pd
+
+# Waarden die als leeg worden gezien bij het inlezen
+NA_WAARDEN = ['', 'nan', 'NaN', 'NULL', 'null']
+
+# Vanaf deze bestandsgrootte (in bytes) wordt parallel ingelezen
+PARALLEL_DREMPEL = 32 * 1024 * 1024
+
+# Doelgrootte van een blok bij parallel inlezen
+BLOK_GROOTTE = 16 * 1024 * 1024
+
+# Stapgrootte bij het doorzoeken van een memory-mapped bestand
+MMAP_STAP = 1024 * 1024
+
+# Gecomprimeerde bestandstypen (met een CSV bestand erin)
+COMPRESSIE_TYPEN = ["gz", "zst", "zip"]
+
+# Bestandstypen die ingelezen kunnen worden
+BESTANDSTYPEN = ["csv", "xls", "xlsx"] + COMPRESSIE_TYPEN
+
+# Buffergrootte bij het lezen van een gedecomprimeerde stroom
+STROOM_BUFFER = 1024 * 1024
+
+# De compressieverhouding van gzip en zstd wordt gemeten op hooguit zoveel gecomprimeerde
+# of gedecomprimeerde bytes
+COMPRESSIE_STEEKPROEF = 4 * 1024 * 1024
+UITGEPAKT_STEEKPROEF = 16 * 1024 * 1024
+
+# Aantal rijen per blok als er tijdens het inlezen een selectie gemaakt wordt
+SELECTIE_RIJEN = 200000
+
+# Tekens waarna een quote een veld opent als het scheidingsteken nog niet bekend is
+SCHEIDINGSTEKENS = b',;\t|'
+
+# Aantal uploads waarvan de hash van de inhoud onthouden wordt
+MAX_HASHES = 64
+
+# Melding van de C parser van pandas bij een overgeslagen regel (on_bad_lines='warn')
+_OVERGESLAGEN = re.compile(r'Skipping line (\d+): expected \d+ fields, saw \d+')
+
+# Status van een overgeslagen regel in de quarantaine
+HERSTELD = 'Hersteld'
+AFGEWEZEN = 'Afgewezen'
+QUARANTAINE_KOLOMMEN = ['Regel', 'Status', 'Reden', 'Inhoud']
+
+# Meldingen van de parser per thread, zodat sessies elkaars regels niet opvangen
+_meldingen = threading.local()
+_stderr_slot = threading.Lock()
+
+# Hash van de inhoud per upload (file_id), zodat elke upload maar één keer gehasht wordt
+_inhoud_hashes = OrderedDict()
+_hashes_slot = threading.Lock()
+
+
+def toegestane_mappen():
+    """
+    Geef de mappen op de server waaruit bestanden gelezen mogen worden. Deze komen
+    uit de environment variabele DATA_VERGELIJKER_MAPPEN (gescheiden door os.pathsep).
+    """
+    mappen = os.environ.get('DATA_VERGELIJKER_MAPPEN', '')
+    return [os.path.realpath(m) for m in mappen.split(os.pathsep) if m.strip()]
+
+
+class ServerBestand:
+    """
+    Een bestand op de server dat via memory mapping gelezen wordt. Heeft dezelfde
+    `name` en `getvalue()` als een Streamlit upload, maar zonder kopie in het geheugen.
+    """
+
+    def __init__(self, pad):
+        self.pad = pad
+        self.name = os.path.basename(pad)
+        self._bestand = None
+        self._mmap = None
+
+    def getvalue(self):
+        if self._mmap is None:
+            self._bestand = open(self.pad, 'rb')
+            if os.fstat(self._bestand.fileno()).st_size == 0:
+                # Een leeg bestand kan niet gemapt worden
+                return b''
+            self._mmap = mmap.mmap(self._bestand.fileno(), 0, access=mmap.ACCESS_READ)
+        return self._mmap
+
+    def close(self):
+        if self._mmap is not None:
+            self._mmap.close()
+            self._mmap = None
+        if self._bestand is not None:
+            self._bestand.close()
+            self._bestand = None
+
+
+def inhoud_hash(file):
+    """De hash van de inhoud van een upload, één keer berekend per upload."""
+    with _hashes_slot:
+        if file.file_id in _inhoud_hashes:
+            return _inhoud_hashes[file.file_id]
+    with file.getbuffer() as buffer:
+        inhoud = hashlib.blake2b(buffer, digest_size=16).hexdigest()
+    with _hashes_slot:
+        _inhoud_hashes[file.file_id] = inhoud
+        while len(_inhoud_hashes) > MAX_HASHES:
+            _inhoud_hashes.popitem(last=False)
+    return inhoud
+
+
+def bron_sleutel(file):
+    """
+    Een sleutel die een bestand identificeert: pad, grootte en wijzigingstijd op de
+    server (zonder de inhoud te lezen), of grootte en hash van de inhoud van een upload.
+    Zo herkennen alle sessies dezelfde upload, ook onder een andere naam.
+    """
+    if isinstance(file, ServerBestand):
+        info = os.stat(file.pad)
+        return ('server', file.pad, info.st_size, info.st_mtime_ns)
+    if getattr(file, 'file_id', None) is None:
+        return None
+    return ('upload', file.size, inhoud_hash(file))
+
+
+def open_server_bestand(pad):
+    """
+    Controleer of het pad binnen de toegestane mappen valt en een ondersteund
+    bestand is, en geef een ServerBestand terug.
+    """
+    mappen = toegestane_mappen()
+    if not mappen:
+        raise ValueError("Er zijn geen mappen op de server geconfigureerd (DATA_VERGELIJKER_MAPPEN)")
+    volledig_pad = os.path.realpath(pad.strip())
+    if not any(os.path.commonpath([volledig_pad, m]) == m for m in mappen):
+        raise ValueError("Het pad valt buiten de toegestane mappen op de server")
+    if not os.path.isfile(volledig_pad):
+        raise ValueError(f"Bestand niet gevonden: {pad}")
+    if volledig_pad.split('.')[-1].lower() not in BESTANDSTYPEN:
+        raise ValueError(f"Alleen deze bestandstypen worden ondersteund: {', '.join(BESTANDSTYPEN)}")
+    return ServerBestand(volledig_pad)
+
+
+def is_leeg(data):
+    """Controleer of data alleen uit witruimte bestaat, zonder een kopie te maken."""
+    if hasattr(data, 'isspace'):
+        return not data or data.isspace()
+    for pos in range(0, len(data), MMAP_STAP):
+        if not data[pos:pos + MMAP_STAP].isspace():
+            return False
+    return True
+
+
+def stukken_van(data, begin=0, eind=None):
+    """data[begin:eind] (bytes of mmap) in stukken van MMAP_STAP bytes."""
+    eind = len(data) if eind is None else eind
+    return (data[pos:min(pos + MMAP_STAP, eind)] for pos in range(begin, eind, MMAP_STAP))
+
+
+def _hele_quotes(stukken, quotechar=b'"'):
+    """De stukken zo aangepast dat een reeks quotes nooit over twee stukken verdeeld is."""
+    rest = b''
+    for stuk in stukken:
+        if rest:
+            stuk = rest + bytes(stuk)
+        eind = len(stuk)
+        while eind and stuk[eind - 1] == quotechar[0]:
+            eind -= 1
+        rest = stuk[eind:]
+        if eind:
+            yield stuk[:eind]
+    if rest:
+        yield rest
+
+
+def _record_eindes(stuk, staat, separator=None, quotechar=b'"'):
+    """
+    De posities van de regelbreuken buiten quotes in een stuk bytes, zoals de C parser
+    van pandas ze ziet: een quote opent alleen aan het begin van een veld een veld met
+    quotes (in '5" disk' is de quote een gewoon teken) en binnen quotes is "" een quote
+    in de waarde. `staat` is (binnen quotes, vorige byte) aan het begin van het stuk;
+    retourneert de posities en de staat na het stuk.
+
+    De staat verandert alleen bij een reeks aaneengesloten quotes. Een even reeks
+    verandert niets; een oneven reeks aan het begin van een veld opent of sluit (wisselt),
+    een oneven reeks midden in een veld sluit of is een gewoon teken (dus daarna buiten
+    quotes). Zo wordt de staat per regelbreuk met numpy bepaald, zonder lus per teken.
+    """
+    waarden = np.frombuffer(stuk, dtype=np.uint8)
+    binnen, vorige = staat
+    regelbreuken = np.flatnonzero(waarden == ord('\n'))
+    quotes = np.flatnonzero(waarden == quotechar[0])
+    laatste_byte = int(waarden[-1]) if len(waarden) else vorige
+    if len(quotes) == 0:
+        return (regelbreuken[:0] if binnen else regelbreuken), (binnen, laatste_byte)
+
+    nieuw = np.ones(len(quotes), dtype=bool)
+    nieuw[1:] = quotes[1:] != quotes[:-1] + 1
+    reeks_begin = quotes[nieuw]
+    oneven = np.diff(np.append(np.flatnonzero(nieuw), len(quotes))) % 2 == 1
+    ervoor = np.where(reeks_begin > 0, waarden[np.maximum(reeks_begin - 1, 0)], vorige)
+    tekens = (separator.encode() if separator else SCHEIDINGSTEKENS) + b'\r\n'
+    veld_begin = np.isin(ervoor, np.frombuffer(tekens, dtype=np.uint8))
+
+    # Staat na de eerste i reeksen: het aantal wissels sinds de laatste reeks die sluit
+    wissels = np.concatenate([[0], np.cumsum(veld_begin & oneven)])
+    sluit = np.where(~veld_begin & oneven, np.arange(1, len(reeks_begin) + 1), 0)
+    laatste_sluit = np.maximum.accumulate(np.concatenate([[0], sluit]))
+    staten = np.where(laatste_sluit > 0, wissels - wissels[laatste_sluit], wissels + int(binnen)) % 2
+    buiten = staten[np.searchsorted(reeks_begin, regelbreuken)] == 0
+    return regelbreuken[buiten], (bool(staten[-1]), laatste_byte)
+
+
+def _scan_records(stukken, separator=None):
+    """Per stuk (met de quotes heel) het stuk, de positie in de invoer en de record-eindes erin."""
+    staat = (False, ord('\n'))
+    positie = 0
+    for stuk in _hele_quotes(stukken):
+        eindes, staat = _record_eindes(stuk, staat, separator)
+        yield stuk, positie, eindes
+        positie += len(stuk)
+
+
+def laatste_recordgrens(data, separator=None):
+    """De positie direct na het laatste volledige record in `data` (0 als er geen is)."""
+    grens = 0
+    for _, positie, eindes in _scan_records(stukken_van(data), separator):
+        if len(eindes):
+            grens = int(eindes[-1]) + positie + 1
+    return grens
+
+
+def einde_eerste_record(data, separator=None, quotechar=b'"'):
+    """
+    Geef de positie direct na het eerste record (de kopregel) terug.
+    Regelbreuken binnen quotes horen nog bij het record.
+    """
+    return volgende_recordgrens(data, 0, 0, quotechar, separator)
+
+
+def volgende_recordgrens(data, vanaf, begin=0, quotechar=b'"', separator=None):
+    """
+    Zoek de eerste regelbreuk vanaf positie `vanaf` die niet binnen quotes valt en
+    geef de positie direct daarna terug. `begin` moet zelf een recordgrens zijn.
+    Zonder `separator` opent een quote na een komma, puntkomma, tab of | een veld.
+    """
+    for _, positie, eindes in _scan_records(stukken_van(data, begin), separator):
+        eindes = eindes[eindes + positie + begin >= vanaf]
+        if len(eindes):
+            return int(eindes[0]) + positie + begin + 1
+    return len(data)
+
+
+def bepaal_blokgrenzen(data, start, blok_grootte=BLOK_GROOTTE, quotechar=b'"', separator=None):
+    """
+    Verdeel data[start:] in blokken van ongeveer `blok_grootte` bytes. Elke grens
+    valt direct na een regelbreuk die buiten quotes ligt, zodat een veld als
+    "8;796;093;067;146,00" nooit over twee blokken verdeeld wordt.
+    """
+    eind = len(data)
+    grenzen = [start]
+    volgende = start + blok_grootte
+    for _, positie, eindes in _scan_records(stukken_van(data, start), separator):
+        eindes = eindes + positie + start
+        while volgende < eind:
+            na = eindes[eindes >= volgende]
+            if not len(na) or na[0] + 1 >= eind:
+                break
+            grenzen.append(int(na[0]) + 1)
+            volgende = grenzen[-1] + blok_grootte
+        if volgende >= eind:
+            break
+    grenzen.append(eind)
+    return grenzen
+
+
+def csv_opties(separator, headers):
+    """
+    De opties voor pd.read_csv die voor alle inleespaden gelijk zijn. De kopregel wordt
+    gelezen en door `headers` vervangen; zo bepaalt de kopregel het aantal velden en
+    worden korte rijen aangevuld, ook als geen enkele rij alle velden heeft.
+    """
+    return dict(sep=separator,
+                names=headers,
+                header=0,
+                dtype=str,  # Alles als string inlezen
+                na_values=NA_WAARDEN,
+                keep_default_na=True,
+                quoting=csv.QUOTE_MINIMAL,
+                quotechar='"',
+                on_bad_lines='warn')
+
+
+class _StderrPerThread:
+    """
+    Vervangt sys.stderr: wat de parser schrijft gaat naar de opvang van de huidige
+    thread als die er is, en anders naar de oorspronkelijke stderr.
+    """
+
+    def __init__(self, origineel):
+        self.origineel = origineel
+
+    def write(self, tekst):
+        opvang = getattr(_meldingen, 'opvang', None)
+        if opvang is None:
+            return self.origineel.write(tekst)
+        opvang.append(tekst)
+        return len(tekst)
+
+    def __getattr__(self, naam):
+        return getattr(self.origineel, naam)
+
+
+@contextlib.contextmanager
+def overgeslagen_regels():
+    """
+    Vang in deze thread de meldingen van de C parser op. Na afloop bevat de lijst de
+    nummers van de overgeslagen regels (1 is de eerste regel van de invoer); andere
+    meldingen gaan alsnog naar stderr.
+    """
+    with _stderr_slot:
+        if not isinstance(sys.stderr, _StderrPerThread):
+            sys.stderr = _StderrPerThread(sys.stderr)
+    _meldingen.opvang = opvang = []
+    nummers = []
+    try:
+        yield nummers
+    finally:
+        _meldingen.opvang = None
+        tekst = ''.join(opvang)
+        nummers.extend(int(nummer) for nummer in _OVERGESLAGEN.findall(tekst))
+        rest = _OVERGESLAGEN.sub('', tekst).strip()
+        if rest:
+            sys.stderr.write(rest + '\n')
+
+
+def stukken_van_stroom(stroom):
+    """Een (gedecomprimeerde) stroom in stukken van STROOM_BUFFER bytes."""
+    return iter(lambda: stroom.read(STROOM_BUFFER), b'')
+
+
+def _records_uit_stroom(stroom, nummers, separator, heropen=None):
+    """
+    Haal de records met de gegeven nummers uit een stroom die al gelezen is: via een
+    nieuwe stroom van `heropen` (zoals open_gedecomprimeerd), of door de stroom terug te
+    zetten. Kan geen van beide, dan is de tekst van de records None.
+    """
+    if heropen is not None:
+        with heropen() as opnieuw:
+            return zoek_records(stukken_van_stroom(opnieuw), nummers, separator)
+    try:
+        stroom.seek(0)
+    except (OSError, ValueError, io.UnsupportedOperation):
+        return [(nummer, None) for nummer in nummers]
+    return zoek_records(stukken_van_stroom(stroom), nummers, separator)
+
+
+def tel_records(stukken, separator=None):
+    """Het aantal records (regelbreuken buiten quotes) in een reeks stukken bytes."""
+    return sum(len(eindes) for _, _, eindes in _scan_records(stukken, separator))
+
+
+def zoek_records(stukken, nummers, separator=None):
+    """
+    Haal de records met de gegeven nummers (1 is het eerste record) uit een reeks
+    stukken bytes, zoals de parser van pandas ze telt: een record eindigt bij een
+    regelbreuk buiten quotes. Retourneert een lijst met (nummer, tekst); de tekst is
+    None als het record niet gevonden is.
+    """
+    gezocht = sorted(set(nummers))
+    gevonden = {}
+    i = 0
+    nummer = 1
+    deel = []  # Het begin van het gezochte record dat in het vorige stuk begon
+    for stuk, _, eindes in _scan_records(stukken, separator):
+        if i == len(gezocht):
+            break
+        # Record nummer + j eindigt bij eindes[j]
+        volgende = nummer + len(eindes)
+        while i < len(gezocht) and gezocht[i] < volgende:
+            j = gezocht[i] - nummer
+            begin = eindes[j - 1] + 1 if j else 0
+            gevonden[gezocht[i]] = (b''.join(deel) if j == 0 else b'') + bytes(stuk[begin:eindes[j]])
+            i += 1
+        if i < len(gezocht) and gezocht[i] == volgende:
+            start = eindes[-1] + 1 if len(eindes) else 0
+            deel = (deel if volgende == nummer else []) + [bytes(stuk[start:])]
+        else:
+            deel = []
+        nummer = volgende
+    if deel and i < len(gezocht) and gezocht[i] == nummer:
+        # Het laatste record zonder regelbreuk aan het eind
+        gevonden[nummer] = b''.join(deel)
+    return [(n, gevonden[n].rstrip(b'\r').decode('utf-8', errors='replace') if n in gevonden else None)
+            for n in gezocht]
+
+
+def _lees_velden(tekst, separator, **opties):
+    return next(csv.reader(io.StringIO(tekst, newline=''), delimiter=separator, quotechar='"', **opties), [])
+
+
+def te_lange_rijen(data, begin, separator, headers, eerste=1):
+    """
+    De records met te veel velden aan het begin van `data`, vanaf positie `begin` (een
+    recordgrens) tot het eerste niet-lege record dat past; dat eerste record heeft
+    nummer `eerste`. Pandas slaat zulke rijen aan het begin niet over: de extra velden
+    van de eerste worden de index en volgende rijen met evenveel velden worden zonder
+    melding afgekapt. Retourneert een lijst met (nummer, tekst) en de positie achter
+    het laatste te lange record (`begin` als er geen is).
+    """
+    rijen = []
+    nummer = eerste
+    positie = begin
+    while begin < len(data):
+        eind = volgende_recordgrens(data, begin, begin, separator=separator)
+        tekst = bytes(data[begin:eind]).rstrip(b'\r\n').decode('utf-8', errors='replace')
+        if tekst.strip():
+            if len(_lees_velden(tekst, separator)) <= len(headers):
+                break
+            rijen.append((nummer, tekst))
+            positie = eind
+        begin = eind
+        nummer += 1
+    return rijen, positie
+
+
+class _StukkenStroom(io.RawIOBase):
+    """Een stroom over een reeks stukken bytes, zonder ze aan elkaar te plakken."""
+
+    def __init__(self, stukken):
+        self.stukken = iter(stukken)
+        self.stuk = memoryview(b'')
+
+    def readable(self):
+        return True
+
+    def readinto(self, buffer):
+        while not len(self.stuk):
+            stuk = next(self.stukken, None)
+            if stuk is None:
+                return 0
+            self.stuk = memoryview(stuk)
+        aantal = min(len(buffer), len(self.stuk))
+        buffer[:aantal] = self.stuk[:aantal]
+        self.stuk = self.stuk[aantal:]
+        return aantal
+
+
+def met_kopregel(kop, stukken):
+    """
+    De kopregel gevolgd door de stukken, als stroom voor pandas. Zo worden records na
+    de kopregel weggelaten; skiprows kan dat niet, omdat pandas daarin een regelbreuk
+    binnen quotes niet altijd herkent (zoals in ';"a<regelbreuk>b"').
+    """
+    return io.BufferedReader(_StukkenStroom(chain([kop], stukken)), buffer_size=STROOM_BUFFER)
+
+
+def _lees_pandas(bron, separator, headers, nrows=None, kies=None, weggelaten=0, **opties):
+    """
+    Lees een CSV met kopregel in met pandas; met `kies` in blokken met per blok de
+    selectie. `weggelaten` is het aantal records dat direct na de kopregel uit de bron
+    is gelaten. Retourneert de rijen en de nummers van de overgeslagen regels.
+    """
+    opties = dict(opties, **csv_opties(separator, headers))
+    if kies is not None:
+        df, nummers = _in_blokken(bron, nrows, kies, opties)
+    else:
+        with overgeslagen_regels() as nummers:
+            df = pd.read_csv(bron, nrows=nrows, **opties)
+    if df.empty:
+        # Zonder rijen geeft pandas soms een lege Index in plaats van een RangeIndex
+        df = df.reset_index(drop=True)
+    return df, [nummer + weggelaten for nummer in nummers]
+
+
+def herstel_records(records, separator, headers):
+    """
+    Lees overgeslagen records opnieuw met de tolerante csv module. Een record wordt
+    hersteld als het na het weglaten van lege velden aan het eind, of met quotes na een
+    spatie (' "1;280,00"'), precies zoveel velden heeft als er kolommen zijn. Een record
+    met te weinig velden (zoals de Arrow lezer die meldt) wordt net als door pandas
+    aangevuld met lege waarden. Retourneert de herstelde rijen (met None voor lege
+    waarden) en het overzicht van alle records als lijst met (regel, status, reden,
+    inhoud).
+    """
+    rijen = []
+    overzicht = []
+    for nummer, tekst in records:
+        if tekst is None:
+            overzicht.append((nummer, AFGEWEZEN, "Regel niet terug te lezen", None))
+            continue
+        velden = _lees_velden(tekst, separator)
+        if len(velden) < len(headers):
+            reden = f"Te weinig velden ({len(velden)} van {len(headers)}), aangevuld"
+            velden += [''] * (len(headers) - len(velden))
+        else:
+            while len(velden) > len(headers) and not velden[-1].strip():
+                velden.pop()
+            reden = "Lege velden aan het eind"
+        if len(velden) != len(headers):
+            velden = _lees_velden(tekst, separator, skipinitialspace=True)
+            reden = "Quotes na een spatie"
+        if len(velden) == len(headers):
+            rijen.append([None if waarde in NA_WAARDEN else waarde for waarde in velden])
+            overzicht.append((nummer, HERSTELD, reden, tekst))
+        else:
+            overzicht.append((nummer, AFGEWEZEN, f"Te veel velden ({len(velden)} van {len(headers)})", tekst))
+    return pd.DataFrame(rijen, columns=headers, dtype=object), overzicht
+
+
+def met_quarantaine(df, records, separator, headers, kies=None, nrows=None):
+    """
+    Voeg de herstelde records toe aan de ingelezen rijen en bewaar het overzicht van
+    de overgeslagen records in df.attrs['quarantaine'] (als lijst, zodat pandas de attrs
+    van twee DataFrames kan vergelijken).
+    """
+    if not records:
+        return df
+    hersteld, overzicht = herstel_records(records, separator, headers)
+    if len(hersteld):
+        df = pd.concat([df, selecteer(hersteld, kies).astype(df.dtypes.to_dict())], ignore_index=True)
+        if nrows is not None:
+            df = df.iloc[:nrows]
+    df.attrs['quarantaine'] = overzicht
+    logging.warning(f"{len(overzicht)} ongeldige regels: {len(hersteld)} hersteld, "
+                    f"{len(overzicht) - len(hersteld)} afgewezen")
+    return df
+
+
+def quarantaine_tabel(quarantaine):
+    """Het overzicht uit df.attrs['quarantaine'] als DataFrame."""
+    return pd.DataFrame(quarantaine, columns=QUARANTAINE_KOLOMMEN)
+
+
+def selecteer(df, kies):
+    """Bewaar alleen de rijen die `kies` aanwijst (alle rijen zonder `kies`)."""
+    if kies is None:
+        return df
+    return df[kies(df)].reset_index(drop=True)
+
+
+def _in_blokken(bron, nrows, kies, opties):
+    """
+    Lees een CSV in blokken van SELECTIE_RIJEN rijen en bewaar per blok de selectie.
+    Retourneert de rijen en de nummers van de overgeslagen regels.
+    """
+    with overgeslagen_regels() as nummers:
+        delen = [selecteer(blok, kies) for blok in pd.read_csv(bron, chunksize=SELECTIE_RIJEN, **opties)]
+    if not delen:
+        return pd.DataFrame(columns=opties['names'], dtype=object), nummers
+    df = pd.concat(delen, ignore_index=True)
+    return (df.iloc[:nrows] if nrows is not None else df), nummers
+
+
+def lees_csv_blok(blok, kop, separator, headers, kies=None):
+    """
+    Lees één blok (bytes zonder kopregel) in met dezelfde opties als het hoofdpad. De
+    kopregel `kop` wordt voor het blok gezet, zodat de parser het blok net zo leest als
+    in één keer. Retourneert de rijen en de overgeslagen records als (nummer, tekst),
+    met de kopregel als regel 1; die worden pas na het samenvoegen van de blokken
+    hersteld, net als in één keer achter alle rijen.
+    """
+    te_lang, na = te_lange_rijen(blok, 0, separator, headers, eerste=2)
+    df, nummers = _lees_pandas(met_kopregel(kop, stukken_van(blok, na)), separator, headers, kies=kies,
+                               weggelaten=te_lang[-1][0] - 1 if te_lang else 0)
+    records = zoek_records(chain([kop], stukken_van(blok)), nummers, separator) if nummers else []
+    return df, te_lang + records
+
+
+def lees_csv_bereik(pad, begin, eind, kop, separator, headers, kies=None):
+    """Lees het byte-bereik [begin, eind) van een bestand op de server in via mmap."""
+    with open(pad, 'rb') as bestand, \
+            mmap.mmap(bestand.fileno(), 0, access=mmap.ACCESS_READ) as data:
+        return lees_csv_blok(data[begin:eind], kop, separator, headers, kies)
+
+
+def lees_csv_parallel(data, separator, headers, nrows=None, max_workers=None,
+                      blok_grootte=BLOK_GROOTTE, pad=None, kies=None):
+    """
+    Lees de CSV in `data` (bytes of mmap inclusief kopregel) parallel in.
+    Het resultaat is gelijk aan een enkele pd.read_csv aanroep.
+    Als `pad` gegeven is, leest elk proces zijn eigen blok uit het bestand, zodat
+    de data niet naar de processen gekopieerd hoeft te worden. Met `kies` maakt elk
+    proces de selectie in zijn eigen blok; `kies` moet dan te pickelen zijn.
+    """
+    max_workers = max_workers or os.cpu_count() or 1
+    start = einde_eerste_record(data, separator)
+    kop = bytes(data[:start])
+    grenzen = bepaal_blokgrenzen(data, start, blok_grootte, separator=separator)
+    blokken = list(zip(grenzen[:-1], grenzen[1:]))
+    logging.info(f"CSV parallel inlezen: {len(blokken)} blokken, {max_workers} processen")
+
+    delen = []
+    records = []
+    aantal_rijen = 0
+    regel, vorige = 0, 0
+    # Houd maar een beperkt aantal blokken tegelijk in de wachtrij, zodat niet het
+    # hele bestand in één keer naar de processen gekopieerd wordt
+    venster = max_workers * 2
+    with ProcessPoolExecutor(max_workers=max_workers) as pool:
+        wachtrij = deque()
+        volgende = 0
+        while volgende < len(blokken) or wachtrij:
+            while volgende < len(blokken) and len(wachtrij) < venster:
+                begin, eind = blokken[volgende]
+                if pad:
+                    future = pool.submit(lees_csv_bereik, pad, begin, eind, kop, separator, headers, kies)
+                else:
+                    future = pool.submit(lees_csv_blok, data[begin:eind], kop, separator, headers, kies)
+                wachtrij.append(future)
+                volgende += 1
+            deel, overgeslagen = wachtrij.popleft().result()
+            # De regelnummers per blok omzetten naar die van het bestand; in elk blok en
+            # in het bestand is de kopregel regel 1
+            begin = blokken[len(delen)][0]
+            if overgeslagen:
+                regel += tel_records(stukken_van(data, vorige, begin), separator)
+                vorige = begin
+                records += [(nummer + regel - 1, tekst) for nummer, tekst in overgeslagen]
+            delen.append(deel)
+            aantal_rijen += len(deel)
+            if nrows is not None and aantal_rijen >= nrows:
+                for future in wachtrij:
+                    future.cancel()
+                break
+
+    df = pd.concat(delen, ignore_index=True) if delen else lees_csv_blok(b'', kop, separator, headers)[0]
+    if nrows is not None and len(df) > nrows:
+        df = df.iloc[:nrows]
+    return met_quarantaine(df, records, separator, headers, kies, nrows)
+
+
+def lees_csv(data, separator, headers, nrows=None, pad=None, kies=None):
+    """
+    Lees de CSV in `data` (bytes of mmap inclusief kopregel) in als DataFrame met
+    strings. Grote bestanden worden parallel ingelezen, kleine in één keer. Met
+    `pad` leest pandas het bestand zelf via memory mapping.
+    """
+    if len(data) >= PARALLEL_DREMPEL and (os.cpu_count() or 1) > 1:
+        return lees_csv_parallel(data, separator, headers, nrows=nrows, pad=pad, kies=kies)
+    # Laat de rijen met te veel velden aan het begin weg
+    start = einde_eerste_record(data, separator)
+    te_lang, na = te_lange_rijen(data, start, separator, headers, eerste=2)
+    if te_lang:
+        df, nummers = _lees_pandas(met_kopregel(bytes(data[:start]), stukken_van(data, na)), separator,
+                                   headers, nrows, kies, weggelaten=te_lang[-1][0] - 1)
+    else:
+        df, nummers = _lees_pandas(pad if pad else io.BytesIO(data), separator, headers, nrows, kies,
+                                   memory_map=bool(pad))
+    records = zoek_records(stukken_van(data), nummers, separator) if nummers else []
+    return met_quarantaine(df, te_lang + records, separator, headers, kies, nrows)
+
+
+def zip_leden(bron):
+    """Geef de namen van de CSV bestanden in een zip-bestand."""
+    with zipfile.ZipFile(bron) as archief:
+        return [lid for lid in archief.namelist()
+                if lid.lower().endswith('.csv') and not lid.startswith('__MACOSX/')]
+
+
+def uitgepakte_grootte(bron, extensie, lid=None):
+    """
+    De (geschatte) grootte van een gecomprimeerd bestand na het uitpakken, in bytes. Een
+    zip-archief bevat de grootte zelf; bij gzip en zstd wordt de compressieverhouding op
+    het begin van het bestand gemeten en met de grootte van het bestand vermenigvuldigd.
+    Retourneert None als de grootte niet te bepalen is.
+    """
+    if extensie == 'zip':
+        with zipfile.ZipFile(bron) as archief:
+            return archief.getinfo(lid).file_size
+    if extensie == 'gz':
+        # 32 + 15: gzip kop herkennen, maximale venstergrootte
+        uitpakker = zlib.decompressobj(wbits=47)
+        fouten = (zlib.error,)
+    elif extensie == 'zst':
+        try:
+            import zstandard
+        except ImportError:
+            return None
+        uitpakker = zstandard.ZstdDecompressor().decompressobj()
+        fouten = (zstandard.ZstdError,)
+    else:
+        return None
+
+    bestand = open(bron, 'rb') if isinstance(bron, str) else bron
+    try:
+        grootte = bestand.seek(0, io.SEEK_END)
+        bestand.seek(0)
+        gelezen = uitgepakt = 0
+        # In kleine stukken, zodat het uitpakken van een sterk gecomprimeerd begin begrensd blijft
+        while gelezen < COMPRESSIE_STEEKPROEF and uitgepakt < UITGEPAKT_STEEKPROEF:
+            stuk = bestand.read(64 * 1024)
+            if not stuk:
+                # Het hele bestand is uitgepakt
+                return uitgepakt
+            try:
+                uitgepakt += len(uitpakker.decompress(stuk))
+            except fouten as e:
+                # Zoals het einde van het eerste frame; meet op wat er tot dan is uitgepakt
+                logging.info(f"Compressieverhouding op {gelezen} bytes gemeten: {e}")
+                break
+            gelezen += len(stuk)
+    except OSError as e:
+        logging.warning(f"Grootte na het uitpakken niet te bepalen: {e}")
+        return None
+    finally:
+        if bestand is not bron:
+            bestand.close()
+        else:
+            bestand.seek(0)
+    if not gelezen or not uitgepakt:
+        return None
+    return int(grootte * uitgepakt / gelezen)
+
+
+def open_gedecomprimeerd(bron, extensie, lid=None):
+    """
+    Open een gecomprimeerd bestand als stroom met gedecomprimeerde bytes. `bron` is
+    een pad of een bestandsobject; bij zip wordt het bestand `lid` geopend.
+    """
+    if hasattr(bron, 'seek'):
+        bron.seek(0)
+    if extensie == 'gz':
+        stroom = gzip.open(bron, 'rb')
+    elif extensie == 'zst':
+        try:
+            import zstandard
+        except ImportError:
+            raise ValueError("Voor .zst bestanden is het package 'zstandard' nodig")
+        bestand = open(bron, 'rb') if isinstance(bron, str) else bron
+        stroom = zstandard.ZstdDecompressor().stream_reader(bestand, read_across_frames=True,
+                                                            closefd=isinstance(bron, str))
+    elif extensie == 'zip':
+        archief = zipfile.ZipFile(bron)
+        stroom = archief.open(lid)
+        # Het geopende lid houdt het archief zelf open tot de stroom gesloten wordt
+        archief.close()
+    else:
+        raise ValueError(f"Onbekend compressietype: {extensie}")
+    return io.BufferedReader(stroom, buffer_size=STROOM_BUFFER)
+
+
+def lees_begin_stroom(stroom):
+    """
+    Lees het begin van een stroom, tot en met het eerste record (de kopregel) of
+    de eerste tekens die geen witruimte zijn.
+    """
+    begin = b''
+    while True:
+        stuk = stroom.read(STROOM_BUFFER)
+        begin += stuk
+        if not stuk:
+            return begin
+        if not begin.isspace() and einde_eerste_record(begin) < len(begin):
+            return begin
+
+
+def lees_csv_stroom(stroom, separator, headers, nrows=None, kies=None, heropen=None):
+    """
+    Lees een CSV uit een (gedecomprimeerde) stroom in. Pandas leest de stroom in
+    stukken, zodat het gedecomprimeerde bestand nooit in zijn geheel in het geheugen staat.
+    Zijn er regels overgeslagen, dan wordt de bron nog een keer gelezen om die regels op
+    te halen; `heropen` opent daarvoor een nieuwe stroom (een zstd stroom kan niet
+    teruggezet worden).
+    """
+    # De eerste rijen worden gecontroleerd in het begin dat al in de buffer van de stroom
+    # staat; is de buffer vol, dan alleen de volledige records daarin
+    begin = stroom.peek(STROOM_BUFFER) if hasattr(stroom, 'peek') else b''
+    if len(begin) >= STROOM_BUFFER:
+        begin = begin[:laatste_recordgrens(begin, separator)]
+    start = einde_eerste_record(begin, separator)
+    te_lang, na = te_lange_rijen(begin, start, separator, headers, eerste=2)
+    bron = stroom
+    if te_lang:
+        kop = stroom.read(start)
+        stroom.read(na - start)
+        bron = met_kopregel(kop, stukken_van_stroom(stroom))
+    df, nummers = _lees_pandas(bron, separator, headers, nrows, kies, weggelaten=te_lang[-1][0] - 1 if te_lang else 0)
+    records = _records_uit_stroom(stroom, nummers, separator, heropen) if nummers else []
+    return met_quarantaine(df, te_lang + records, separator, headers, kies, nrows)
+
+
+def open_excel(bron):
+    """
+    Open een Excel bestand in read-only modus. Alleen de werkboekstructuur wordt
+    geladen; de rijen worden pas gelezen als erom gevraagd wordt.
+    """
+    return openpyxl.load_workbook(bron, read_only=True, data_only=True)
+
+
+def excel_bladen(werkboek):
+    """Geef de namen van alle werkbladen in het werkboek."""
+    return list(werkboek.sheetnames)
+
+
+def _excel_waarde(waarde):
+    """Zet een celwaarde om naar tekst zoals pd.read_excel(dtype=str) dat doet."""
+    if waarde is None:
+        return None
+    if isinstance(waarde, float) and waarde.is_integer():
+        return str(int(waarde))
+    return str(waarde)
+
+
+def _excel_kolomnamen(kopregel):
+    """Maak kolomnamen van de kopregel, met dezelfde naamgeving als pandas."""
+    namen = []
+    gezien = {}
+    for i, waarde in enumerate(kopregel):
+        naam = _excel_waarde(waarde)
+        if naam is None or naam == '':
+            naam = f"Unnamed: {i}"
+        if naam in gezien:
+            gezien[naam] += 1
+            naam = f"{naam}.{gezien[naam]}"
+        else:
+            gezien[naam] = 0
+        namen.append(naam)
+    return namen
+
+
+def excel_kop(werkboek, blad):
+    """Lees alleen de kopregel van een werkblad, zonder de data te verwerken."""
+    rijen = werkboek[blad].iter_rows(values_only=True)
+    kopregel = next(rijen, None)
+    return _excel_kolomnamen(kopregel or ())
+
+
+def _excel_blok(data, headers, kies):
+    """De rijen van een blok als DataFrame met strings, met alleen de selectie."""
+    return selecteer(pd.DataFrame(data, columns=headers, dtype=object), kies)
+
+
+def lees_excel(werkboek, bladen, nrows=None, kies=None):
+    """
+    Lees één of meer werkbladen in als DataFrame met strings. De rijen worden
+    gestreamd en het lezen stopt zodra `nrows` rijen (in totaal) gelezen zijn.
+    Met `kies` wordt per blok van SELECTIE_RIJEN rijen alleen de selectie bewaard,
+    zodat een steekproef ook de piek in het geheugen verkleint.
+    """
+    delen = []
+    resterend = nrows
+    for blad in bladen:
+        if resterend is not None and resterend <= 0:
+            break
+        werkblad = werkboek[blad]
+        # Sommige bestanden bevatten een verkeerde afmeting; laat openpyxl die negeren
+        werkblad.reset_dimensions()
+        rijen = werkblad.iter_rows(values_only=True)
+        headers = _excel_kolomnamen(next(rijen, None) or ())
+        if resterend is not None:
+            rijen = islice(rijen, resterend)
+
+        blokken = []
+        data = []
+        # Lege rijen aan het einde van een blad tellen niet mee (net als bij pandas); ze
+        # worden pas bewaard als er nog een gevulde rij volgt
+        leeg = []
+        bewaard = 0
+        for rij in rijen:
+            waarden = [_excel_waarde(w) for w in rij]
+            if len(waarden) > len(headers):
+                headers += _excel_kolomnamen([None] * len(waarden))[len(headers):]
+            waarden += [None] * (len(headers) - len(waarden))
+            if all(w is None for w in waarden):
+                leeg.append(waarden)
+                continue
+            bewaard += len(leeg) + 1
+            data += leeg
+            data.append(waarden)
+            leeg = []
+            if len(data) >= SELECTIE_RIJEN:
+                blokken.append(_excel_blok(data, headers, kies))
+                data = []
+        if data or not blokken:
+            blokken.append(_excel_blok(data, headers, kies))
+
+        # Kolommen die pas in een later blok opduiken ontbreken in de eerdere blokken
+        for blok in blokken:
+            for col in headers[len(blok.columns):]:
+                blok[col] = pd.Series([None] * len(blok), dtype=object)
+        delen.append(pd.concat(blokken, ignore_index=True) if len(blokken) > 1 else blokken[0])
+        if resterend is not None:
+            resterend -= bewaard
+
+    if not delen:
+        return pd.DataFrame()
+    return pd.concat(delen, ignore_index=True)
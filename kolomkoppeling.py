@@ -0,0 +1,86 @@
+"""
+Automatisch koppelen van kolommen met verschillende namen.
+
+Elk paar van een kolom in Bron A en een kolom in Bron B krijgt een score uit de
+gelijkenis van de namen en van de waarden in een steekproef: de meest voorkomende
+waarden, de patronen van de waarden (cijfers als '9', letters als 'a') en de
+gemiddelde lengte. De paren met de hoogste score worden één op één gekoppeld.
+"""
+import re
+from difflib import SequenceMatcher
+
+import pandas as pd
+
+from verschillen import als_tekst
+
+# Aantal meest voorkomende waarden en patronen per kolom in het profiel
+MAX_WAARDEN = 1000
+MAX_PATRONEN = 20
+
+# Paren met een lagere score worden niet voorgesteld
+MIN_SCORE = 0.5
+
+
+def _naam(naam):
+    """Een kolomnaam zonder hoofdletters, spaties en leestekens."""
+    return re.sub(r'[\W_]+', '', str(naam).lower())
+
+
+def kolomprofiel(serie):
+    """Het profiel van een kolom: meest voorkomende waarden, patronen en gemiddelde lengte."""
+    waarden = als_tekst(serie)
+    patronen = waarden.str.replace(r'\d+', '9', regex=True).str.replace(r'[^\W\d_]+', 'a', regex=True)
+    return {
+        'waarden': frozenset(waarden.value_counts().index[:MAX_WAARDEN]),
+        'patronen': frozenset(patronen.value_counts().index[:MAX_PATRONEN]),
+        'lengte': waarden.str.len().mean() if len(waarden) else 0.0,
+    }
+
+
+def _jaccard(links, rechts):
+    """Het deel gedeelde elementen van twee verzamelingen."""
+    if not links and not rechts:
+        return 1.0
+    return len(links & rechts) / len(links | rechts)
+
+
+def kolom_score(naam_a, profiel_a, naam_b, profiel_b):
+    """De gelijkenis van twee kolommen tussen 0 en 1, uit de namen en de profielen."""
+    naam = SequenceMatcher(None, _naam(naam_a), _naam(naam_b)).ratio()
+    lengtes = sorted([profiel_a['lengte'], profiel_b['lengte']])
+    lengte = lengtes[0] / lengtes[1] if lengtes[1] else 1.0
+    waarde = 0.5 * _jaccard(profiel_a['waarden'], profiel_b['waarden']) \
+        + 0.3 * _jaccard(profiel_a['patronen'], profiel_b['patronen']) \
+        + 0.2 * lengte
+    return 0.5 * naam + 0.5 * waarde
+
+
+def stel_koppeling_voor(steekproef_a, steekproef_b):
+    """
+    Stel voor elke kolom van Bron A een kolom van Bron B voor. Elke kolom van B wordt
+    hooguit één keer gebruikt; de paren met de hoogste score gaan voor. Retourneert
+    een DataFrame met per kolom van A de voorgestelde kolom van B ('' als er geen
+    goede kandidaat is) en de score.
+    """
+    profielen_a = {col: kolomprofiel(steekproef_a[col]) for col in steekproef_a.columns}
+    profielen_b = {col: kolomprofiel(steekproef_b[col]) for col in steekproef_b.columns}
+    paren = sorted(
+        ((kolom_score(col_a, profielen_a[col_a], col_b, profielen_b[col_b]), col_a, col_b)
+         for col_a in profielen_a for col_b in profielen_b),
+        key=lambda paar: -paar[0]
+    )
+
+    koppeling = {}
+    gebruikt = set()
+    for score, col_a, col_b in paren:
+        if score < MIN_SCORE:
+            break
+        if col_a not in koppeling and col_b not in gebruikt:
+            koppeling[col_a] = (col_b, score)
+            gebruikt.add(col_b)
+
+    return pd.DataFrame({
+        'Kolom in A': list(steekproef_a.columns),
+        'Kolom in B': [koppeling.get(col, ('', 0.0))[0] for col in steekproef_a.columns],
+        'Score': [round(koppeling.get(col, ('', 0.0))[1], 2) for col in steekproef_a.columns],
+    })
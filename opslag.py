@@ -0,0 +1,67 @@
+"""
+Compacte opslag van kolommen met weinig unieke waarden.
+
+Kolommen als 'VERF', 'Ja'/'Nee' of 'omzet' bestaan uit een handvol waarden die
+heel vaak herhaald worden. Deze kolommen worden als categorie (dictionary-encoding)
+opgeslagen: elke waarde staat één keer in een dictionary en per rij wordt alleen
+een kleine code bewaard. Bij de vergelijking krijgen Bron A en Bron B dezelfde
+dictionary, zodat gelijkheid direct op de codes bepaald kan worden.
+"""
+import pandas as pd
+
+# Een kolom wordt gecodeerd als het aantal unieke waarden hooguit dit deel van het
+# aantal rijen is
+DICTIONARY_DREMPEL = 0.5
+
+
+def is_gecodeerd(serie):
+    """Controleer of een kolom dictionary-encoded (categorie) is."""
+    return isinstance(serie.dtype, pd.CategoricalDtype)
+
+
+def comprimeer(df, drempel=DICTIONARY_DREMPEL):
+    """
+    Codeer alle kolommen met weinig unieke waarden als categorie. Kolommen met
+    veel unieke waarden (zoals sleutels of omschrijvingen) blijven gewone strings.
+    """
+    df = df.copy()
+    for col in df.columns:
+        if is_gecodeerd(df[col]) or len(df) == 0:
+            continue
+        if df[col].nunique(dropna=False) <= drempel * len(df):
+            df[col] = df[col].astype('category')
+    return df
+
+
+def geheugen_mb(df):
+    """Het werkelijke geheugengebruik van een DataFrame in MB."""
+    return df.memory_usage(deep=True).sum() / (1024 * 1024)
+
+
+def _waarden(serie):
+    """De unieke waarden van een kolom; bij een gecodeerde kolom is dat de dictionary."""
+    if is_gecodeerd(serie):
+        return pd.Index(serie.cat.categories, dtype=object)
+    return pd.Index(serie.unique(), dtype=object)
+
+
+def deel_dictionary(df_a, df_b, kolommen):
+    """
+    Geef de kolommen die in één van beide bronnen gecodeerd zijn in beide bronnen
+    dezelfde dictionary. De lege waarde zit altijd in de dictionary, zodat ontbrekende
+    waarden na een outer merge als '' ingevuld kunnen worden.
+    """
+    for col in kolommen:
+        if not (is_gecodeerd(df_a[col]) or is_gecodeerd(df_b[col])):
+            continue
+        categorieen = _waarden(df_a[col]).append(_waarden(df_b[col])).append(pd.Index([''])).dropna().unique()
+        df_a[col] = pd.Categorical(df_a[col], categories=categorieen)
+        df_b[col] = pd.Categorical(df_b[col], categories=categorieen)
+    return df_a, df_b
+
+
+def vul_leeg(serie):
+    """Vul ontbrekende waarden in een gecodeerde kolom met de lege string."""
+    if '' not in serie.cat.categories:
+        serie = serie.cat.add_categories([''])
+    return serie.fillna('')
@@ -0,0 +1,174 @@
+"""
+De vergelijking als pijplijn van losse stadia met een eigen cache.
+
+De stadia zijn: ingelezen bron, genormaliseerde bron, sleutelindex, uitlijning (de
+paren van rijen in A en B) en verschillen. Elk resultaat wordt bewaard onder een
+sleutel die alleen bestaat uit de invoer van dat stadium. Wijzigt er één sleutelkolom,
+één koppeling of één bron, dan worden alleen de stadia die daarvan afhangen opnieuw
+berekend. Een DataFrame uit de cache draagt zijn eigen sleutel mee in df.attrs, zodat
+volgende stadia daarop kunnen voortbouwen.
+"""
+import logging
+import threading
+from collections import OrderedDict
+from functools import reduce
+
+import numpy as np
+import pandas as pd
+
+from arrow_engine import arrow_verschil, is_arrow_kolom
+from opslag import is_gecodeerd, vul_leeg
+from regels import EXACT, regel_verschil
+from verschillen import ALLEEN_A, ALLEEN_B, Verschillen, als_tekst, waarde_verschillen
+
+# Aantal resultaten dat per stadium bewaard wordt (genoeg voor Bron A en Bron B plus
+# een vorige versie)
+MAX_PER_STADIUM = 4
+
+
+class StadiumCache:
+    """
+    Cache met per stadium de laatst gebruikte resultaten. De oudste resultaten
+    worden verwijderd zodra een stadium meer dan `max_per_stadium` resultaten heeft.
+    De cache kan vanuit meerdere threads gebruikt worden; het berekenen zelf gebeurt
+    buiten het slot.
+    """
+
+    def __init__(self, max_per_stadium=MAX_PER_STADIUM):
+        self.max_per_stadium = max_per_stadium
+        self._stadia = {}
+        self._slot = threading.Lock()
+
+    def haal(self, stadium, sleutel, bereken):
+        """Geef het bewaarde resultaat voor `sleutel`, of bereken en bewaar het."""
+        with self._slot:
+            resultaten = self._stadia.setdefault(stadium, OrderedDict())
+            if sleutel in resultaten:
+                resultaten.move_to_end(sleutel)
+                logging.info(f"Stadium '{stadium}' uit de cache")
+                return resultaten[sleutel]
+
+        resultaat = bereken()
+        if isinstance(resultaat, pd.DataFrame):
+            resultaat.attrs['sleutel'] = (stadium, sleutel)
+        with self._slot:
+            resultaten[sleutel] = resultaat
+            while len(resultaten) > self.max_per_stadium:
+                resultaten.popitem(last=False)
+        return resultaat
+
+    def leeg(self):
+        """Verwijder alle bewaarde resultaten."""
+        with self._slot:
+            self._stadia.clear()
+
+
+def sleutel_van(df):
+    """De cachesleutel van een DataFrame dat uit een stadium komt (of None)."""
+    return df.attrs.get('sleutel')
+
+
+def stadium(cache, naam, sleutel, bereken):
+    """
+    Voer een stadium uit via de cache. Zonder cache, of als een deel van de sleutel
+    onbekend is, wordt het resultaat gewoon berekend.
+    """
+    if cache is None or sleutel is None or any(deel is None for deel in sleutel):
+        return bereken()
+    return cache.haal(naam, sleutel, bereken)
+
+
+def sleutel_index(df, key_columns):
+    """De sleutelkolommen van een bron als strings; de basis voor de uitlijning."""
+    return pd.DataFrame({key: als_tekst(df[key]).to_numpy(dtype=object) for key in key_columns})
+
+
+def lijn_uit(index_a, index_b, key_columns):
+    """
+    Koppel de rijen van A en B op sleutel. Het resultaat heeft per rij van de outer
+    merge de sleutel en de positie in A en B (-1 als de rij in die bron ontbreekt),
+    in dezelfde volgorde als een merge van de volledige DataFrames.
+    """
+    paren = pd.merge(
+        index_a.assign(_positie_a=np.arange(len(index_a))),
+        index_b.assign(_positie_b=np.arange(len(index_b))),
+        on=key_columns,
+        how='outer'
+    )
+    paren['_positie_a'] = paren['_positie_a'].fillna(-1).astype(np.int64)
+    paren['_positie_b'] = paren['_positie_b'].fillna(-1).astype(np.int64)
+    return paren
+
+
+def uitlijning(df_a, df_b, key_columns, cache=None):
+    """
+    De uitlijning van twee bronnen via de cache: de sleutelindex hangt alleen af van
+    de eigen bron en de sleutelkolommen, de uitlijning alleen van de twee indexen.
+    """
+    index_a = stadium(cache, 'sleutelindex', (sleutel_van(df_a), tuple(key_columns)),
+                      lambda: sleutel_index(df_a, key_columns))
+    index_b = stadium(cache, 'sleutelindex', (sleutel_van(df_b), tuple(key_columns)),
+                      lambda: sleutel_index(df_b, key_columns))
+    return stadium(cache, 'uitlijning', (sleutel_van(index_a), sleutel_van(index_b)),
+                   lambda: lijn_uit(index_a, index_b, key_columns))
+
+
+def rij_labels(paren, key_columns):
+    """De sleutel per paar als 'waarde1, waarde2', zoals in de kolom 'Rij'."""
+    return reduce(lambda links, rechts: links + ', ' + rechts,
+                  [paren[key].to_numpy(dtype=object) for key in key_columns])
+
+
+def kolom_verschil(serie_a, serie_b, positie_a, positie_b, regel=None):
+    """
+    Vergelijk een kolom voor de gekoppelde posities en retourneer het masker met de
+    afwijkende paren. Met een gedeelde dictionary worden alleen de codes vergeleken,
+    Arrow strings met de kernels van pyarrow. Met een vergelijkingsregel wordt de kolom
+    eerst volgens die regel omgezet.
+    """
+    if regel and regel.get('regel', EXACT) != EXACT:
+        return regel_verschil(serie_a, serie_b, positie_a, positie_b, regel)
+
+    if is_arrow_kolom(serie_a) and is_arrow_kolom(serie_b):
+        return arrow_verschil(serie_a, serie_b, positie_a, positie_b)
+
+    if is_gecodeerd(serie_a) and is_gecodeerd(serie_b):
+        serie_a = vul_leeg(serie_a)
+        serie_b = vul_leeg(serie_b)
+        if serie_a.cat.categories.equals(serie_b.cat.categories):
+            return serie_a.cat.codes.to_numpy()[positie_a] != serie_b.cat.codes.to_numpy()[positie_b]
+
+    waarden_a = als_tekst(serie_a).to_numpy(dtype=object)[positie_a]
+    waarden_b = als_tekst(serie_b).to_numpy(dtype=object)[positie_b]
+    return waarden_a != waarden_b
+
+
+def verschillen_uit_paren(df_a, df_b, paren, key_columns, regels=None):
+    """
+    Bepaal de verschillen uit de uitlijning, zonder de volledige DataFrames samen te
+    voegen. Per kolom worden alleen de gekoppelde posities vergeleken (volgens de
+    vergelijkingsregel van die kolom in `regels`); het resultaat bewaart alleen de
+    posities van de afwijkende rijen.
+    """
+    regels = regels or {}
+    positie_a = paren['_positie_a'].to_numpy()
+    positie_b = paren['_positie_b'].to_numpy()
+    alleen_a = positie_b < 0
+    alleen_b = positie_a < 0
+    beide = ~alleen_a & ~alleen_b
+
+    delen = [
+        (ALLEEN_A, -1, positie_a[alleen_a], positie_b[alleen_a]),
+        (ALLEEN_B, -1, positie_a[alleen_b], positie_b[alleen_b]),
+    ]
+
+    # Verschillen in waarden voor overeenkomende rijen
+    positie_a = positie_a[beide]
+    positie_b = positie_b[beide]
+    vergelijk_kolommen = [col for col in df_a.columns if col not in key_columns and col in df_b.columns]
+    delen += waarde_verschillen(
+        vergelijk_kolommen, positie_a, positie_b,
+        lambda col: kolom_verschil(df_a[col], df_b[col], positie_a, positie_b, regels.get(col))
+    )
+
+    return Verschillen.uit_delen(df_a, df_b, key_columns, vergelijk_kolommen, delen)
@@ -0,0 +1,53 @@
+"""
+Vergelijkingsprofielen: opgeslagen instellingen voor een vaste combinatie van feeds.
+
+Een profiel bewaart alles wat bij een terugkerende vergelijking steeds opnieuw gekozen
+moet worden: de instellingen voor het inlezen per bron (scheidingsteken, kolomnamen,
+werkbladen, aantal rijen), de opslag en engine, de kolom mapping, de sleutels en het
+formaat van de export. Een profiel is een JSON bestand.
+"""
+import json
+import os
+
+# Map waarin de profielen bewaard worden
+PROFIEL_MAP = os.environ.get(
+    'DATA_VERGELIJKER_PROFIELEN',
+    os.path.join(os.path.expanduser('~'), '.data_vergelijker', 'profielen')
+)
+
+
+def _pad(naam):
+    """Het bestand van een profiel; de naam mag geen pad zijn."""
+    naam = naam.strip()
+    if not naam or naam in ('.', '..') or os.sep in naam or (os.altsep and os.altsep in naam):
+        raise ValueError("Ongeldige naam voor een profiel")
+    return os.path.join(PROFIEL_MAP, naam + '.json')
+
+
+def profielen():
+    """De namen van alle opgeslagen profielen."""
+    if not os.path.isdir(PROFIEL_MAP):
+        return []
+    return sorted(bestand[:-len('.json')] for bestand in os.listdir(PROFIEL_MAP) if bestand.endswith('.json'))
+
+
+def bewaar_profiel(naam, profiel):
+    """Bewaar een profiel; een bestaand profiel met dezelfde naam wordt vervangen."""
+    pad = _pad(naam)
+    os.makedirs(PROFIEL_MAP, exist_ok=True)
+    tijdelijk = pad + '.tmp'
+    with open(tijdelijk, 'w', encoding='utf-8') as f:
+        json.dump(profiel, f, ensure_ascii=False, indent=2)
+    os.replace(tijdelijk, pad)
+
+
+def laad_profiel(naam):
+    """Laad een profiel."""
+    try:
+        with open(_pad(naam), encoding='utf-8') as f:
+            profiel = json.load(f)
+    except json.JSONDecodeError as e:
+        raise ValueError(f"Profiel '{naam}' is geen geldig JSON bestand: {e}")
+    if not isinstance(profiel, dict):
+        raise ValueError(f"Profiel '{naam}' heeft een onbekend formaat")
+    return profiel
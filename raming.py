@@ -0,0 +1,155 @@
+"""
+Raming vooraf van het geheugengebruik en de looptijd.
+
+Voor het inlezen komt de raming uit de bestandsgrootte en een steekproef van de eerste
+regels: het aantal bytes per regel geeft het aantal rijen, de ingelezen steekproef het
+geheugen per rij voor elke opslag. Voor de vergelijking komt de raming uit het
+geheugengebruik van de bronnen, het aantal kolommen en de geschatte grootte van de
+merge (uit de schetsen van de sleutels).
+
+Alles wordt afgezet tegen een geheugenbudget voor het hele proces. De engine
+"Automatisch" kiest pandas zolang de geraamde piek binnen het budget past en anders
+DuckDB, dat met een geheugenlimiet naar schijf uitwijkt. De doorvoer per engine is
+gemeten op één core; de looptijd is een orde van grootte, geen belofte.
+"""
+import io
+import logging
+import os
+
+import pandas as pd
+
+from duckdb_engine import SCHAT_RIJEN, duckdb, schat_geheugen_mb
+from inlezen import csv_opties, einde_eerste_record, laatste_recordgrens
+from verschillen import als_tekst
+
+try:
+    import pyarrow as pa
+except ImportError:
+    pa = None
+
+
+def _standaard_budget_mb():
+    """De helft van het fysieke geheugen, of 4 GB als dat niet bepaald kan worden."""
+    try:
+        return os.sysconf('SC_PAGE_SIZE') * os.sysconf('SC_PHYS_PAGES') / (2 * 1024 * 1024)
+    except (AttributeError, ValueError, OSError):
+        return 4096
+
+
+# Geheugenbudget van het proces in MB, voor alle bronnen en de vergelijking samen
+GEHEUGEN_BUDGET_MB = float(os.environ.get('DATA_VERGELIJKER_GEHEUGEN_MB') or _standaard_budget_mb())
+
+# Aantal bytes aan het begin van een bestand waaruit de breedte van een rij geschat wordt
+SCHAT_BYTES = 1024 * 1024
+
+# Piek tijdens het inlezen ten opzichte van de ingelezen bron (kopieën bij het opschonen
+# en comprimeren) en doorvoer in cellen per seconde
+PIEK_INLEZEN = {'Standaard': 1.5, 'Compact': 2.0, 'Arrow': 1.5}
+CELLEN_PER_S_INLEZEN = {'Standaard': 650000, 'Compact': 600000, 'Arrow': 16000000}
+
+# Extra geheugen van pandas per rij van de merge (sleutelindex, merge en posities) en
+# per sleutelkolom
+BYTES_PER_PAAR = 160
+BYTES_PER_SLEUTEL = 24
+
+# Looptijd per rij van de merge en per vergeleken cel, op één core
+PANDAS_S_PER_PAAR = 7e-6
+PANDAS_S_PER_CEL = 2.5e-7
+DUCKDB_S_PER_PAAR = 2e-6
+DUCKDB_S_PER_CEL = 1.4e-6
+
+# Geheugenlimiet van DuckDB als de bronnen zelf al bijna het hele budget gebruiken
+MIN_DUCKDB_MB = 256
+
+
+def raming_inlezen(data, grootte, separator, headers, nrows=None, fractie=None):
+    """
+    Raam het aantal rijen en per opslag het piekgeheugen en de looptijd van het inlezen.
+    `data` is (het begin van) het bestand inclusief kopregel, `grootte` de grootte van
+    het hele bestand in bytes (na het uitpakken). Retourneert het aantal rijen en een
+    DataFrame per opslag, of None als de grootte onbekend is of de steekproef geen rijen
+    bevat of niet gelezen kan worden.
+    """
+    if grootte is None:
+        # Zonder de grootte is alleen het aantal rijen in de steekproef bekend, en dat
+        # zegt niets over het hele bestand
+        return None
+    begin = bytes(data[:SCHAT_BYTES])
+    if len(begin) < len(data):
+        # Alleen volledige records (een regelbreuk binnen quotes is geen grens)
+        begin = begin[:laatste_recordgrens(begin, separator)]
+    kop = einde_eerste_record(begin, separator)
+    try:
+        steekproef = pd.read_csv(io.BytesIO(begin), **csv_opties(separator, headers)).fillna('')
+    except (pd.errors.ParserError, UnicodeDecodeError) as e:
+        # Zonder raming wordt gewoon ingelezen; het inlezen zelf meldt eventuele fouten
+        logging.warning(f"Geen raming van het inlezen: {e}")
+        return None
+    if steekproef.empty:
+        return None
+
+    rijen = (grootte - kop) * len(steekproef) / max(len(begin) - kop, 1)
+    if fractie is not None:
+        rijen *= fractie
+    if nrows is not None:
+        rijen = min(rijen, nrows)
+
+    per_rij = {'Standaard': steekproef.memory_usage(deep=True, index=False).sum() / len(steekproef)}
+    per_rij['Compact'] = per_rij['Standaard']
+    if pa is not None:
+        per_rij['Arrow'] = pa.Table.from_pandas(steekproef, preserve_index=False).nbytes / len(steekproef)
+    cellen = rijen * len(headers)
+    return rijen, pd.DataFrame({
+        'Geheugen (MB)': {opslag: rijen * breedte * PIEK_INLEZEN[opslag] / (1024 * 1024)
+                          for opslag, breedte in per_rij.items()},
+        'Looptijd (s)': {opslag: cellen / CELLEN_PER_S_INLEZEN[opslag] for opslag in per_rij},
+    })
+
+
+def _tekst_breedte(df):
+    """Het gemiddelde aantal tekens per rij (alle kolommen), geschat uit de eerste rijen."""
+    steekproef = df.head(SCHAT_RIJEN)
+    if len(steekproef) == 0:
+        return 0.0
+    return sum(als_tekst(steekproef[col]).str.len().sum() for col in steekproef.columns) / len(steekproef)
+
+
+def raming_vergelijking(df_a, df_b, key_columns, merge_rijen):
+    """
+    Raam per engine het piekgeheugen (inclusief de bronnen) en de looptijd van de
+    vergelijking, uit de bronnen en de geschatte grootte van de merge.
+    """
+    bronnen_mb = schat_geheugen_mb(df_a) + schat_geheugen_mb(df_b)
+    kolommen = len([col for col in df_a.columns if col not in key_columns and col in df_b.columns])
+    cores = os.cpu_count() or 1
+
+    # DuckDB zet de gekoppelde waarden als tekst in een tabel, maar blijft binnen zijn limiet
+    duckdb_mb = min(merge_rijen * (_tekst_breedte(df_a) + _tekst_breedte(df_b) + BYTES_PER_SLEUTEL)
+                    / (1024 * 1024), duckdb_limiet_mb(df_a, df_b))
+    raming = pd.DataFrame({
+        'Geheugen (MB)': {
+            'pandas': bronnen_mb + merge_rijen * (BYTES_PER_PAAR + BYTES_PER_SLEUTEL * len(key_columns))
+            / (1024 * 1024),
+            'DuckDB': bronnen_mb + duckdb_mb,
+        },
+        'Looptijd (s)': {
+            'pandas': merge_rijen * (PANDAS_S_PER_PAAR + kolommen * PANDAS_S_PER_CEL),
+            'DuckDB': merge_rijen * (DUCKDB_S_PER_PAAR + kolommen * DUCKDB_S_PER_CEL) / cores,
+        },
+    })
+    raming['Past in budget'] = raming['Geheugen (MB)'] <= GEHEUGEN_BUDGET_MB
+    if duckdb is None:
+        raming = raming.drop(index='DuckDB')
+    return raming
+
+
+def kies_engine(raming):
+    """Kies pandas als de geraamde piek binnen het budget past, anders DuckDB (als dat er is)."""
+    if raming.loc['pandas', 'Past in budget'] or 'DuckDB' not in raming.index:
+        return "pandas"
+    return "DuckDB"
+
+
+def duckdb_limiet_mb(df_a, df_b):
+    """De geheugenlimiet voor DuckDB: het deel van het budget dat de bronnen overlaten."""
+    return max(GEHEUGEN_BUDGET_MB - schat_geheugen_mb(df_a) - schat_geheugen_mb(df_b), MIN_DUCKDB_MB)
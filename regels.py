@@ -0,0 +1,167 @@
+"""
+Vergelijkingsregels per kolom.
+
+Standaard worden waarden als tekst vergeleken, zodat '30,00' en '30.0' als verschil
+gelden. Met een regel wordt een kolom eerst genormaliseerd en dan vergeleken:
+
+- Getal: Nederlandse en Engelse notatie ('1.280,00', '"1;280,00"', '1,280.00',
+  '1280.0') worden getallen, vergeleken met een absolute en/of relatieve tolerantie.
+- Datum: datums en tijdstippen in verschillende formaten worden tijdstippen.
+- Tekst: hoofdletters en witruimte tellen niet mee.
+
+Een regel wordt één keer per kolom toegepast met vectoroperaties van pandas, niet per
+cel. Bij een gecodeerde kolom worden alleen de waarden in de dictionary genormaliseerd.
+Waarden die niet als getal of datum gelezen kunnen worden, worden als tekst vergeleken.
+"""
+import numpy as np
+import pandas as pd
+
+from arrow_engine import controleer_pyarrow
+from opslag import is_gecodeerd, vul_leeg
+from verschillen import als_tekst
+
+try:
+    import pyarrow as pa
+    import pyarrow.compute as pc
+except ImportError:
+    pa = None
+
+EXACT = 'Exact'
+GETAL = 'Getal'
+DATUM = 'Datum'
+TEKST = 'Tekst'
+REGELS = [EXACT, GETAL, DATUM, TEKST]
+
+# Formaten die voor een datumkolom geprobeerd worden, in deze volgorde
+DATUM_FORMATEN = [
+    '%Y-%m-%d %H:%M:%S',
+    '%Y-%m-%d',
+    '%Y-%m-%dT%H:%M:%S',
+    '%d-%m-%Y %H:%M:%S',
+    '%d-%m-%Y %H:%M',
+    '%d-%m-%Y',
+    '%d/%m/%Y',
+    '%d.%m.%Y',
+    '%Y%m%d',
+]
+
+# Een getal na het verwijderen van de scheiding van duizendtallen
+_GETAL = r'^[+-]?(\d+\.?\d*|\.\d+)([eE][+-]?\d+)?$'
+
+
+def regels_sleutel(regels):
+    """De regels als hashbare waarde, voor de cache."""
+    if not regels:
+        return ()
+    return tuple(sorted((col, tuple(sorted(regel.items()))) for col, regel in regels.items()))
+
+
+def als_tekst_array(serie):
+    """De waarden als Arrow strings zonder witruimte aan het begin en eind ('' voor leeg)."""
+    if is_gecodeerd(serie):
+        serie = vul_leeg(serie)
+    waarden = pa.array(als_tekst(serie).to_numpy(dtype=object), type=pa.string())
+    return pc.utf8_trim_whitespace(waarden)
+
+
+def als_getal(tekst):
+    """
+    Lees Arrow strings als getallen. Met een punt en een komma in de waarde is het
+    laatste teken het decimaalteken ('1.280,50' en '1,280.50'). Met alleen een komma
+    is die het decimaalteken ('30,00'), behalve als er meer komma's zijn ('1,280,000');
+    meer punten zonder komma zijn duizendtallen ('1.280.000'). Aanhalingstekens, spaties
+    en ';' als scheiding van duizendtallen worden weggelaten. Waarden die geen getal
+    zijn worden null.
+    """
+    for teken in ['"', "'", ' ', ';']:
+        if pc.any(pc.match_substring(tekst, teken)).as_py():
+            tekst = pc.replace_substring(tekst, teken, '')
+    komma = pc.match_substring(tekst, ',')
+    if pc.any(komma).as_py():
+        zonder_punten = pc.replace_substring(tekst, '.', '')
+        zonder_komma = pc.replace_substring(tekst, ',', '')
+        # De komma is het decimaalteken als hij de enige is en na de laatste punt staat
+        decimaal = pc.and_(pc.match_substring_regex(tekst, r',[^.]*$'),
+                           pc.invert(pc.match_substring_regex(tekst, r',.*,')))
+        tekst = pc.if_else(komma, pc.if_else(decimaal, pc.replace_substring(zonder_punten, ',', '.'),
+                                              zonder_komma), tekst)
+    punten = pc.match_substring_regex(tekst, r'\..*\.')
+    if pc.any(punten).as_py():
+        tekst = pc.if_else(punten, pc.replace_substring(tekst, '.', ''), tekst)
+    tekst = pc.if_else(pc.equal(tekst, ''), None, tekst)
+    try:
+        return pc.cast(tekst, pa.float64())
+    except pa.ArrowInvalid:
+        # Niet alle waarden zijn getallen; alleen de getallen worden gelezen
+        return pc.cast(pc.if_else(pc.match_substring_regex(tekst, _GETAL), tekst, None), pa.float64())
+
+
+def als_datum(tekst):
+    """
+    Lees Arrow strings als tijdstippen. Elk formaat in DATUM_FORMATEN wordt in één keer
+    op de hele kolom toegepast; per waarde telt het eerste formaat dat past. Waarden die
+    in geen enkel formaat passen worden null.
+    """
+    datums = pa.nulls(len(tekst), pa.timestamp('ns'))
+    for formaat in DATUM_FORMATEN:
+        if datums.null_count == 0:
+            break
+        datums = pc.coalesce(datums, pc.strptime(tekst, format=formaat, unit='ns', error_is_null=True))
+    return datums
+
+
+def als_vrije_tekst(tekst):
+    """Arrow strings in kleine letters, met witruimte samengevoegd tot één spatie."""
+    return pc.utf8_lower(pc.replace_substring_regex(tekst, r'\s+', ' '))
+
+
+def _waarden(serie, positie, omzetten=None):
+    """
+    Zet een kolom om en neem de waarden op `positie`. Bij een gecodeerde kolom wordt
+    alleen de dictionary omgezet; de codes halen daarna de waarden per rij op.
+    """
+    if is_gecodeerd(serie):
+        serie = vul_leeg(serie)
+        tekst = als_tekst_array(pd.Series(serie.cat.categories))
+        positie = serie.cat.codes.to_numpy()[positie]
+    else:
+        tekst = als_tekst_array(serie)
+    return (omzetten(tekst) if omzetten else tekst).take(positie)
+
+
+def _ongelijk(links, rechts):
+    """Per paar of de waarden verschillen, als numpy masker (null telt als gelijk aan null)."""
+    gelijk = pc.or_kleene(pc.equal(links, rechts), pc.and_(pc.is_null(links), pc.is_null(rechts)))
+    return ~pc.fill_null(gelijk, False).to_numpy(zero_copy_only=False)
+
+
+def regel_verschil(serie_a, serie_b, positie_a, positie_b, regel):
+    """
+    Vergelijk een kolom volgens een regel voor de gekoppelde posities en retourneer het
+    masker met de afwijkende paren.
+    """
+    controleer_pyarrow()
+    soort = regel.get('regel', EXACT)
+    if soort == TEKST:
+        return _ongelijk(_waarden(serie_a, positie_a, als_vrije_tekst), _waarden(serie_b, positie_b, als_vrije_tekst))
+    if soort not in (GETAL, DATUM):
+        raise ValueError(f"Onbekende vergelijkingsregel: {soort}")
+
+    tekst_a = _waarden(serie_a, positie_a)
+    tekst_b = _waarden(serie_b, positie_b)
+    if soort == GETAL:
+        waarde_a = als_getal(tekst_a).to_numpy(zero_copy_only=False)
+        waarde_b = als_getal(tekst_b).to_numpy(zero_copy_only=False)
+        gelezen = ~np.isnan(waarde_a) & ~np.isnan(waarde_b)
+        tolerantie = np.maximum(float(regel.get('absoluut') or 0.0),
+                                float(regel.get('relatief') or 0.0) * np.maximum(np.abs(waarde_a), np.abs(waarde_b)))
+        with np.errstate(invalid='ignore'):
+            anders = np.abs(waarde_a - waarde_b) > tolerantie
+    else:
+        waarde_a = als_datum(tekst_a).to_numpy(zero_copy_only=False)
+        waarde_b = als_datum(tekst_b).to_numpy(zero_copy_only=False)
+        gelezen = ~np.isnat(waarde_a) & ~np.isnat(waarde_b)
+        anders = waarde_a != waarde_b
+
+    # Waarden die niet gelezen kunnen worden (zoals lege cellen) worden als tekst vergeleken
+    return np.where(gelezen, anders, _ongelijk(tekst_a, tekst_b))
@@ -0,0 +1,199 @@
+"""
+Schetsen van kolommen en sleutels.
+
+Een schets is een kleine, vaste samenvatting van de waarden in een kolom: de k
+kleinste verschillende hashes (k-minimum-values). Daaruit volgt een schatting van het
+aantal verschillende waarden, en door de schetsen van Bron A en Bron B te combineren
+ook een schatting van het aantal waarden dat in beide bronnen voorkomt. Zo kunnen
+sleutels voorgesteld en beoordeeld worden zonder groupby of merge over alle rijen.
+"""
+from itertools import combinations
+
+import numpy as np
+import pandas as pd
+
+from vingerafdruk import meng, sleutel_hashes, waarde_hashes
+
+# Onder dit deel gedeelde sleutels is de koppeling waarschijnlijk verkeerd
+MIN_OVERLAP = 0.1
+
+# Aantal hashes in een schets; de relatieve fout is ongeveer 1 / sqrt(KMV_GROOTTE)
+KMV_GROOTTE = 1024
+
+# Aantal rijen in de steekproef waarmee de uniekheid van kolommen geschat wordt
+STEEKPROEF = 20000
+
+# Aantal kolommen dat gecombineerd wordt tot samengestelde sleutels
+MAX_SAMENGESTELD = 5
+
+# Aantal voorgestelde sleutels
+MAX_KANDIDATEN = 10
+
+# Een sleutel wordt alleen voorgesteld als hij in beide steekproeven minstens dit deel
+# unieke waarden heeft
+MIN_UNIEK = 0.5
+
+_HASH_BEREIK = float(2 ** 64)
+
+
+def kmv(hashes, k=KMV_GROOTTE):
+    """De k kleinste verschillende hashes, gesorteerd."""
+    if len(hashes) > 8 * k:
+        # Meestal zitten de k kleinste verschillende hashes ruim binnen de 8k kleinste
+        drempel = np.partition(hashes, 8 * k)[8 * k]
+        kleinste = np.unique(hashes[hashes <= drempel])
+        if len(kleinste) >= k:
+            return kleinste[:k]
+    return np.sort(pd.unique(hashes))[:k]
+
+
+class Schets:
+    """De k kleinste verschillende hashes van een kolom, met het aantal rijen."""
+
+    def __init__(self, hashes, rijen, k=KMV_GROOTTE):
+        self.hashes = hashes
+        self.rijen = rijen
+        self.k = k
+
+    @classmethod
+    def van_hashes(cls, hashes, k=KMV_GROOTTE):
+        return cls(kmv(hashes, k), len(hashes), k)
+
+    @property
+    def volledig(self):
+        """True als de schets alle verschillende waarden bevat (de telling is dan exact)."""
+        return len(self.hashes) < self.k
+
+    def verschillend(self):
+        """Schatting van het aantal verschillende waarden."""
+        if self.volledig:
+            return float(len(self.hashes))
+        return (self.k - 1) / (float(self.hashes[-1]) / _HASH_BEREIK)
+
+    def uniek(self):
+        """Het geschatte deel van de rijen met een eigen waarde (1.0 is een unieke kolom)."""
+        if self.rijen == 0:
+            return 0.0
+        return min(self.verschillend() / self.rijen, 1.0)
+
+    def gedeeld(self, ander):
+        """Schatting van het aantal verschillende waarden dat in beide schetsen voorkomt."""
+        if self.volledig and ander.volledig:
+            return float(len(np.intersect1d(self.hashes, ander.hashes, assume_unique=True)))
+        k = min(self.k, ander.k)
+        vereniging = np.union1d(self.hashes, ander.hashes)[:k]
+        in_beide = np.isin(vereniging, self.hashes, assume_unique=True) & \
+            np.isin(vereniging, ander.hashes, assume_unique=True)
+        totaal = (k - 1) / (float(vereniging[-1]) / _HASH_BEREIK) if len(vereniging) >= k else len(vereniging)
+        return in_beide.mean() * totaal
+
+
+def schets_sleutel(df, key_columns):
+    """De schets van een (samengestelde) sleutel."""
+    return Schets.van_hashes(sleutel_hashes(df, key_columns))
+
+
+def steekproef(df, aantal=STEEKPROEF):
+    """Een vaste, willekeurige steekproef van rijen waarmee de uniekheid geschat wordt."""
+    if len(df) <= aantal:
+        return df
+    return df.iloc[np.sort(np.random.default_rng(0).choice(len(df), aantal, replace=False))]
+
+
+def _uniek_in_steekproef(df, key_columns):
+    """Het deel van de rijen in de steekproef met een eigen sleutel."""
+    if len(df) == 0:
+        return 0.0
+    return len(pd.unique(sleutel_hashes(df, key_columns))) / len(df)
+
+
+def _overlap(schets_a, schets_b):
+    """Het deel van de sleutels van de kleinste bron dat ook in de andere bron voorkomt."""
+    kleinste = min(schets_a.verschillend(), schets_b.verschillend())
+    if kleinste == 0:
+        return 0.0
+    return min(schets_a.gedeeld(schets_b) / kleinste, 1.0)
+
+
+def sleutelkandidaten(df_a, df_b, steekproef_a, steekproef_b, kolommen):
+    """
+    Stel sleutels voor, enkel en samengesteld, gerangschikt op uniekheid in beide
+    bronnen en overlap tussen A en B. De uniekheid komt uit de steekproeven; alleen
+    voor de beste kandidaten wordt een schets van alle rijen gemaakt om de overlap
+    te schatten.
+    """
+    def uniek(sleutel):
+        return (_uniek_in_steekproef(steekproef_a, list(sleutel)), _uniek_in_steekproef(steekproef_b, list(sleutel)))
+    
+    uniekheid = {(col,): uniek((col,)) for col in kolommen}
+
+    # Combineer de meest unieke kolommen die zelf geen unieke sleutel zijn
+    niet_uniek = sorted((col for col in kolommen if min(uniekheid[(col,)]) < 1.0),
+                        key=lambda col: -min(uniekheid[(col,)]))[:MAX_SAMENGESTELD]
+    for paar in combinations(niet_uniek, 2):
+        uniekheid[paar] = uniek(paar)
+
+    # De hashes van alle rijen worden per kolom één keer berekend
+    hashes = {}
+
+    def schets(df, kant, sleutel):
+        totaal = np.zeros(len(df), dtype=np.uint64)
+        for col in sleutel:
+            if (kant, col) not in hashes:
+                hashes[(kant, col)] = waarde_hashes(df[col])
+            totaal = meng(totaal, hashes[(kant, col)])
+        return Schets.van_hashes(totaal)
+
+    beste = sorted((sleutel for sleutel in uniekheid if min(uniekheid[sleutel]) >= MIN_UNIEK),
+                   key=lambda sleutel: (-min(uniekheid[sleutel]), len(sleutel)))[:MAX_KANDIDATEN]
+    rijen = []
+    for sleutel in beste:
+        uniek_a, uniek_b = uniekheid[sleutel]
+        overlap = _overlap(schets(df_a, 'A', sleutel), schets(df_b, 'B', sleutel))
+        rijen.append({
+            'Sleutel': ', '.join(sleutel),
+            'Kolommen': len(sleutel),
+            'Uniek in A': uniek_a,
+            'Uniek in B': uniek_b,
+            'Overlap': overlap,
+            'Score': min(uniek_a, uniek_b) * overlap,
+        })
+    kandidaten = pd.DataFrame(rijen, columns=['Sleutel', 'Kolommen', 'Uniek in A', 'Uniek in B', 'Overlap', 'Score'])
+    return kandidaten.sort_values(['Score', 'Kolommen'], ascending=[False, True]).reset_index(drop=True)
+
+
+def _per_sleutel(schets):
+    """Het gemiddelde aantal rijen per sleutel; binnen de schattingsfout van 1 is dat precies 1."""
+    verschillend = schets.verschillend()
+    if verschillend == 0:
+        return 0.0
+    per_sleutel = schets.rijen / verschillend
+    if not schets.volledig and per_sleutel < 1 + 3 / np.sqrt(schets.k):
+        return 1.0
+    return per_sleutel
+
+
+def schat_koppeling(schets_a, schets_b):
+    """
+    Schat uit de schetsen van de sleutels hoeveel sleutels (en rijen) in beide bronnen
+    voorkomen en hoeveel alleen in A of alleen in B, zonder de bronnen te koppelen.
+    """
+    verschillend_a = min(schets_a.verschillend(), schets_a.rijen)
+    verschillend_b = min(schets_b.verschillend(), schets_b.rijen)
+    gedeeld = min(schets_a.gedeeld(schets_b), verschillend_a, verschillend_b)
+    per_sleutel_a = _per_sleutel(schets_a)
+    per_sleutel_b = _per_sleutel(schets_b)
+    return {
+        'in_beide': gedeeld,
+        'alleen_a': verschillend_a - gedeeld,
+        'alleen_b': verschillend_b - gedeeld,
+        'rijen_in_beide_a': gedeeld * per_sleutel_a,
+        'rijen_in_beide_b': gedeeld * per_sleutel_b,
+        'rijen_alleen_a': (verschillend_a - gedeeld) * per_sleutel_a,
+        'rijen_alleen_b': (verschillend_b - gedeeld) * per_sleutel_b,
+        'overlap': _overlap(schets_a, schets_b),
+        'merge_rijen': gedeeld * per_sleutel_a * per_sleutel_b
+        + (verschillend_a - gedeeld) * per_sleutel_a
+        + (verschillend_b - gedeeld) * per_sleutel_b,
+    }
+
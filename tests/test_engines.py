@@ -0,0 +1,50 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from arrow_engine import vergelijk_arrow
+from duckdb_engine import vergelijk_duckdb
+from pijplijn import uitlijning, verschillen_uit_paren
+
+
+def _bron(rng, rijen):
+    """Een bron met dubbele en lege sleutels en lege waarden."""
+    def kolom(waarden):
+        return pd.Series(rng.choice(waarden, rijen), dtype=object)
+    return pd.DataFrame({
+        'k1': kolom(['1', '2', '3', '4', '5', '']),
+        'k2': kolom(['x', 'y', 'z']),
+        'a': kolom(['p', 'q', None]),
+        'b': kolom(['r', 's', 't', '']),
+    })
+
+
+def _pandas(df_a, df_b, key_columns):
+    return verschillen_uit_paren(df_a, df_b, uitlijning(df_a, df_b, key_columns), key_columns)
+
+
+def _zelfde(verwacht, resultaat):
+    assert resultaat.kolommen == verwacht.kolommen
+    for veld in ('typen', 'kolom_ids', 'positie_a', 'positie_b'):
+        assert getattr(resultaat, veld).tolist() == getattr(verwacht, veld).tolist(), veld
+
+
+@pytest.mark.parametrize('seed', range(40))
+def test_engines_geven_dezelfde_verschillen_in_dezelfde_volgorde(seed):
+    rng = np.random.default_rng(seed)
+    df_a = _bron(rng, int(rng.integers(0, 60)))
+    df_b = _bron(rng, int(rng.integers(0, 60)))
+    key_columns = ['k1', 'k2'] if seed % 2 else ['k1']
+    verwacht = _pandas(df_a, df_b, key_columns)
+    _zelfde(verwacht, vergelijk_arrow(df_a, df_b, key_columns))
+    _zelfde(verwacht, vergelijk_duckdb(df_a, df_b, key_columns))
+
+
+@pytest.mark.parametrize('leeg', ['A', 'B'])
+def test_engines_met_een_lege_bron(leeg):
+    rng = np.random.default_rng(0)
+    df_a = _bron(rng, 0 if leeg == 'A' else 50)
+    df_b = _bron(rng, 0 if leeg == 'B' else 50)
+    verwacht = _pandas(df_a, df_b, ['k1'])
+    _zelfde(verwacht, vergelijk_arrow(df_a, df_b, ['k1']))
+    _zelfde(verwacht, vergelijk_duckdb(df_a, df_b, ['k1']))
@@ -0,0 +1,27 @@
+import numpy as np
+import pandas as pd
+
+from gedeeld import GedeeldeOpslag
+
+
+def test_none_wordt_een_keer_berekend():
+    opslag = GedeeldeOpslag()
+    berekend = []
+    sessie = object()
+    for _ in range(3):
+        assert opslag.haal(('raming', 1), lambda: berekend.append(1), sessie) is None
+    assert berekend == [1]
+
+
+def test_boven_budget_naar_schijf_en_terug(tmp_path):
+    opslag = GedeeldeOpslag(budget_mb=1, map=str(tmp_path))
+    sessie = object()
+    groot = pd.DataFrame({'a': np.arange(200000)})
+    opslag.haal(('ingelezen', 'A'), lambda: groot.copy(), sessie)
+    opslag.haal(('ingelezen', 'B'), lambda: groot.copy(), sessie)
+    assert len(list(tmp_path.iterdir())) == 1
+    terug = opslag.haal(('ingelezen', 'A'), lambda: None, sessie)
+    assert terug['a'].equals(groot['a'])
+    opslag.laat_los([('ingelezen', 'A'), ('ingelezen', 'B')], sessie)
+    assert opslag.geheugen_mb() == 0
+    assert not list(tmp_path.iterdir())
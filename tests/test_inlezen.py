@@ -0,0 +1,83 @@
+import csv
+import io
+import random
+
+import pandas as pd
+import pytest
+
+from inlezen import lees_csv, lees_csv_parallel, lees_csv_stroom
+
+HEADERS = ['a', 'b', 'c']
+
+
+def _rijen(df):
+    return df.astype(object).where(df.notna(), None).values.tolist()
+
+
+def test_rijen_korter_dan_kopregel():
+    data = b'a;b;c\n875;879\n1;2\n'
+    verwacht = [['875', '879', None], ['1', '2', None]]
+    assert _rijen(lees_csv(data, ';', HEADERS)) == verwacht
+    assert _rijen(lees_csv_stroom(io.BufferedReader(io.BytesIO(data)), ';', HEADERS)) == verwacht
+    assert _rijen(lees_csv_parallel(data, ';', HEADERS, max_workers=2, blok_grootte=4)) == verwacht
+
+
+def test_te_lange_rijen_aan_het_begin_in_quarantaine():
+    data = b'a;b;c\n1;2;3;4\n5;6;7;8\n9;10;11\n'
+    for df in [lees_csv(data, ';', HEADERS),
+               lees_csv_stroom(io.BufferedReader(io.BytesIO(data)), ';', HEADERS),
+               lees_csv_parallel(data, ';', HEADERS, max_workers=2, blok_grootte=4)]:
+        assert _rijen(df) == [['9', '10', '11']]
+        assert [(regel, status) for regel, status, _, _ in df.attrs['quarantaine']] == \
+            [(2, 'Afgewezen'), (3, 'Afgewezen')]
+
+
+def test_blok_met_korte_eerste_rij_voor_overgeslagen_regel():
+    data = b'a;b;c\n1;2;3\n213;709\n787;566;5" disk;\n154;65;831\n'
+    verwacht = [['1', '2', '3'], ['213', '709', None], ['154', '65', '831'], ['787', '566', '5" disk']]
+    assert _rijen(lees_csv(data, ';', HEADERS)) == verwacht
+    for blok_grootte in [1, 10, 100]:
+        assert _rijen(lees_csv_parallel(data, ';', HEADERS, max_workers=2, blok_grootte=blok_grootte)) == verwacht
+
+
+def test_te_lange_rij_met_regelbreuk_in_quotes_aan_het_begin():
+    data = b'a;b;c\n;"m\nr";t;u\n1;2;3\n'
+    for df in [lees_csv(data, ';', HEADERS),
+               lees_csv_stroom(io.BufferedReader(io.BytesIO(data)), ';', HEADERS),
+               lees_csv_parallel(data, ';', HEADERS, max_workers=2, blok_grootte=4)]:
+        assert _rijen(df) == [['1', '2', '3']]
+        assert [regel for regel, _, _, _ in df.attrs['quarantaine']] == [2]
+
+
+def _willekeurig_bestand(seed):
+    """Een CSV met korte en te lange rijen, lege regels en quotes (ook met regelbreuken)."""
+    rng = random.Random(seed)
+    velden = ['1', 'x', '', '5" disk', '"met ; en\nregel"', '"""q"""', 'tekst']
+    regels = ['a;b;c']
+    for _ in range(rng.randint(0, 40)):
+        aantal = rng.choice([1, 2, 3, 3, 3, 3, 4, 5])
+        regels.append(rng.choice([';'.join(rng.choice(velden) for _ in range(aantal))] * 3 + ['']))
+    return ('\n'.join(regels) + '\n').encode(), rng.randint(1, 60)
+
+
+@pytest.mark.parametrize('seed', range(40))
+def test_parallel_gelijk_aan_in_een_keer(seed):
+    data, blok_grootte = _willekeurig_bestand(seed)
+    verwacht = lees_csv(data, ';', HEADERS)
+    for df in [lees_csv_parallel(data, ';', HEADERS, max_workers=2, blok_grootte=blok_grootte),
+               lees_csv_stroom(io.BufferedReader(io.BytesIO(data)), ';', HEADERS)]:
+        pd.testing.assert_frame_equal(df, verwacht)
+        assert df.attrs.get('quarantaine') == verwacht.attrs.get('quarantaine')
+
+
+@pytest.mark.parametrize('seed', range(40))
+def test_geen_rij_verdwijnt_zonder_melding(seed):
+    data, _ = _willekeurig_bestand(seed)
+    records = [velden for velden in csv.reader(io.StringIO(data.decode(), newline=''), delimiter=';')][1:]
+    te_lang = [i + 2 for i, velden in enumerate(records) if len(velden) > len(HEADERS)]
+    df = lees_csv(data, ';', HEADERS)
+    quarantaine = df.attrs.get('quarantaine', [])
+    # Elke te lange rij staat in de quarantaine; de rest (en wat hersteld is) in de rijen
+    assert sorted(regel for regel, _, _, _ in quarantaine) == te_lang
+    afgewezen = sum(status == 'Afgewezen' for _, status, _, _ in quarantaine)
+    assert len(df) == sum(1 for velden in records if velden) - afgewezen
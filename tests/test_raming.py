@@ -0,0 +1,30 @@
+import gzip
+import io
+
+import zstandard
+
+from inlezen import lees_begin_stroom, open_gedecomprimeerd, uitgepakte_grootte
+from raming import raming_inlezen
+
+HEADERS = ['id', 'naam', 'bedrag']
+
+
+def _csv(rijen):
+    return ('id;naam;bedrag\n' + ''.join(f'{i};naam {i * 7919 % 100003};{i * 0.37:.2f}\n'
+                                         for i in range(rijen))).encode()
+
+
+def test_raming_van_gecomprimeerd_bestand_schaalt_met_de_grootte():
+    data = _csv(400000)
+    for extensie, inhoud in [('gz', gzip.compress(data)), ('zst', zstandard.ZstdCompressor().compress(data))]:
+        bron = io.BytesIO(inhoud)
+        grootte = uitgepakte_grootte(bron, extensie)
+        assert abs(grootte - len(data)) < 0.1 * len(data)
+        with open_gedecomprimeerd(bron, extensie) as stroom:
+            begin = lees_begin_stroom(stroom)
+        rijen, _ = raming_inlezen(begin, grootte, ';', HEADERS)
+        assert 360000 < rijen < 440000
+
+
+def test_geen_raming_zonder_grootte():
+    assert raming_inlezen(_csv(100), None, ';', HEADERS) is None
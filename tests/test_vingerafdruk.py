@@ -0,0 +1,15 @@
+import numpy as np
+import pandas as pd
+
+from vingerafdruk import in_steekproef
+
+
+def test_steekproef_onafhankelijk_van_volgorde_en_namen_van_de_sleutel():
+    rng = np.random.default_rng(0)
+    a = pd.DataFrame({'k1': rng.integers(0, 1000, 20000).astype(str),
+                      'k2': rng.integers(0, 1000, 20000).astype(str)})
+    b = a.rename(columns={'k1': 'klant', 'k2': 'datum'})
+    masker = in_steekproef(a, ('k2', 'k1'), 0.1)
+    assert (masker == in_steekproef(a, ('k1', 'k2'), 0.1)).all()
+    assert (masker == in_steekproef(b, ('klant', 'datum'), 0.1)).all()
+    assert 0.08 < masker.mean() < 0.12
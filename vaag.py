@@ -0,0 +1,223 @@
+"""
+Vage koppeling van sleutels die bijna overeenkomen.
+
+Sleutels verschillen tussen systemen vaak alleen in de vorm: 'KH_426903' en '426903',
+voorloopnullen of spaties aan het eind. Zulke rijen komen in de vergelijking terug als
+een rij alleen in A en een rij alleen in B. Deze module zoekt voor die rest alsnog
+paren, zonder elke sleutel met elke andere te vergelijken. Kandidaten komen uit vier
+indexen, die met een hash join van Arrow gekoppeld worden:
+
+- de genormaliseerde sleutel (kleine letters, alleen letters en cijfers, zonder
+  voorloopnullen);
+- het cijferdeel van de sleutel (zonder voorloopnullen);
+- de varianten van de genormaliseerde sleutel met één teken minder, zodat sleutels
+  met één tikfout, één extra of één ontbrekend teken elkaar vinden. Bij sleutels van
+  alleen cijfers is één cijfer verschil meestal een ander nummer, zulke paren krijgen
+  een lagere betrouwbaarheid;
+- trigrammen van de genormaliseerde sleutel, met een begin- en eindteken zodat ook
+  het begin (prefix) en het eind een eigen trigram hebben. Trigrammen die in veel
+  sleutels voorkomen worden overgeslagen, zodat de blokken klein blijven.
+
+Elk kandidaatpaar krijgt een betrouwbaarheid tussen 0 en 1; de paren worden één op
+één gekozen, met de hoogste betrouwbaarheid eerst.
+"""
+import numpy as np
+import pandas as pd
+
+from arrow_engine import controleer_pyarrow
+
+try:
+    import pyarrow as pa
+    import pyarrow.compute as pc
+except ImportError:
+    pa = None
+
+# Betrouwbaarheid van een paar met dezelfde genormaliseerde sleutel of hetzelfde cijferdeel
+GENORMALISEERD = 1.0
+CIJFERS = 0.9
+
+# Minimaal aantal cijfers voordat het cijferdeel als sleutel gebruikt wordt
+MIN_CIJFERS = 4
+
+# Minimale lengte van een sleutel voor de varianten met één teken minder
+MIN_LENGTE = 4
+
+# Trigrammen die in meer sleutels per kant voorkomen zijn te algemeen om te koppelen
+MAX_BLOK = 50
+
+# Bij numerieke sleutels is één cijfer verschil meestal een andere sleutel (opeenvolgende
+# nummers), geen tikfout; de betrouwbaarheid van zo'n paar wordt met deze factor verlaagd
+NUMERIEK_EEN_TEKEN = 0.5
+
+# Paren uit de trigrammen met een lagere betrouwbaarheid worden niet voorgesteld
+MIN_BETROUWBAARHEID = 0.6
+
+KOLOMMEN = ['Sleutel in A', 'Sleutel in B', 'Betrouwbaarheid', 'Methode']
+
+
+def normaliseer(sleutels):
+    """Sleutels in kleine letters, alleen letters en cijfers, zonder voorloopnullen in getallen."""
+    vormen = pc.utf8_lower(pa.array(sleutels.astype(str).to_numpy(dtype=object), type=pa.string()))
+    vormen = pc.replace_substring_regex(vormen, r'[\W_]+', '')
+    return pc.replace_substring_regex(vormen, r'(^|[^0-9])0+([0-9])', r'\1\2')
+
+
+def cijfers(sleutels):
+    """Het cijferdeel van de sleutels zonder voorloopnullen ('' als er te weinig cijfers zijn)."""
+    deel = pc.replace_substring_regex(pa.array(sleutels.astype(str).to_numpy(dtype=object), type=pa.string()),
+                                      r'\D+', '')
+    deel = pc.if_else(pc.greater_equal(pc.utf8_length(deel), MIN_CIJFERS), deel, '')
+    return pc.utf8_ltrim(deel, characters='0')
+
+
+def _index(vormen, kant):
+    """Een index als Arrow tabel met de kolommen 'id_<kant>' en 'vorm', zonder lege vormen."""
+    tabel = pa.table({f'id_{kant}': np.arange(len(vormen)), 'vorm': vormen})
+    return tabel.filter(pc.not_equal(tabel['vorm'], ''))
+
+
+def _koppel(index_a, index_b, aantal_b):
+    """
+    De paren met dezelfde vorm in beide indexen als DataFrame met 'id_a', 'id_b' en
+    'gedeeld' (het aantal vormen dat het paar deelt).
+    """
+    paren = index_a.join(index_b, 'vorm', join_type='inner')
+    codes = paren['id_a'].to_numpy().astype(np.int64) * aantal_b + paren['id_b'].to_numpy()
+    codes, gedeeld = np.unique(codes, return_counts=True)
+    return pd.DataFrame({'id_a': codes // aantal_b, 'id_b': codes % aantal_b, 'gedeeld': gedeeld})
+
+
+def varianten(vormen, kant):
+    """De vormen zelf en alle varianten met één teken minder, als index."""
+    lengtes = pc.utf8_length(vormen).to_numpy(zero_copy_only=False)
+    ids = np.arange(len(vormen))
+    delen = [_index(vormen, kant)]
+    for positie in range(int(lengtes.max(initial=0))):
+        heeft = (lengtes > positie) & (lengtes >= MIN_LENGTE)
+        if not heeft.any():
+            break
+        selectie = vormen.filter(pa.array(heeft))
+        variant = pc.binary_join_element_wise(pc.utf8_slice_codeunits(selectie, 0, positie),
+                                              pc.utf8_slice_codeunits(selectie, positie + 1), '')
+        delen.append(pa.table({f'id_{kant}': ids[heeft], 'vorm': variant}))
+    return pa.concat_tables(delen)
+
+
+def trigrammen(vormen, kant):
+    """De trigrammen van de vormen (met begin- en eindteken) als index."""
+    vormen = pc.binary_join_element_wise('^', vormen, '$', '')
+    lengtes = pc.utf8_length(vormen).to_numpy(zero_copy_only=False)
+    ids = np.arange(len(vormen))
+    delen = []
+    for begin in range(max(int(lengtes.max(initial=0)) - 2, 0)):
+        heeft = lengtes >= begin + 3
+        gram = pc.utf8_slice_codeunits(vormen.filter(pa.array(heeft)), begin, begin + 3)
+        delen.append(pa.table({f'id_{kant}': ids[heeft], 'vorm': gram}))
+    tabel = pa.concat_tables(delen) if delen else pa.table({f'id_{kant}': [], 'vorm': pa.array([], pa.string())})
+    return tabel.group_by([f'id_{kant}', 'vorm']).aggregate([])
+
+
+def _zeldzaam(grams):
+    """De trigrammen zonder de trigrammen die in meer dan MAX_BLOK sleutels voorkomen."""
+    aantallen = grams.group_by('vorm').aggregate([([], 'count_all')])
+    algemeen = aantallen.filter(pc.greater(aantallen['count_all'], MAX_BLOK))['vorm']
+    return grams.filter(pc.invert(pc.is_in(grams['vorm'], value_set=algemeen)))
+
+
+def _gelijke_vorm(vorm_a, vorm_b, betrouwbaarheid, methode):
+    """Kandidaatparen met dezelfde vorm (genormaliseerd of cijferdeel)."""
+    paren = _koppel(_index(vorm_a, 'a'), _index(vorm_b, 'b'), len(vorm_b))
+    return paren[['id_a', 'id_b']].assign(score=betrouwbaarheid, methode=methode)
+
+
+def _een_teken_paren(vorm_a, vorm_b):
+    """
+    Kandidaatparen die één teken verschillen; de betrouwbaarheid hangt af van de lengte
+    en is lager als beide sleutels alleen uit cijfers bestaan.
+    """
+    paren = _koppel(varianten(vorm_a, 'a'), varianten(vorm_b, 'b'), len(vorm_b))
+    id_a = paren['id_a'].to_numpy()
+    id_b = paren['id_b'].to_numpy()
+    lengte_a = pc.utf8_length(vorm_a).to_numpy(zero_copy_only=False)[id_a]
+    lengte_b = pc.utf8_length(vorm_b).to_numpy(zero_copy_only=False)[id_b]
+    numeriek = pc.utf8_is_digit(vorm_a).to_numpy(zero_copy_only=False)[id_a] & \
+        pc.utf8_is_digit(vorm_b).to_numpy(zero_copy_only=False)[id_b]
+    paren['score'] = (1 - 1 / np.maximum(np.maximum(lengte_a, lengte_b), 1)) * \
+        np.where(numeriek, NUMERIEK_EEN_TEKEN, 1.0)
+    paren['methode'] = 'Eén teken verschil'
+    return paren[['id_a', 'id_b', 'score', 'methode']]
+
+
+def _trigram_paren(vorm_a, vorm_b, open_a, open_b):
+    """
+    Kandidaatparen met gedeelde trigrammen voor de sleutels met nummer `open_a` en
+    `open_b`; de betrouwbaarheid is de Dice-coëfficiënt.
+    """
+    grams_a = trigrammen(vorm_a.take(open_a), 'a')
+    grams_b = trigrammen(vorm_b.take(open_b), 'b')
+    gedeeld = _koppel(_zeldzaam(grams_a), _zeldzaam(grams_b), len(open_b))
+    totaal_a = np.bincount(grams_a['id_a'].to_numpy(), minlength=len(open_a))[gedeeld['id_a'].to_numpy()]
+    totaal_b = np.bincount(grams_b['id_b'].to_numpy(), minlength=len(open_b))[gedeeld['id_b'].to_numpy()]
+    gedeeld['score'] = 2 * gedeeld['gedeeld'] / (totaal_a + totaal_b)
+    gedeeld['methode'] = 'Trigrammen'
+    gedeeld['id_a'] = open_a[gedeeld['id_a'].to_numpy()]
+    gedeeld['id_b'] = open_b[gedeeld['id_b'].to_numpy()]
+    return gedeeld.loc[gedeeld['score'] >= MIN_BETROUWBAARHEID, ['id_a', 'id_b', 'score', 'methode']]
+
+
+def _een_op_een(kandidaten):
+    """
+    Kies paren één op één: steeds de paren die voor hun sleutel in A én in B de beste
+    kandidaat zijn, waarna alle kandidaten met die sleutels vervallen.
+    """
+    kandidaten = kandidaten.sort_values(['score', 'id_a', 'id_b'], ascending=[False, True, True], kind='stable')
+    gekozen = []
+    while len(kandidaten):
+        ronde = kandidaten[~kandidaten['id_a'].duplicated() & ~kandidaten['id_b'].duplicated()]
+        gekozen.append(ronde)
+        kandidaten = kandidaten[~kandidaten['id_a'].isin(ronde['id_a']) & ~kandidaten['id_b'].isin(ronde['id_b'])]
+    return pd.concat(gekozen, ignore_index=True) if gekozen else kandidaten
+
+
+def koppel_vaag(sleutels_a, sleutels_b):
+    """
+    Zoek paren tussen de sleutels die alleen in A en alleen in B voorkomen. De sleutels
+    zijn Series met als index de positie van de rij in de bron. Retourneert een
+    DataFrame met per paar de sleutels, de betrouwbaarheid, de methode en de posities
+    ('positie_a', 'positie_b'), gesorteerd op betrouwbaarheid.
+    """
+    controleer_pyarrow()
+    leeg = pd.DataFrame(columns=KOLOMMEN + ['positie_a', 'positie_b'])
+    if len(sleutels_a) == 0 or len(sleutels_b) == 0:
+        return leeg
+
+    vorm_a = normaliseer(sleutels_a)
+    vorm_b = normaliseer(sleutels_b)
+    kandidaten = pd.concat([
+        _gelijke_vorm(vorm_a, vorm_b, GENORMALISEERD, 'Genormaliseerd'),
+        _gelijke_vorm(cijfers(sleutels_a), cijfers(sleutels_b), CIJFERS, 'Cijfers'),
+        _een_teken_paren(vorm_a, vorm_b),
+    ], ignore_index=True)
+
+    # De trigrammen alleen voor sleutels die met de andere indexen nog geen kandidaat hebben
+    open_a = np.setdiff1d(np.arange(len(vorm_a)), kandidaten['id_a'].to_numpy(dtype=np.int64))
+    open_b = np.setdiff1d(np.arange(len(vorm_b)), kandidaten['id_b'].to_numpy(dtype=np.int64))
+    if len(open_a) and len(open_b):
+        kandidaten = pd.concat([kandidaten, _trigram_paren(vorm_a, vorm_b, open_a, open_b)], ignore_index=True)
+    if kandidaten.empty:
+        return leeg
+
+    # Per paar telt de methode met de hoogste betrouwbaarheid
+    kandidaten = kandidaten.sort_values('score', ascending=False, kind='stable') \
+        .drop_duplicates(['id_a', 'id_b'])
+    paren = _een_op_een(kandidaten)
+    id_a = paren['id_a'].to_numpy(dtype=np.int64)
+    id_b = paren['id_b'].to_numpy(dtype=np.int64)
+    return pd.DataFrame({
+        'Sleutel in A': sleutels_a.to_numpy(dtype=object)[id_a],
+        'Sleutel in B': sleutels_b.to_numpy(dtype=object)[id_b],
+        'Betrouwbaarheid': paren['score'].to_numpy(dtype=float).round(3),
+        'Methode': paren['methode'].to_numpy(dtype=object),
+        'positie_a': sleutels_a.index.to_numpy()[id_a],
+        'positie_b': sleutels_b.index.to_numpy()[id_b],
+    }).sort_values('Betrouwbaarheid', ascending=False, kind='stable').reset_index(drop=True)
@@ -0,0 +1,204 @@
+"""
+Compacte opslag van de gevonden verschillen.
+
+Een verschil wordt bewaard als een type, een kolomnummer en de posities van de rij in
+Bron A en Bron B: een paar bytes per verschil. De tekst van de sleutel ('Rij') en de
+waarden worden pas uit de bronnen opgehaald als een pagina, een export of een
+samenvatting erom vraagt.
+"""
+import io
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import pandas as pd
+
+from opslag import is_gecodeerd, vul_leeg
+
+# De typen verschillen, in de volgorde waarin ze in het resultaat staan
+ALLEEN_A = 0
+ALLEEN_B = 1
+WAARDE = 2
+TYPEN = ['Alleen in Bron A', 'Alleen in Bron B', 'Verschillende waarden']
+
+KOLOMMEN = ['Verschil Type', 'Rij', 'Kolom', 'Waarde in A', 'Waarde in B']
+
+# Aantal verschillen per pagina in de tabel
+PAGINA_GROOTTE = 1000
+
+# Aantal verschillen per blok bij het exporteren naar CSV
+EXPORT_BLOK = 100000
+
+# Vanaf dit aantal te vergelijken cellen (paren x kolommen) worden de kolommen parallel
+# vergeleken; daaronder kost de thread pool meer dan hij oplevert
+PARALLEL_CELLEN = 1000000
+
+
+def als_tekst(serie):
+    """Zet een kolom om naar strings met '' voor lege waarden (zoals str(x) in vergelijk_data)."""
+    if is_gecodeerd(serie):
+        serie = vul_leeg(serie)
+    return serie.fillna('').astype(str)
+
+
+def _posities(posities):
+    """Posities als int32 als dat past, anders als int64."""
+    posities = np.asarray(posities, dtype=np.int64)
+    if len(posities) == 0 or posities.max() < np.iinfo(np.int32).max:
+        return posities.astype(np.int32)
+    return posities
+
+
+def waarde_verschillen(kolommen, positie_a, positie_b, masker, max_workers=None):
+    """
+    Vergelijk de kolommen voor de gekoppelde posities en geef de delen met verschillende
+    waarden (zoals Verschillen.uit_delen ze verwacht), in de volgorde van `kolommen`.
+    `masker(col)` geeft per paar of de waarden in kolom `col` verschillen. De kolommen
+    zijn onafhankelijk en worden bij veel cellen in een thread pool vergeleken; de
+    posities en bronnen worden alleen gelezen. Kernels van numpy en pyarrow geven de GIL
+    vrij, zodat brede tabellen meerdere cores gebruiken.
+    """
+    def vergelijk(kolom):
+        kolom_id, col = kolom
+        mask = masker(col)
+        if not mask.any():
+            return None
+        return (WAARDE, kolom_id, positie_a[mask], positie_b[mask])
+
+    kolommen = list(enumerate(kolommen))
+    max_workers = min(max_workers or os.cpu_count() or 1, len(kolommen))
+    if max_workers > 1 and len(positie_a) * len(kolommen) >= PARALLEL_CELLEN:
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            delen = list(executor.map(vergelijk, kolommen))
+    else:
+        delen = [vergelijk(kolom) for kolom in kolommen]
+    return [deel for deel in delen if deel is not None]
+
+
+class Verschillen:
+    """
+    De verschillen tussen twee bronnen. Per verschil is er een type (ALLEEN_A, ALLEEN_B
+    of WAARDE), het nummer van de kolom in `kolommen` (-1 voor 'Alle kolommen') en de
+    positie van de rij in A en B (-1 als de rij in die bron ontbreekt).
+    """
+
+    def __init__(self, df_a, df_b, key_columns, kolommen, typen, kolom_ids, positie_a, positie_b):
+        self.df_a = df_a
+        self.df_b = df_b
+        self.key_columns = list(key_columns)
+        self.kolommen = list(kolommen)
+        self.typen = np.asarray(typen, dtype=np.int8)
+        self.kolom_ids = np.asarray(kolom_ids, dtype=np.int32)
+        self.positie_a = _posities(positie_a)
+        self.positie_b = _posities(positie_b)
+
+    @classmethod
+    def uit_delen(cls, df_a, df_b, key_columns, kolommen, delen):
+        """Bouw de verschillen uit delen (type, kolomnummer, posities in A, posities in B)."""
+        typen, kolom_ids, positie_a, positie_b = [], [], [], []
+        for verschil_type, kolom_id, deel_a, deel_b in delen:
+            typen.append(np.full(len(deel_a), verschil_type, dtype=np.int8))
+            kolom_ids.append(np.full(len(deel_a), kolom_id, dtype=np.int32))
+            positie_a.append(np.asarray(deel_a, dtype=np.int64))
+            positie_b.append(np.asarray(deel_b, dtype=np.int64))
+        if not delen:
+            typen = kolom_ids = positie_a = positie_b = [np.empty(0, dtype=np.int64)]
+        return cls(df_a, df_b, key_columns, kolommen, np.concatenate(typen), np.concatenate(kolom_ids),
+                   np.concatenate(positie_a), np.concatenate(positie_b))
+
+    def __len__(self):
+        return len(self.typen)
+
+    @property
+    def empty(self):
+        return len(self) == 0
+
+    def geheugen_bytes(self):
+        """Het geheugengebruik van de verschillen zelf (zonder de bronnen)."""
+        return self.typen.nbytes + self.kolom_ids.nbytes + self.positie_a.nbytes + self.positie_b.nbytes
+
+    def _rij(self, posities, df):
+        """De sleutel als 'waarde1, waarde2' voor de rijen op `posities` in `df`."""
+        delen = [als_tekst(df[key].take(posities)).to_numpy(dtype=object) for key in self.key_columns]
+        rij = delen[0]
+        for deel in delen[1:]:
+            rij = rij + ', ' + deel
+        return rij
+
+    def _waarden(self, df, kolom_ids, posities):
+        """De waarden als tekst, per verschil uit de kolom met nummer `kolom_ids`."""
+        waarden = np.empty(len(posities), dtype=object)
+        for kolom_id in np.unique(kolom_ids):
+            mask = kolom_ids == kolom_id
+            waarden[mask] = als_tekst(df[self.kolommen[kolom_id]].take(posities[mask])).to_numpy(dtype=object)
+        return waarden
+
+    def pagina(self, begin, eind):
+        """Haal de verschillen met nummer `begin` tot `eind` op als DataFrame."""
+        typen = self.typen[begin:eind]
+        kolom_ids = self.kolom_ids[begin:eind]
+        positie_a = self.positie_a[begin:eind]
+        positie_b = self.positie_b[begin:eind]
+
+        # De sleutel komt uit Bron A, behalve voor rijen die alleen in Bron B staan
+        alleen_b = typen == ALLEEN_B
+        rij = np.empty(len(typen), dtype=object)
+        rij[~alleen_b] = self._rij(positie_a[~alleen_b], self.df_a)
+        rij[alleen_b] = self._rij(positie_b[alleen_b], self.df_b)
+
+        waarde = typen == WAARDE
+        waarde_a = np.where(typen == ALLEEN_A, 'Aanwezig', 'Niet aanwezig').astype(object)
+        waarde_b = np.where(typen == ALLEEN_A, 'Niet aanwezig', 'Aanwezig').astype(object)
+        waarde_a[waarde] = self._waarden(self.df_a, kolom_ids[waarde], positie_a[waarde])
+        waarde_b[waarde] = self._waarden(self.df_b, kolom_ids[waarde], positie_b[waarde])
+
+        kolom = np.array(self.kolommen + ['Alle kolommen'], dtype=object)[kolom_ids]
+        return pd.DataFrame({
+            'Verschil Type': np.array(TYPEN, dtype=object)[typen],
+            'Rij': rij,
+            'Kolom': kolom,
+            'Waarde in A': waarde_a,
+            'Waarde in B': waarde_b,
+        }, index=pd.RangeIndex(begin, begin + len(typen)))
+
+    def naar_dataframe(self):
+        """Alle verschillen als DataFrame (zoals vergelijk_data vroeger teruggaf)."""
+        if self.empty:
+            return pd.DataFrame()
+        return self.pagina(0, len(self))
+
+    def aantallen(self):
+        """Het aantal verschillen per type."""
+        aantallen = np.bincount(self.typen, minlength=len(TYPEN))
+        return pd.Series(aantallen, index=TYPEN)[aantallen > 0]
+
+    def samenvatting(self):
+        """Per type verschil het aantal en de betrokken kolommen."""
+        samenvatting = []
+        for verschil_type, naam in enumerate(TYPEN):
+            mask = self.typen == verschil_type
+            if not mask.any():
+                continue
+            kolommen = [self.kolommen[i] if i >= 0 else 'Alle kolommen' for i in np.unique(self.kolom_ids[mask])]
+            samenvatting.append({'Type Verschil': naam, 'Aantal': int(mask.sum()),
+                                 'Betrokken Kolommen': ', '.join(sorted(kolommen))})
+        return pd.DataFrame(samenvatting)
+
+    def ongekoppelde_sleutels(self):
+        """
+        De sleutels van de rijen die alleen in A en alleen in B staan, als twee Series
+        met de positie van de rij in de bron als index.
+        """
+        sleutels = []
+        for verschil_type, posities, df in [(ALLEEN_A, self.positie_a, self.df_a), (ALLEEN_B, self.positie_b, self.df_b)]:
+            posities = posities[self.typen == verschil_type]
+            sleutels.append(pd.Series(self._rij(posities, df), index=posities, dtype=object))
+        return tuple(sleutels)
+
+    def naar_csv(self, blok=EXPORT_BLOK):
+        """Exporteer alle verschillen als CSV tekst, blok voor blok opgehaald."""
+        uitvoer = io.StringIO()
+        pd.DataFrame(columns=KOLOMMEN).to_csv(uitvoer, index=False)
+        for begin in range(0, len(self), blok):
+            self.pagina(begin, begin + blok).to_csv(uitvoer, index=False, header=False)
+        return uitvoer.getvalue()
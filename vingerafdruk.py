@@ -0,0 +1,109 @@
+"""
+Vingerafdrukken van kolommen.
+
+Per kolom wordt een volgorde-onafhankelijke hash berekend over de paren (sleutel,
+waarde) van de sleutels die in beide bronnen voorkomen. Kolommen met dezelfde
+vingerafdruk in Bron A en Bron B zijn (op een verwaarloosbare kans op een botsing na)
+gelijk voor alle overeenkomende rijen en hoeven niet samengevoegd en per cel
+vergeleken te worden. Hebben beide bronnen bovendien precies dezelfde sleutels en zijn
+alle kolommen identiek, dan bevatten ze dezelfde rijen en is er helemaal geen merge nodig.
+"""
+import numpy as np
+import pandas as pd
+
+from opslag import is_gecodeerd, vul_leeg
+
+# Constanten voor het mengen van twee 64-bit hashes (splitmix64)
+_GOUDEN_RATIO = np.uint64(0x9E3779B97F4A7C15)
+_MENG_1 = np.uint64(0xBF58476D1CE4E5B9)
+_MENG_2 = np.uint64(0x94D049BB133111EB)
+
+# Een kolom wordt voor het hashen gecategoriseerd als de eerste CATEGORISEER_RIJEN rijen
+# hooguit dit deel verschillende waarden hebben
+CATEGORISEER_RIJEN = 1000
+CATEGORISEER_DREMPEL = 0.5
+
+# Vaste waarde die met de sleutelhash gemengd wordt voor de steekproef, zodat de
+# steekproef onafhankelijk is van de kleinste hashes in de schetsen van de sleutels
+_STEEKPROEF_ZOUT = np.uint64(0x5EED5A3B1E5EED01)
+
+
+def meng(links, rechts):
+    """Combineer twee arrays met 64-bit hashes tot één goed verspreide hash per rij."""
+    with np.errstate(over='ignore'):
+        x = links ^ (rechts * _GOUDEN_RATIO)
+        x ^= x >> np.uint64(30)
+        x *= _MENG_1
+        x ^= x >> np.uint64(27)
+        x *= _MENG_2
+        x ^= x >> np.uint64(31)
+    return x
+
+
+def waarde_hashes(serie):
+    """
+    Hash per rij van een kolom, met '' voor lege waarden (zoals in vergelijk_data). Een
+    kolom met veel verschillende waarden (zoals een sleutel) wordt direct gehasht, zonder
+    eerst te categoriseren; de hashes zijn in beide gevallen gelijk.
+    """
+    serie = vul_leeg(serie) if is_gecodeerd(serie) else serie.fillna('')
+    begin = serie.iloc[:CATEGORISEER_RIJEN]
+    categoriseer = begin.nunique() <= CATEGORISEER_DREMPEL * len(begin)
+    return pd.util.hash_pandas_object(serie, index=False, categorize=categoriseer).to_numpy()
+
+
+def sleutel_hashes(df, key_columns):
+    """Hash per rij van de combinatie van de sleutelkolommen."""
+    hashes = np.zeros(len(df), dtype=np.uint64)
+    for key in key_columns:
+        hashes = meng(hashes, waarde_hashes(df[key]))
+    return hashes
+
+
+def in_steekproef(df, key_columns, fractie):
+    """
+    Masker met de rijen die in de steekproef vallen: de rijen waarvan de hash van de
+    sleutel in het eerste deel `fractie` van het hashbereik ligt. De keuze hangt alleen
+    af van de sleutel, zodat Bron A en Bron B met dezelfde fractie dezelfde sleutels
+    kiezen, ook als ze in blokken gelezen worden. De hashes van de sleutelkolommen worden
+    opgeteld, zodat de volgorde waarin de kolommen gekozen zijn niet uitmaakt.
+    """
+    if fractie >= 1:
+        return np.ones(len(df), dtype=bool)
+    grens = np.uint64(int(fractie * 2 ** 64))
+    hashes = np.zeros(len(df), dtype=np.uint64)
+    with np.errstate(over='ignore'):
+        for key in key_columns:
+            hashes += meng(waarde_hashes(df[key]), _STEEKPROEF_ZOUT)
+    return meng(hashes, _STEEKPROEF_ZOUT) < grens
+
+
+def vingerafdrukken(df_a, df_b, key_columns):
+    """
+    Geef de kolommen waarvan de vingerafdruk in beide bronnen gelijk is, en of beide
+    bronnen precies dezelfde (unieke) sleutels hebben. Alleen rijen met een sleutel die
+    in beide bronnen voorkomt tellen mee. Bij dubbele sleutels vergelijkt de merge alle
+    combinaties; dan wordt er geen kolom overgeslagen.
+    """
+    kolommen = [col for col in df_a.columns if col not in key_columns and col in df_b.columns]
+    if not key_columns:
+        return [], False
+
+    sleutel_a = sleutel_hashes(df_a, key_columns)
+    sleutel_b = sleutel_hashes(df_b, key_columns)
+    if len(np.unique(sleutel_a)) < len(sleutel_a) or len(np.unique(sleutel_b)) < len(sleutel_b):
+        return [], False
+    gedeeld_a = np.isin(sleutel_a, sleutel_b)
+    gedeeld_b = np.isin(sleutel_b, sleutel_a)
+    zelfde_sleutels = bool(gedeeld_a.all() and gedeeld_b.all())
+    sleutel_a = sleutel_a[gedeeld_a]
+    sleutel_b = sleutel_b[gedeeld_b]
+
+    identiek = []
+    for col in kolommen:
+        # De som is onafhankelijk van de volgorde van de rijen
+        vingerafdruk_a = meng(sleutel_a, waarde_hashes(df_a[col])[gedeeld_a]).sum(dtype=np.uint64)
+        vingerafdruk_b = meng(sleutel_b, waarde_hashes(df_b[col])[gedeeld_b]).sum(dtype=np.uint64)
+        if vingerafdruk_a == vingerafdruk_b:
+            identiek.append(col)
+    return identiek, zelfde_sleutels